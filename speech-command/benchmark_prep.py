@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Benchmarks for the stages of the speech-command preprocessing pipeline.
+
+Usage example:
+
+```sh
+python benchmark_prep.py --num_clips 500 --output bench.json
+```
+
+A synthetic corpus of .wav files is generated in a temporary directory, and
+every stage of `prep_wavs.py` is timed separately. The results are printed
+(and optionally written) as JSON, so they can be compared across commits.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from scipy.io import wavfile
+
+import prep_wavs
+import spectrogram
+
+
+def make_corpus(corpus_dir,
+                num_clips,
+                fs,
+                min_clip_len,
+                max_clip_len,
+                seed=0):
+  '''Generate a synthetic corpus of mono int16 .wav files.
+
+  The clips are white noise with random lengths.
+
+  Args:
+    corpus_dir: Directory to write the .wav files to.
+    num_clips: Number of .wav files.
+    fs: Sampling frequency in Hz.
+    min_clip_len: Minimum clip length in number of samples.
+    max_clip_len: Maximum clip length in number of samples (inclusive).
+    seed: Random seed.
+
+  Returns:
+    Paths to the .wav files, as a sorted `list` of `str`s.
+  '''
+  if not os.path.isdir(corpus_dir):
+    os.makedirs(corpus_dir)
+  rng = np.random.RandomState(seed)
+  wav_paths = []
+  for i in range(num_clips):
+    clip_len = rng.randint(min_clip_len, max_clip_len + 1)
+    signal = np.clip(rng.randn(clip_len) * 3000, -32768, 32767)
+    wav_path = os.path.join(corpus_dir, '%.5d.wav' % i)
+    wavfile.write(wav_path, fs, signal.astype(np.int16))
+    wav_paths.append(wav_path)
+  return wav_paths
+
+
+def time_stage(name, fn, inputs, input_bytes, repeats, num_clips=None):
+  '''Time a pipeline stage over a list of inputs.
+
+  Args:
+    name: Name of the stage.
+    fn: Function to call on every input.
+    inputs: A `list` of inputs to `fn`. Each counts as one clip.
+    input_bytes: Total number of bytes in `inputs`, for the MB/s figure.
+    repeats: Number of times to time the stage. The fastest one is reported.
+    num_clips: Number of clips processed by the stage. Defaults to
+      `len(inputs)`.
+
+  Returns:
+    A `dict` of the timing results.
+  '''
+  times = []
+  for _ in range(repeats):
+    t0 = time.time()
+    for item in inputs:
+      fn(item)
+    times.append(time.time() - t0)
+  best_time = min(times)
+  if num_clips is None:
+    num_clips = len(inputs)
+  result = {
+      'stage': name,
+      'num_clips': num_clips,
+      'seconds': best_time,
+      'all_seconds': times,
+      'clips_per_second': num_clips / best_time,
+      'mb_per_second': input_bytes / best_time / 1e6,
+  }
+  print('%-36s %10.1f clips/s %10.2f MB/s' %
+        (name, result['clips_per_second'], result['mb_per_second']))
+  return result
+
+
+def main():
+  work_dir = tempfile.mkdtemp(prefix='benchmark_prep_')
+  try:
+    corpus_dir = os.path.join(work_dir, 'corpus')
+    wav_paths = make_corpus(
+        corpus_dir, FLAGS.num_clips, FLAGS.fs, FLAGS.min_clip_len,
+        FLAGS.max_clip_len, seed=FLAGS.seed)
+    wav_bytes = sum(os.path.getsize(path) for path in wav_paths)
+    np.random.seed(FLAGS.seed)
+
+    results = []
+    results.append(time_stage(
+        'read_as_floats', prep_wavs.read_as_floats,
+        wav_paths, wav_bytes, FLAGS.repeats))
+    results.append(time_stage(
+        'read_and_resample_as_floats',
+        lambda path: prep_wavs.read_and_resample_as_floats(
+            path, FLAGS.target_fs, resample_method=FLAGS.resample_method),
+        wav_paths, wav_bytes, FLAGS.repeats))
+
+    waveforms = [
+        prep_wavs.load_and_normalize_waveform(
+            path, FLAGS.target_fs, FLAGS.frame_size,
+            resample_method=FLAGS.resample_method)
+        for path in wav_paths]
+    short_waveforms = [w for w in waveforms if len(w) < FLAGS.match_len]
+    if short_waveforms:
+      results.append(time_stage(
+          'get_filling_snippet',
+          lambda w: prep_wavs.get_filling_snippet(
+              w, FLAGS.match_len - len(w), 'head'),
+          short_waveforms, sum(w.nbytes for w in short_waveforms),
+          FLAGS.repeats))
+    results.append(time_stage(
+        'waveform_to_spectrogram',
+        lambda w: spectrogram.waveform_to_spectrogram(
+            w, FLAGS.frame_size, FLAGS.n_fft_out),
+        waveforms, sum(w.nbytes for w in waveforms), FLAGS.repeats))
+
+    def convert_dir(num_workers):
+      out_dir = os.path.join(work_dir, 'out')
+      shutil.rmtree(out_dir, ignore_errors=True)
+      pool = None
+      if num_workers > 1:
+        pool = prep_wavs.multiprocessing.Pool(num_workers)
+      try:
+        prep_wavs.convert_wav_files_in_dir(
+            corpus_dir, os.path.join(out_dir, 'train'),
+            FLAGS.recordings_per_subfolder, FLAGS.target_fs,
+            FLAGS.frame_size, FLAGS.n_fft_out, FLAGS.match_len,
+            test_split=FLAGS.test_split,
+            test_output_dir=os.path.join(out_dir, 'test'),
+            pool=pool, chunk_size=FLAGS.chunk_size,
+            resample_method=FLAGS.resample_method)
+      finally:
+        if pool is not None:
+          pool.close()
+          pool.join()
+
+    # convert_wav_files_in_dir() takes the whole directory as one input.
+    for num_workers in sorted(set([1, FLAGS.num_workers])):
+      results.append(time_stage(
+          'convert_wav_files_in_dir[workers=%d]' % num_workers,
+          convert_dir, [num_workers], wav_bytes, FLAGS.repeats,
+          num_clips=len(wav_paths)))
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+  report = {
+      'label': FLAGS.label,
+      'config': vars(FLAGS),
+      'platform': {
+          'python': platform.python_version(),
+          'numpy': np.__version__,
+          'machine': platform.machine(),
+          'cpu_count': prep_wavs.multiprocessing.cpu_count(),
+      },
+      'results': results,
+  }
+  report_json = json.dumps(report, indent=2)
+  if FLAGS.output:
+    with open(FLAGS.output, 'wt') as f:
+      f.write(report_json)
+    print('Wrote results to %s' % FLAGS.output)
+  else:
+    print(report_json)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      'Benchmark the stages of the speech-command preprocessing pipeline '
+      'on a synthetic .wav corpus.')
+  parser.add_argument(
+      '--num_clips', type=int, default=200,
+      help='Number of synthetic .wav files to generate.')
+  parser.add_argument(
+      '--fs', type=int, default=16000,
+      help='Sampling frequency of the synthetic .wav files in Hz.')
+  parser.add_argument(
+      '--min_clip_len', type=int, default=12000,
+      help='Minimum length of the synthetic .wav files in number of samples.')
+  parser.add_argument(
+      '--max_clip_len', type=int, default=16000,
+      help='Maximum length of the synthetic .wav files in number of samples.')
+  parser.add_argument(
+      '--target_fs', type=float, default=44100,
+      help='Target sampling frequency in Hz.')
+  parser.add_argument(
+      '--resample_method', type=str, default='fft',
+      choices=('fft', 'polyphase'),
+      help='Resampling method. See prep_wavs.py.')
+  parser.add_argument(
+      '--frame_size', type=int, default=1024,
+      help='Frame size at target frequency.')
+  parser.add_argument(
+      '--n_fft_out', type=int, default=232,
+      help='Truncation length for each spectrum of the spectrogram.')
+  parser.add_argument(
+      '--match_len', type=int, default=44032,
+      help='Length of the waveforms after splitting and filling.')
+  parser.add_argument(
+      '--test_split', type=float, default=0.15,
+      help='Test split for the end-to-end conversion.')
+  parser.add_argument(
+      '--recordings_per_subfolder', type=int, default=300,
+      help='Passed on to convert_wav_files_in_dir().')
+  parser.add_argument(
+      '--chunk_size', type=int, default=32,
+      help='Chunk size for the end-to-end conversion.')
+  parser.add_argument(
+      '--num_workers', type=int, default=1,
+      help='If > 1, the end-to-end conversion is also timed with this many '
+      'worker processes.')
+  parser.add_argument(
+      '--repeats', type=int, default=3,
+      help='Number of times to time every stage. The fastest time is '
+      'reported.')
+  parser.add_argument(
+      '--seed', type=int, default=0,
+      help='Random seed for the synthetic corpus and the conversion.')
+  parser.add_argument(
+      '--label', type=str, default=None,
+      help='Optional label (e.g., a commit hash) to put in the results.')
+  parser.add_argument(
+      '--output', type=str, default=None,
+      help='Optional path to write the JSON results to. If not specified, '
+      'the results are printed.')
+  FLAGS, _ = parser.parse_known_args()
+
+  main()
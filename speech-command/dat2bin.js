@@ -63,7 +63,8 @@ function processDirectory(inputPath, outputPath, frameSize, numFrames) {
   const items = fs.readdirSync(inputPath);
   for (const item of items) {
     const fullInputPath = path.join(inputPath, item);
-    const fullOutputPath = path.join(outputPath, item);
+    const fullOutputPath =
+        path.join(outputPath, item.replace(/\.dat$/, '.bin'));
     if (fs.lstatSync(fullInputPath).isDirectory()) {
     //   console.log(`Recursive cal: ${fullInputPath} --> ${fullOutputPath}`);  // DEBUG
       processDirectory(fullInputPath, fullOutputPath, frameSize, numFrames);
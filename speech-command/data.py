@@ -3,16 +3,34 @@ from __future__ import division
 from __future__ import print_function
 
 import glob
+import hashlib
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
-import struct
 
 from matplotlib import pyplot as plt
 import numpy as np
 
+import profiling
+import tfjsscds
+
 
 NUM_FRAMES_CUTOFF = 43
 VALID_FRAME_COUNT_RANGE = [5, 50]
 
+# Normalization modes of the spectrograms:
+#   - 'example': every spectrogram by its own mean and standard deviation.
+#   - 'global': all spectrograms by the mean and standard deviation of the
+#     whole dataset.
+#   - 'bin': every frequency bin by its mean and standard deviation over the
+#     whole dataset.
+NORMALIZATION_MODES = ('example', 'global', 'bin')
+
+# Version of the format of the preprocessed-data cache. Must be incremented
+# whenever a change to load_data() would change its output.
+_CACHE_VERSION = 2
+
 
 def sanity_check_spectrogram(spec):
   if np.any(np.isnan(spec)) or np.any(np.isinf(spec)):
@@ -27,13 +45,104 @@ def normalize(spec):
   return (spec - np.mean(spec)) / np.std(spec)
 
 
+def normalize_spectrograms(specs, stats=None):
+  '''Normalize a batch of spectrograms in place.
+
+  Without `stats` ('example' mode), the mean of every spectrogram is
+  computed and subtracted first, and the standard deviation is then computed
+  from the centered values. Apart from the per-spectrogram statistics, no
+  temporaries of the size of `specs` are created.
+
+  Args:
+    specs: float32 numpy array of shape `[N, time_steps, freq_steps]`. It is
+      overwritten with the normalized spectrograms.
+    stats: Optional precomputed statistics from
+      `compute_normalization_stats()`. If `None`, every spectrogram is
+      normalized by its own mean and standard deviation.
+
+  Returns:
+    `specs`.
+  '''
+  if stats is None or stats['mode'] == 'example':
+    specs -= np.mean(specs, axis=(1, 2), keepdims=True)
+    variances = (np.einsum('ijk,ijk->i', specs, specs) /
+                 (specs.shape[1] * specs.shape[2]))
+    specs /= np.sqrt(variances)[:, np.newaxis, np.newaxis]
+  else:
+    specs -= np.asarray(stats['mean'], dtype=specs.dtype)
+    specs /= np.asarray(stats['std'], dtype=specs.dtype)
+  return specs
+
+
+def compute_normalization_stats(spec_blocks, mode):
+  '''Compute the statistics for the 'global' or 'bin' normalization mode.
+
+  The statistics of every block are computed in two passes and merged into
+  the running statistics in float64 (Chan et al.'s parallel algorithm), so
+  the result is numerically safe for any number of blocks.
+
+  Args:
+    spec_blocks: Iterable of numpy arrays of shape
+      `[n, time_steps, freq_steps]` with the unnormalized spectrograms.
+    mode: 'global' or 'bin'. See `NORMALIZATION_MODES`.
+
+  Returns:
+    A JSON-serializable `dict` with the `mode`, `mean` and `std`. For 'bin',
+    `mean` and `std` are `list`s with one value per frequency bin.
+  '''
+  if mode not in ('global', 'bin'):
+    raise ValueError('Invalid normalization mode for statistics: %s' % mode)
+  count = 0
+  mean = 0.0
+  m2 = 0.0
+  for block in spec_blocks:
+    block = block.reshape([-1, block.shape[-1]])
+    if mode == 'global':
+      block = block.reshape([-1, 1])
+    if not len(block):
+      continue
+    block_mean = np.mean(block, axis=0, dtype=np.float64)
+    block_m2 = np.sum(np.square(block - block_mean), axis=0,
+                      dtype=np.float64)
+    delta = block_mean - mean
+    total = count + len(block)
+    mean = mean + delta * (len(block) / total)
+    m2 = m2 + block_m2 + np.square(delta) * (count * len(block) / total)
+    count = total
+  if not count:
+    raise ValueError('Cannot compute normalization statistics without data.')
+  std = np.sqrt(m2 / count)
+  if mode == 'global':
+    return {'mode': mode, 'mean': float(mean[0]), 'std': float(std[0])}
+  return {'mode': mode, 'mean': mean.tolist(), 'std': std.tolist()}
+
+
 def to_one_hot(labels, unique_labels):
   out = np.zeros([len(labels), len(unique_labels)], dtype=np.float32)
-  for i, label in enumerate(labels):
-    out[i, label] = 1.0
+  out[np.arange(len(labels)), np.asarray(labels, dtype=np.int64)] = 1.0
   return out
 
 
+def read_dat(dat_path, frame_size):
+  '''Memory-map a .dat file of float32 spectra.
+
+  The data is not copied or converted. It is read from disk only when it is
+  accessed.
+
+  Args:
+    dat_path: Path to the .dat file.
+    frame_size: Number of float32 values per spectrum (frame).
+
+  Returns:
+    A read-only float32 numpy array of shape `[num_frames, frame_size]`.
+  '''
+  num_frames = os.path.getsize(dat_path) // 4 // frame_size
+  if not num_frames:
+    return np.zeros([0, frame_size], dtype=np.float32)
+  return np.memmap(dat_path, dtype=np.float32, mode='r',
+                   shape=(num_frames, frame_size))
+
+
 def load_spectrograms(dat_path,
                       label,
                       unique_labels,
@@ -52,88 +161,189 @@ def load_spectrograms(dat_path,
       half the sampling frequency.
 
   Returns:
-    A `list` of 2D numpy arrays.
-  '''
-  specs = []
-  spec_lengths = []
-  labels = []
-  with open(dat_path, 'rb') as f:
-    buffer = f.read()
-    buffer_len = len(buffer)
-    num_floats = int(buffer_len / 4)
-
-    data = np.array(struct.unpack('=%df' % num_floats, buffer))
-    data = data.reshape([int(num_floats / n_fft), n_fft]).T
-
-  num_discarded = 0
-  num_kept = 0
-  t = 0
-  while t < data.shape[1]:
-    t_begin = t
-    t_end = t + 1
-    while (t_end < data.shape[1] and
-           (not np.isnan(data[0, t_end]) and not np.isinf(data[0, t_end]) and
-            data[0, t_end] != 0.0)):
-      t_end += 1
-    if t_end >= data.shape[1]:
-      break
-    # print('t_begin = %d, t_end = %d' % (t_begin, t_end))  # DEBUG
-
-    spec = data[:, t_begin : t_end]
-    frame_count = t_end - t_begin
-    if (frame_count < VALID_FRAME_COUNT_RANGE[0] or
-        frame_count > VALID_FRAME_COUNT_RANGE[1]):
-      print('WARNING: Invalid frame count: %d' % frame_count)
-    if not sanity_check_spectrogram(spec):
-      # plt.imshow(np.flipud(spec), interpolation='bilinear', aspect='auto')
-      # plt.show()
-      # print(spec.shape)
-      num_discarded += 1
-    else:
-      spec = spec[:, :NUM_FRAMES_CUTOFF]
-
-      specs.append(normalize(spec))
-      spec_lengths.append(spec.shape[1])
-      labels.append(label)
-      num_kept += 1
-
-    t = t_end + 1
-    while (t < data.shape[1] and
-           (np.isnan(data[0, t]) or np.isinf(data[0, t]) or data[0, t] == 0.0)):
-      t += 1
-    if t >= data.shape[1]:
-      break
+    - `xs`: normalized spectrograms as a float32 numpy array of shape
+      `[num_examples, NUM_FRAMES_CUTOFF, n_fft, 1]`.
+    - `ys`: one-hot encoded labels, of shape `[num_examples, num_classes]`.
+  '''
+  frames, begins = find_kept_spectrograms(dat_path, n_fft)
+  return (np.expand_dims(gather_spectrograms(frames, begins), -1),
+          to_one_hot([label] * len(begins), unique_labels))
+
+
+def find_kept_spectrograms(dat_path, n_fft):
+  '''Find the spectrograms in a .dat file that pass the sanity check.
+
+  The data of the spectrograms is not read, except for the checks.
+
+  Args:
+    dat_path: Path to the .dat file.
+    n_fft: Number of FFT points for each time slice.
+
+  Returns:
+    - The memory-mapped frames of the .dat file. See `read_dat()`.
+    - The begin frame indices of the kept spectrograms, as a numpy array.
+  '''
+  frames = read_dat(dat_path, n_fft)
+  run_begins, run_ends = find_spectrogram_runs(frames[:, 0])
+
+  frame_counts = run_ends - run_begins
+  for frame_count in frame_counts[
+      (frame_counts < VALID_FRAME_COUNT_RANGE[0]) |
+      (frame_counts > VALID_FRAME_COUNT_RANGE[1])]:
+    print('WARNING: Invalid frame count: %d' % frame_count)
+
+  keep = _is_sane_run(frames, run_begins, run_ends)
+  num_kept = int(np.sum(keep))
+  num_discarded = len(keep) - num_kept
   print('  Kept: %d; Discarded: %d' % (num_kept, num_discarded))
-  # print('  Length min: %d, max: %d' % (np.min(spec_lengths), np.max(spec_lengths)))
-  specs = np.expand_dims(np.swapaxes(np.array(specs, dtype=np.float32), 1, 2), -1)
-  return specs, to_one_hot(labels, unique_labels)
+  profiling.count('find_kept_spectrograms', files=1, bytes_read=frames.nbytes,
+                  kept=num_kept, discarded=num_discarded)
+  return frames, run_begins[keep]
 
 
-def load_data(root_dir, n_fft, include_words=None):
-  '''Load data from a directory.
+def find_kept_bin_spectrograms(bin_path, n_fft, unique_labels):
+  '''Find the spectrograms in a TFJSSCDS .bin file that pass the sanity check.
+
+  Only the header of the .bin file is parsed. The data of the spectrograms
+  is not read, except for the checks. See `tfjsscds.py` for the format.
 
   Args:
-    root_dir: Root directory of data. Under the directory, it is assumed
-      that subdirectories with names matching individual words can be found.
-      It is further assumed that in each subdirectory, there are one or more
-      .dat files.
-    n_fft: Number of FFT points for each time slice. This corresponds to
-      half the sampling frequency.
-    include_words: Optional word list as a `list` of `str`. Use only these words.
+    bin_path: Path to the .bin file.
+    n_fft: Number of FFT points for each time slice. Must match the frame
+      size of the spectrograms in the file.
+    unique_labels: All unique labels in the entire dataset. Examples with
+      other labels are discarded silently.
 
   Returns:
-    - Unique word labels as a `list` of `str`s.
-    - `xs`: numpy array for the input features, of shape
-      `[num_examples, time_steps, freq_steps, 1]`.
-    - `ys`: numpy array for the one-hot encoded labels, of shape
-      `[numExamples, num_classes]`.
+    - The frames of the .bin file, as a float32 numpy array of shape
+      `[num_frames, n_fft]`. Memory-mapped, unless the file contains raw
+      audio that breaks the alignment of the frames.
+    - The begin frame indices of the kept spectrograms, as a numpy array.
+    - The label indices of the kept spectrograms, as an int32 numpy array.
+
+  Raises:
+    ValueError: If the frame size of a spectrogram does not match `n_fft`.
   '''
-  xs = None
-  ys = None
+  manifest, data, offsets = tfjsscds.read_bin(bin_path)
+  for spec in manifest:
+    if spec['spectrogramFrameSize'] != n_fft:
+      raise ValueError(
+          'Expected frame size %d, but got %d in %s' %
+          (n_fft, spec['spectrogramFrameSize'], bin_path))
+  word_indices = dict((word, i) for i, word in enumerate(unique_labels))
+  labels = np.array([word_indices.get(spec['label'], -1)
+                     for spec in manifest], dtype=np.int32)
+  frame_counts = np.array([spec['spectrogramNumFrames'] for spec in manifest],
+                          dtype=np.int64)
+
+  if len(data) % n_fft == 0 and np.all(offsets % n_fft == 0):
+    frames = data.reshape([-1, n_fft])
+    begins = offsets // n_fft
+  else:
+    # Raw audio between the spectrograms: copy the spectrograms.
+    frames = np.concatenate([np.zeros([0, n_fft], dtype=np.float32)] + [
+        data[offset : offset + frame_count * n_fft].reshape([-1, n_fft])
+        for offset, frame_count in zip(offsets, frame_counts)])
+    begins = np.concatenate(
+        [[0], np.cumsum(frame_counts)[:-1]]).astype(np.int64)
+
+  included = labels >= 0
+  keep = included & _is_sane_run(frames, begins, begins + frame_counts)
+  num_kept = int(np.sum(keep))
+  num_discarded = int(np.sum(included)) - num_kept
+  print('  Kept: %d; Discarded: %d' % (num_kept, num_discarded))
+  profiling.count('find_kept_spectrograms', files=1, bytes_read=data.nbytes,
+                  kept=num_kept, discarded=num_discarded)
+  return frames, begins[keep], labels[keep]
+
+
+def _is_sane_run(frames, begins, ends):
+  '''Apply the criteria of sanity_check_spectrogram() to runs of frames.
+
+  Args:
+    frames: Frames as a float32 numpy array of shape `[num_frames, n_fft]`.
+    begins: Begin frame indices (inclusive) of the runs.
+    ends: End frame indices (exclusive) of the runs.
+
+  Returns:
+    A bool numpy array: whether every run is long enough and free of NaNs
+    and infinities.
+  '''
+  num_bad_frames = np.concatenate(
+      [[0], np.cumsum(~np.all(np.isfinite(frames), axis=1))])
+  return ((ends - begins >= NUM_FRAMES_CUTOFF) &
+          (num_bad_frames[ends] == num_bad_frames[begins]))
+
 
-  unique_labels = sorted([
-      os.path.basename(path) for path in glob.glob(os.path.join(root_dir, '*'))
-      if os.path.isdir(path)])
+def gather_spectrograms(frames, begins, normalize=True, stats=None):
+  '''Gather and normalize spectrograms from the frames of a .dat file.
+
+  Args:
+    frames: Frames of a .dat file, as returned by `read_dat()`.
+    begins: Begin frame indices of the spectrograms.
+    normalize: Whether to normalize the spectrograms.
+    stats: Optional normalization statistics. See
+      `normalize_spectrograms()`.
+
+  Returns:
+    Normalized spectrograms as a float32 numpy array of shape
+    `[len(begins), NUM_FRAMES_CUTOFF, n_fft]`.
+  '''
+  specs = frames[np.asarray(begins)[:, np.newaxis] +
+                 np.arange(NUM_FRAMES_CUTOFF)]
+  specs = np.asarray(specs, dtype=np.float32)
+  if not normalize:
+    return specs
+  return normalize_spectrograms(specs, stats)
+
+
+def find_spectrogram_runs(first_bins):
+  '''Find the spectrograms in a combined .dat file.
+
+  In a combined .dat file, the spectrograms are separated by one or more
+  frames whose first frequency bin is NaN, infinite or zero. A trailing
+  spectrogram without a separator after it is incomplete and is ignored.
+
+  Args:
+    first_bins: The first frequency bin of every frame, as a 1D numpy array.
+
+  Returns:
+    Two int numpy arrays: the begin (inclusive) and end (exclusive) frame
+    indices of every spectrogram.
+  '''
+  is_separator = ~np.isfinite(first_bins) | (first_bins == 0.0)
+  separators = np.flatnonzero(is_separator)
+  # The first spectrogram begins at frame 0, even if that is a separator.
+  # Every other spectrogram begins at the first frame after a separator.
+  begins = np.flatnonzero(is_separator[:-1] & ~is_separator[1:]) + 1
+  begins = np.concatenate([[0], begins[begins > 1]]).astype(np.int64)
+  # A spectrogram ends at the first separator after its begin frame.
+  end_indices = np.searchsorted(separators, begins, side='right')
+  complete = end_indices < len(separators)
+  return begins[complete], separators[end_indices[complete]]
+
+
+def _list_data_files(root_dir, include_words=None):
+  '''List the labels and data files of a data directory.
+
+  See `load_dataset()` for the arguments.
+
+  Returns:
+    - Unique word labels as a `list` of `str`s.
+    - A `list` of (label index, data file path) tuples. The label index is
+      `None` for .bin files, whose labels are in their manifests.
+  '''
+  bin_paths = sorted(glob.glob(os.path.join(root_dir, '*.bin')) +
+                     glob.glob(os.path.join(root_dir, '*', '*.bin')))
+  if bin_paths:
+    unique_labels = sorted(set(
+        spec['label'] for bin_path in bin_paths
+        for spec in tfjsscds.read_manifest(bin_path)[0]))
+  else:
+    unique_labels = sorted([
+        os.path.basename(path)
+        for path in glob.glob(os.path.join(root_dir, '*'))
+        if os.path.isdir(path)])
 
   if include_words:
     # Make sure that all the specified elements of include_words are available
@@ -148,32 +358,400 @@ def load_data(root_dir, n_fft, include_words=None):
     if '_unknown_' in unique_labels:
       filtered_labels.append('_unknown_')
     unique_labels = filtered_labels
-  print('Unique labels (count = %d) = %s' %
-        (len(unique_labels), unique_labels))
 
+  if bin_paths:
+    return unique_labels, [(None, bin_path) for bin_path in bin_paths]
+  dat_files = []
   for i, label in enumerate(unique_labels):
     label_dir = os.path.join(root_dir, label)
-    dat_paths = sorted(glob.glob(os.path.join(label_dir, '*.dat')))
-    for dat_path in dat_paths:
-      print('Loading spectrograms from %s' % dat_path)
-      file_xs, file_ys = load_spectrograms(dat_path, i, unique_labels, n_fft)
-      assert(file_xs.shape[0] == file_ys.shape[0])
-      if xs is None:
-        xs = file_xs
-        ys = file_ys
-      else:
-        xs = np.concatenate([xs, file_xs], 0)
-        ys = np.concatenate([ys, file_ys], 0)
-      # plt.imshow(spec, interpolation='bilinear', aspect='auto')
-      # plt.show()
-  print('xs.shape = %s' % (xs.shape,))
+    for dat_path in sorted(glob.glob(os.path.join(label_dir, '*.dat'))):
+      dat_files.append((i, dat_path))
+  return unique_labels, dat_files
+
+
+def _find_kept_in_data_file(data_file, n_fft, unique_labels):
+  '''Find the kept spectrograms in a .dat or .bin file.
+
+  Args:
+    data_file: A (label index, data file path) tuple from
+      `_list_data_files()`.
+    n_fft: Number of FFT points for each time slice.
+    unique_labels: All unique labels in the entire dataset.
+
+  Returns:
+    - The frames of the file.
+    - The begin frame indices of the kept spectrograms, as a numpy array.
+    - The label indices of the kept spectrograms, as an int32 numpy array.
+  '''
+  label, path = data_file
+  if label is None:
+    return find_kept_bin_spectrograms(path, n_fft, unique_labels)
+  frames, begins = find_kept_spectrograms(path, n_fft)
+  return frames, begins, np.full([len(begins)], label, dtype=np.int32)
+
+
+class SpectrogramIndex(object):
+  '''Index of the spectrograms in a data directory, for lazy loading.
+
+  Only the checks of `find_kept_spectrograms()` read the .dat (or .bin)
+  files when the index is built. The spectrograms themselves are read from
+  the memory-mapped files by `gather()`, when they are needed.
+
+  Attributes:
+    words: Unique word labels as a `list` of `str`s.
+    labels: Label index of every spectrogram, as an int32 numpy array.
+    normalization: The normalization of the spectrograms, as a
+      JSON-serializable `dict`. See `SpectrogramDataset`.
+  '''
+
+  def __init__(self, root_dir, n_fft, include_words=None, num_workers=None,
+               normalization='example', block_size=1024):
+    '''Constructor of SpectrogramIndex.
+
+    See `load_dataset()` for the arguments. For the 'global' and 'bin'
+    normalization modes, all the spectrograms are read once, `block_size`
+    at a time, to compute the statistics. `normalization` may also be a
+    normalization `dict` as in metadata.json, whose statistics are then
+    used as they are, e.g., to evaluate a model on the test split.
+    '''
+    self.words, data_files = _list_data_files(root_dir, include_words)
+    print('Unique labels (count = %d) = %s' %
+          (len(self.words), self.words))
+    self._n_fft = n_fft
+
+    pool = ThreadPool(num_workers or multiprocessing.cpu_count())
+    try:
+      kept = pool.map(
+          lambda data_file: _find_kept_in_data_file(
+              data_file, n_fft, self.words),
+          data_files)
+    finally:
+      pool.close()
+      pool.join()
+
+    self._frames = [frames for frames, _, _ in kept]
+    self._begins = np.concatenate(
+        [np.zeros([0], dtype=np.int64)] + [begins for _, begins, _ in kept])
+    self._file_indices = np.concatenate([np.zeros([0], dtype=np.int32)] + [
+        np.full([len(begins)], k, dtype=np.int32)
+        for k, (_, begins, _) in enumerate(kept)])
+    self.labels = np.concatenate(
+        [np.zeros([0], dtype=np.int32)] + [labels for _, _, labels in kept])
+    print('Indexed %d spectrograms' % len(self.labels))
+
+    if isinstance(normalization, dict):
+      self.normalization = normalization
+    elif normalization == 'example':
+      self.normalization = {'mode': normalization}
+    else:
+      self.normalization = compute_normalization_stats(
+          (self._gather(np.arange(i, min(i + block_size, len(self))),
+                        normalize=False)
+           for i in range(0, len(self), block_size)),
+          normalization)
+
+  def __len__(self):
+    return len(self.labels)
+
+  def gather(self, indices):
+    '''Read and normalize spectrograms.
+
+    Args:
+      indices: Indices of the spectrograms, as an int numpy array.
+
+    Returns:
+      float32 numpy array of shape
+      `[len(indices), NUM_FRAMES_CUTOFF, n_fft, 1]`.
+    '''
+    return self._gather(indices)[..., np.newaxis]
+
+  def _gather(self, indices, normalize=True):
+    indices = np.asarray(indices)
+    out = np.empty([len(indices), NUM_FRAMES_CUTOFF, self._n_fft],
+                   dtype=np.float32)
+    file_indices = self._file_indices[indices]
+    for k in np.unique(file_indices):
+      in_file = file_indices == k
+      out[in_file] = gather_spectrograms(
+          self._frames[k], self._begins[indices[in_file]],
+          normalize=normalize, stats=self.normalization if normalize else None)
+    return out
+
+
+def _get_cache_path(cache_dir, root_dir, n_fft, include_words, data_files,
+                    dtype, normalization):
+  '''Get the path to the cache entry of a preprocessed dataset.
+
+  The cache key covers everything that affects the output of `load_data()`:
+  the data directory, `n_fft`, `include_words`, `NUM_FRAMES_CUTOFF`, the
+  storage dtype, the normalization mode and the sizes and modification times
+  of the source .dat (or .bin) files.
+  '''
+  key_items = {
+      'version': _CACHE_VERSION,
+      'root_dir': os.path.abspath(root_dir),
+      'n_fft': n_fft,
+      'include_words': include_words,
+      'num_frames_cutoff': NUM_FRAMES_CUTOFF,
+      'dtype': np.dtype(dtype).name,
+      'normalization': normalization,
+      'files': [(path, os.path.getsize(path),
+                 os.path.getmtime(path)) for _, path in data_files],
+  }
+  key = hashlib.sha1(
+      json.dumps(key_items, sort_keys=True).encode('utf-8')).hexdigest()
+  return os.path.join(cache_dir, key)
+
+
+def _read_cache(cache_path):
+  '''Read a preprocessed dataset from the cache, memory-mapping xs.
+
+  Returns:
+    `(unique_labels, xs, labels, normalization)` or `None` if the cache entry
+    is missing.
+  '''
+  manifest_path = os.path.join(cache_path, 'manifest.json')
+  if not os.path.isfile(manifest_path):
+    return None
+  with open(manifest_path, 'rt') as f:
+    manifest = json.load(f)
+  xs = np.load(os.path.join(cache_path, 'xs.npy'), mmap_mode='r')
+  labels = np.load(os.path.join(cache_path, 'labels.npy'))
+  return manifest['words'], xs, labels, manifest['normalization']
+
+
+def _write_cache(cache_path, unique_labels, xs, labels, normalization):
+  '''Write a preprocessed dataset to the cache.
+
+  The manifest is written last, so an interrupted write is never read back.
+  '''
+  if not os.path.isdir(cache_path):
+    os.makedirs(cache_path)
+  np.save(os.path.join(cache_path, 'xs.npy'), xs)
+  np.save(os.path.join(cache_path, 'labels.npy'), labels)
+  with open(os.path.join(cache_path, 'manifest.json'), 'wt') as f:
+    json.dump({'words': unique_labels,
+               'normalization': normalization,
+               'xs_shape': list(xs.shape),
+               'num_examples': len(labels)}, f)
+
+
+class SpectrogramDataset(object):
+  '''A compact in-memory dataset of spectrograms and integer labels.
+
+  Attributes:
+    words: Unique word labels as a `list` of `str`s.
+    xs: Spectrograms as a contiguous numpy array of shape
+      `[num_examples, time_steps, freq_steps, 1]`, of dtype float32 or
+      float16. May be memory-mapped.
+    labels: Label index of every example, as an int32 numpy array.
+    label_indices: For every label, the indices of its examples, as a
+      `list` of int numpy arrays.
+    normalization: The normalization of `xs`, as a JSON-serializable
+      `dict`: `{'mode': 'example'}`, or the statistics from
+      `compute_normalization_stats()` for the 'global' and 'bin' modes. The
+      same normalization must be applied to the inputs at inference time.
+  '''
+
+  def __init__(self, words, xs, labels, normalization=None):
+    '''Constructor of SpectrogramDataset.
+
+    Args:
+      words: Unique word labels as a `list` of `str`s.
+      xs: Spectrograms as a numpy array.
+      labels: Label indices as an int numpy array.
+      normalization: The normalization of `xs`. Defaults to
+        `{'mode': 'example'}`.
+    '''
+    self.words = words
+    self.xs = np.ascontiguousarray(xs)
+    self.labels = np.asarray(labels, dtype=np.int32)
+    self.normalization = normalization or {'mode': 'example'}
+    self.label_indices = [
+        np.flatnonzero(self.labels == i) for i in range(len(words))]
+
+  def __len__(self):
+    return len(self.labels)
+
+  def one_hot(self):
+    '''Get the one-hot encoded labels, of shape `[num_examples, num_words]`.'''
+    return to_one_hot(self.labels, self.words)
+
+  def sample_balanced(self, num_examples, random_state=None):
+    '''Sample example indices with all labels equally likely.
+
+    Args:
+      num_examples: Number of example indices to sample.
+      random_state: Optional `numpy.random.RandomState`. If `None`, the
+        global numpy random state is used.
+
+    Returns:
+      An int numpy array of `num_examples` example indices.
+    '''
+    rng = np.random if random_state is None else random_state
+    nonempty = [indices for indices in self.label_indices if len(indices)]
+    sampled_labels = rng.randint(0, len(nonempty), num_examples)
+    out = np.empty([num_examples], dtype=np.int64)
+    for i, indices in enumerate(nonempty):
+      is_label = sampled_labels == i
+      out[is_label] = indices[
+          rng.randint(0, len(indices), int(np.sum(is_label)))]
+    return out
+
+
+def load_data(root_dir, n_fft, include_words=None, num_workers=None,
+              cache_dir=None):
+  '''Load data from a directory.
+
+  See `load_dataset()` for the arguments.
+
+  Returns:
+    - Unique word labels as a `list` of `str`s.
+    - `xs`: numpy array for the input features, of shape
+      `[num_examples, time_steps, freq_steps, 1]`.
+    - `ys`: numpy array for the one-hot encoded labels, of shape
+      `[numExamples, num_classes]`.
+  '''
+  dataset = load_dataset(root_dir, n_fft, include_words=include_words,
+                         num_workers=num_workers, cache_dir=cache_dir)
+  ys = dataset.one_hot()
   print('ys.shape = %s' % (ys.shape,))
+  return dataset.words, dataset.xs, ys
+
+
+def load_dataset(root_dir, n_fft, include_words=None, num_workers=None,
+                 cache_dir=None, dtype=np.float32, normalization='example',
+                 block_size=1024):
+  '''Load data from a directory as a `SpectrogramDataset`.
+
+  The data files are loaded concurrently in a thread pool, in two passes.
+  The first pass finds the spectrograms to keep in every file. The second
+  pass gathers them straight into their shuffled positions in a single
+  preallocated array.
+
+  Args:
+    root_dir: Root directory of data. Under the directory, it is assumed
+      that subdirectories with names matching individual words can be found.
+      It is further assumed that in each subdirectory, there are one or more
+      .dat files. Alternatively, the directory may contain TFJSSCDS .bin
+      files, directly or in subdirectories, as written by `dat2bin.js`,
+      `puppeteer-convert.js` or `tfjsscds.write_bin()`. The labels are then
+      taken from the .bin files.
+    n_fft: Number of FFT points for each time slice. This corresponds to
+      half the sampling frequency.
+    include_words: Optional word list as a `list` of `str`. Use only these words.
+    num_workers: Number of threads for loading the data files. Defaults to
+      the number of CPUs.
+    cache_dir: Optional directory for caching the preprocessed data. If the
+      same data (same `root_dir`, `n_fft`, `include_words`, `dtype` and
+      unmodified data files) has been loaded with the same `cache_dir`
+      before, `xs` is memory-mapped from the cache instead, and has the same
+      (shuffled) order as when it was first loaded.
+    dtype: Storage dtype of the spectrograms, `np.float32` or `np.float16`.
+      float16 halves the memory footprint of the dataset.
+    normalization: Normalization mode of the spectrograms. One of
+      `NORMALIZATION_MODES`. For 'global' and 'bin' with float32 storage,
+      the spectrograms are first loaded unnormalized, and then normalized in
+      place, `block_size` at a time, once the statistics are computed. With
+      float16 storage, the statistics are computed in a first pass over the
+      data files, and the spectrograms are normalized in float32 before they
+      are stored.
+    block_size: Number of spectrograms per block for the 'global' and 'bin'
+      normalization modes.
+
+  Returns:
+    A `SpectrogramDataset`.
+  '''
+  if normalization not in NORMALIZATION_MODES:
+    raise ValueError('Invalid normalization mode: %s' % normalization)
+  unique_labels, data_files = _list_data_files(root_dir, include_words)
+  print('Unique labels (count = %d) = %s' %
+        (len(unique_labels), unique_labels))
+
+  if cache_dir:
+    cache_path = _get_cache_path(
+        cache_dir, root_dir, n_fft, include_words, data_files, dtype,
+        normalization)
+    with profiling.stage('load_dataset/read_cache'):
+      cached = _read_cache(cache_path)
+    if cached is not None:
+      print('Loaded preprocessed data from cache: %s' % cache_path)
+      return SpectrogramDataset(*cached)
 
-  # Randomly shuffle the data.
-  num_examples = xs.shape[0]
-  order = np.array(range(num_examples), dtype=np.int32)
-  np.random.shuffle(order)
+  def find_kept(data_file):
+    print('Loading spectrograms from %s' % data_file[1])
+    with profiling.stage('find_kept_spectrograms'):
+      return _find_kept_in_data_file(data_file, n_fft, unique_labels)
 
-  xs = xs[order, :,  :]
-  ys = ys[order, :]
-  return unique_labels, xs, ys
+  pool = ThreadPool(num_workers or multiprocessing.cpu_count())
+  try:
+    kept = pool.map(find_kept, data_files)
+    file_offsets = np.cumsum([0] + [len(begins) for _, begins, _ in kept])
+    num_examples = int(file_offsets[-1])
+
+    # Randomly shuffle the data, by writing every example directly into its
+    # shuffled position.
+    order = np.array(range(num_examples), dtype=np.int32)
+    np.random.shuffle(order)
+    positions = np.empty_like(order)
+    positions[order] = np.arange(num_examples, dtype=np.int32)
+
+    xs = np.empty([num_examples, NUM_FRAMES_CUTOFF, n_fft, 1], dtype=dtype)
+    labels = np.empty([num_examples], dtype=np.int32)
+
+    stats = None
+    if normalization == 'example':
+      stats = {'mode': normalization}
+    elif xs.dtype != np.float32:
+      # The statistics are computed from, and applied to, the float32
+      # spectrograms read from the data files, so that only the normalized
+      # values are rounded to the storage dtype.
+      with profiling.stage('load_dataset/normalization_stats'):
+        stats = compute_normalization_stats(
+            (gather_spectrograms(frames, begins[i : i + block_size],
+                                 normalize=False)
+             for frames, begins, _ in kept
+             for i in range(0, len(begins), block_size)),
+            normalization)
+
+    def gather(k):
+      frames, begins, file_labels = kept[k]
+      file_positions = positions[file_offsets[k] : file_offsets[k + 1]]
+      xs[file_positions, :, :, 0] = gather_spectrograms(
+          frames, begins, normalize=(stats is not None), stats=stats)
+      labels[file_positions] = file_labels
+
+    with profiling.stage('load_dataset/gather'):
+      pool.map(gather, range(len(data_files)))
+    profiling.count('load_dataset/gather', clips=num_examples,
+                    xs_bytes=xs.nbytes)
+
+    if stats is None:
+      # float32 'global' or 'bin': normalize the gathered spectrograms in
+      # place, without reading the data files again.
+      block_begins = range(0, num_examples, block_size)
+      with profiling.stage('load_dataset/normalization_stats'):
+        stats = compute_normalization_stats(
+            (xs[i : i + block_size, :, :, 0] for i in block_begins),
+            normalization)
+
+      def normalize_block(i):
+        normalize_spectrograms(xs[i : i + block_size, :, :, 0], stats)
+
+      with profiling.stage('load_dataset/normalize'):
+        pool.map(normalize_block, block_begins)
+    if normalization != 'example':
+      print('Normalization statistics (%s): mean = %s; std = %s' %
+            (normalization, np.mean(stats['mean']), np.mean(stats['std'])))
+  finally:
+    pool.close()
+    pool.join()
+
+  if cache_dir:
+    with profiling.stage('load_dataset/write_cache'):
+      _write_cache(cache_path, unique_labels, xs, labels, stats)
+    profiling.count('load_dataset/write_cache', bytes_written=xs.nbytes)
+    print('Wrote preprocessed data to cache: %s' % cache_path)
+
+  print('xs.shape = %s' % (xs.shape,))
+  return SpectrogramDataset(unique_labels, xs, labels, stats)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Export a model of model.py to TensorFlow.js, with quantized weights.
+
+The model is written in the layers format of the TensorFlow.js converter: a
+model.json with the Keras topology and the weights manifest, and the weights
+in shards of at most 4 MB. With `--quantization`, the weights are stored with
+post-training quantization, which `tf.loadModel()` dequantizes to float32:
+
+  - `uint8` (or `uint16`): affine quantization of every weight tensor, with
+    a scale and a minimum such that 0 is exactly representable. This makes
+    the weights 4 (or 2) times smaller.
+  - `float16`: half-precision floats, 2 times smaller. This needs
+    TensorFlow.js 2.1 or later.
+
+Usage example:
+
+```sh
+python export_tfjs.py speech_command_browser.h5 path/to/tfjs_model \
+    --quantization uint8
+```
+
+The quantized model can be run in NumPy with
+`numpy_model.load_tfjs_model()`, e.g., to check its accuracy with
+`model_report.py`.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+
+import numpy as np
+
+import numpy_model
+
+
+QUANTIZATIONS = ('float32', 'float16', 'uint16', 'uint8')
+SHARD_SIZE_BYTES = 4 * 1024 * 1024
+
+
+def quantize_weight(weight, quantization):
+  '''Quantize a weight tensor like the TensorFlow.js converter.
+
+  Args:
+    weight: float32 numpy array.
+    quantization: One of `QUANTIZATIONS`.
+
+  Returns:
+    - The quantized values, as a little-endian numpy array.
+    - The `quantization` entry of the weights manifest, or `None` for
+      'float32'.
+  '''
+  if quantization == 'float32':
+    return weight.astype('<f4'), None
+  if quantization == 'float16':
+    return weight.astype('<f2'), {'dtype': 'float16'}
+  dtype = np.dtype(quantization).newbyteorder('<')
+  quant_max = np.iinfo(dtype).max
+  # The range includes 0, so that zeros (e.g., biases) stay exact.
+  w_min = min(float(np.min(weight)), 0.0)
+  w_max = max(float(np.max(weight)), 0.0)
+  if w_min == w_max:
+    scale = 1.0
+    zero_point = 0
+  else:
+    scale = (w_max - w_min) / quant_max
+    zero_point = int(round(-w_min / scale))
+  q_min = -zero_point * scale
+  quantized = np.round((weight - q_min) / scale)
+  quantized = np.clip(quantized, 0, quant_max).astype(dtype)
+  return quantized, {'dtype': quantization, 'scale': scale, 'min': q_min}
+
+
+def export_tfjs(h5_path, out_dir, quantization='float32',
+                shard_size_bytes=SHARD_SIZE_BYTES):
+  '''Export a model saved by `keras.Model.save()` for TensorFlow.js.
+
+  Args:
+    h5_path: Path to the HDF5 file (e.g., speech_command_browser.h5).
+    out_dir: Output directory for model.json and the weight files.
+    quantization: One of `QUANTIZATIONS`.
+    shard_size_bytes: Maximum size of a weight file.
+
+  Returns:
+    Total size of the written files in bytes.
+  '''
+  if quantization not in QUANTIZATIONS:
+    raise ValueError('Invalid quantization: %s' % quantization)
+  attrs, weights = numpy_model.read_h5(h5_path)
+
+  manifest_weights = []
+  buffers = []
+  for layer_name, layer_weights in weights.items():
+    for key, weight in layer_weights.items():
+      values, quantization_info = quantize_weight(weight, quantization)
+      spec = collections.OrderedDict([
+          ('name', '%s/%s' % (layer_name, key)),
+          ('shape', list(weight.shape)),
+          ('dtype', 'float32'),
+      ])
+      if quantization_info:
+        spec['quantization'] = quantization_info
+      manifest_weights.append(spec)
+      buffers.append(values.tobytes())
+  weight_bytes = b''.join(buffers)
+  num_shards = max(1, -(-len(weight_bytes) // shard_size_bytes))
+  paths = ['group1-shard%dof%d.bin' % (i + 1, num_shards)
+           for i in range(num_shards)]
+
+  topology = collections.OrderedDict([
+      ('keras_version', attrs.get('keras_version')),
+      ('backend', attrs.get('backend')),
+      ('model_config', attrs['model_config']),
+  ])
+  if 'training_config' in attrs:
+    topology['training_config'] = attrs['training_config']
+  model_json = collections.OrderedDict([
+      ('format', 'layers-model'),
+      ('generatedBy', 'keras v%s' % attrs.get('keras_version')),
+      ('convertedBy', 'export_tfjs.py'),
+      ('modelTopology', topology),
+      ('weightsManifest', [{'paths': paths, 'weights': manifest_weights}]),
+  ])
+
+  if not os.path.isdir(out_dir):
+    os.makedirs(out_dir)
+  total_bytes = 0
+  for i, path in enumerate(paths):
+    shard = weight_bytes[i * shard_size_bytes : (i + 1) * shard_size_bytes]
+    with open(os.path.join(out_dir, path), 'wb') as f:
+      f.write(shard)
+    total_bytes += len(shard)
+  model_json_bytes = json.dumps(model_json).encode('utf-8')
+  with open(os.path.join(out_dir, 'model.json'), 'wb') as f:
+    f.write(model_json_bytes)
+  return total_bytes + len(model_json_bytes)
+
+
+def main():
+  total_bytes = export_tfjs(FLAGS.h5_path, FLAGS.out_dir,
+                            quantization=FLAGS.quantization)
+  print('Wrote %s model to %s: %d bytes' %
+        (FLAGS.quantization, FLAGS.out_dir, total_bytes))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      'Export a model of model.py to TensorFlow.js, with quantized weights.')
+  parser.add_argument(
+      'h5_path', type=str,
+      help='Path to the model saved by model.py (speech_command_browser.h5).')
+  parser.add_argument(
+      'out_dir', type=str,
+      help='Output directory for model.json and the weight files.')
+  parser.add_argument(
+      '--quantization', type=str, default='float32', choices=QUANTIZATIONS,
+      help='Storage dtype of the weights. uint8 and uint16 are affine '
+      'quantizations of every weight tensor.')
+  FLAGS, _ = parser.parse_known_args()
+
+  main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Run a model trained by model.py on .wav files.
+
+Usage example:
+
+```sh
+python infer.py path/to/wavs --output predictions.csv
+```
+
+The model (`speech_command_browser.h5`) and its `metadata.json` are read from
+the current directory by default, where `model.py` writes them. Every .wav
+file goes through the same steps as the training data: resampling to
+`--target_fs`, truncation or filling to `data.NUM_FRAMES_CUTOFF` frames, the
+spectrogram and the normalization recorded in `metadata.json`. The
+predictions are written as CSV, with the top word and the probability of
+every word.
+
+With `--engine numpy`, the model runs in NumPy (see `numpy_model.py`), and
+Keras and TensorFlow are not imported at all.
+
+With `--benchmark`, the predictions are not written. Instead, the pipeline is
+timed for every batch size in `--batch_sizes`, and the per-batch latency
+percentiles of every stage and the throughput in clips/s are reported as
+JSON.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import glob
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+import data
+import numpy_model
+import prep_wavs
+import spectrogram
+
+
+STAGES = ('read_and_resample', 'spectrogram', 'normalize', 'predict')
+ENGINES = ('keras', 'numpy')
+
+
+def load_model(model_path, metadata_path, engine='keras'):
+  '''Load a model saved by `model.train_model()` and its metadata.
+
+  Args:
+    model_path: Path to the model (e.g., speech_command_browser.h5).
+    metadata_path: Path to the metadata.json of the model.
+    engine: 'keras', or 'numpy' for a `numpy_model.NumpyModel`. Keras is
+      imported only for 'keras'.
+
+  Returns:
+    - The model, with a Keras-like `predict()` method.
+    - The metadata `dict`, with `normalization` defaulting to
+      `{'mode': 'example'}` for models saved before it was recorded.
+  '''
+  if engine == 'numpy':
+    model = numpy_model.load_model(model_path)
+  else:
+    # Imported here so that the NumPy engine does not pay for importing
+    # Keras and TensorFlow.
+    import keras
+    model = keras.models.load_model(model_path)
+  with open(metadata_path, 'rt') as f:
+    metadata = json.load(f)
+  metadata.setdefault('normalization', {'mode': 'example'})
+  return model, metadata
+
+
+def load_waveforms(wav_paths, target_fs, match_len, seed=0,
+                   resample_method='fft'):
+  '''Load .wav files as waveforms of `match_len` samples.
+
+  Longer waveforms are truncated. Shorter ones are filled as in
+  `prep_wavs.load_and_split_waveform()`, with the same seed for every file,
+  so that the predictions do not depend on the batching.
+
+  Returns:
+    A float32 numpy array of shape `[len(wav_paths), match_len]`.
+  '''
+  out = np.empty([len(wav_paths), match_len], dtype=np.float32)
+  short_indices = []
+  short_waveforms = []
+  for i, wav_path in enumerate(wav_paths):
+    waveform = prep_wavs.read_and_resample_as_floats(
+        wav_path, target_fs, resample_method=resample_method)
+    if len(waveform) >= match_len:
+      out[i] = waveform[:match_len]
+    else:
+      short_indices.append(i)
+      short_waveforms.append(waveform)
+  if short_waveforms:
+    out[short_indices] = prep_wavs.fill_waveforms(
+        short_waveforms, match_len,
+        [np.random.RandomState(seed) for _ in short_waveforms])
+  return out
+
+
+def predict_batch(model, metadata, wav_paths, frame_size, target_fs,
+                  resample_method='fft', timings=None):
+  '''Predict the probabilities of the words for a batch of .wav files.
+
+  Args:
+    model: The model. See `load_model()`.
+    metadata: The metadata `dict` of the model.
+    wav_paths: Paths to the .wav files.
+    frame_size: Hop size of the spectrogram in number of samples, as in
+      prep_wavs.py.
+    target_fs: Sampling frequency of the training data in Hz.
+    resample_method: Resampling method. See `prep_wavs.resample_waveforms()`.
+    timings: Optional `dict` mapping the names in `STAGES` to `list`s. The
+      wall time of every stage of this batch is appended to them.
+
+  Returns:
+    A float32 numpy array of shape `[len(wav_paths), num_words]`.
+  '''
+  n_fft = metadata['frameSize']
+  t0 = time.time()
+  waveforms = load_waveforms(
+      wav_paths, target_fs, data.NUM_FRAMES_CUTOFF * frame_size,
+      resample_method=resample_method)
+  t1 = time.time()
+  specs = spectrogram.waveforms_to_spectrograms(waveforms, frame_size, n_fft)
+  t2 = time.time()
+  data.normalize_spectrograms(specs, metadata['normalization'])
+  t3 = time.time()
+  probs = model.predict(specs[..., np.newaxis], batch_size=len(wav_paths))
+  t4 = time.time()
+  if timings is not None:
+    for stage, seconds in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+      timings[stage].append(seconds)
+  return probs
+
+
+def run_inference(model, metadata, wav_paths, batch_size, frame_size,
+                  target_fs, resample_method='fft', timings=None):
+  '''Predict the probabilities of the words for .wav files, in batches.
+
+  See `predict_batch()` for the arguments.
+
+  Returns:
+    A float32 numpy array of shape `[len(wav_paths), num_words]`.
+  '''
+  return np.concatenate(
+      [np.zeros([0, len(metadata['words'])], dtype=np.float32)] +
+      [predict_batch(model, metadata, wav_paths[i : i + batch_size],
+                     frame_size, target_fs, resample_method=resample_method,
+                     timings=timings)
+       for i in range(0, len(wav_paths), batch_size)])
+
+
+def write_predictions(f, words, wav_paths, probs):
+  '''Write the predictions as CSV: path, top word, its probability, and the
+  probabilities of all the words.'''
+  writer = csv.writer(f)
+  writer.writerow(['path', 'word', 'probability'] + list(words))
+  for wav_path, p in zip(wav_paths, probs):
+    top = int(np.argmax(p))
+    writer.writerow([wav_path, words[top], '%.6f' % p[top]] +
+                    ['%.6f' % x for x in p])
+
+
+def benchmark(model, metadata, wav_paths, batch_sizes, repeats, frame_size,
+              target_fs, resample_method='fft'):
+  '''Time the inference pipeline for every batch size.
+
+  Every batch size gets one untimed warm-up batch, then `repeats` timed
+  passes over all the .wav files.
+
+  Returns:
+    A `list` of `dict`s with the results for every batch size.
+  '''
+  results = []
+  for batch_size in batch_sizes:
+    predict_batch(model, metadata, wav_paths[:batch_size], frame_size,
+                  target_fs, resample_method=resample_method)
+    timings = dict((stage, []) for stage in STAGES)
+    t0 = time.time()
+    for _ in range(repeats):
+      run_inference(model, metadata, wav_paths, batch_size, frame_size,
+                    target_fs, resample_method=resample_method,
+                    timings=timings)
+    total_seconds = time.time() - t0
+    result = {
+        'batch_size': batch_size,
+        'num_clips': len(wav_paths) * repeats,
+        'seconds': total_seconds,
+        'clips_per_second': len(wav_paths) * repeats / total_seconds,
+        'batch_latency_ms': {},
+    }
+    for stage in STAGES + ('total',):
+      if stage == 'total':
+        seconds = np.sum([timings[s] for s in STAGES], axis=0)
+      else:
+        seconds = np.array(timings[stage])
+      p50, p90, p99 = np.percentile(seconds * 1e3, [50, 90, 99])
+      result['batch_latency_ms'][stage] = {
+          'p50': p50, 'p90': p90, 'p99': p99, 'mean': np.mean(seconds) * 1e3}
+    print('batch_size=%-5d %10.1f clips/s   p50 batch latency %8.2f ms' %
+          (batch_size, result['clips_per_second'],
+           result['batch_latency_ms']['total']['p50']))
+    results.append(result)
+  return results
+
+
+def main():
+  if os.path.isdir(FLAGS.wav_path):
+    wav_paths = sorted(glob.glob(os.path.join(FLAGS.wav_path, '*.wav')))
+    if not wav_paths:
+      raise ValueError('Cannot find any .wav files in %s' % FLAGS.wav_path)
+  else:
+    wav_paths = [FLAGS.wav_path]
+  model, metadata = load_model(FLAGS.model_path, FLAGS.metadata_path,
+                               engine=FLAGS.engine)
+
+  if FLAGS.benchmark:
+    batch_sizes = [int(b) for b in FLAGS.batch_sizes.split(',') if b]
+    platform_info = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+    }
+    if FLAGS.engine == 'keras':
+      import keras
+      platform_info['keras'] = keras.__version__
+    results = benchmark(
+        model, metadata, wav_paths, batch_sizes, FLAGS.repeats,
+        FLAGS.frame_size, FLAGS.target_fs,
+        resample_method=FLAGS.resample_method)
+    report_json = json.dumps({
+        'config': vars(FLAGS),
+        'platform': platform_info,
+        'results': results,
+    }, indent=2)
+    if FLAGS.output:
+      with open(FLAGS.output, 'wt') as f:
+        f.write(report_json)
+      print('Wrote benchmark results to %s' % FLAGS.output)
+    else:
+      print(report_json)
+    return
+
+  probs = run_inference(
+      model, metadata, wav_paths, FLAGS.batch_size, FLAGS.frame_size,
+      FLAGS.target_fs, resample_method=FLAGS.resample_method)
+  if FLAGS.output:
+    with open(FLAGS.output, 'wt') as f:
+      write_predictions(f, metadata['words'], wav_paths, probs)
+    print('Wrote predictions for %d files to %s' %
+          (len(wav_paths), FLAGS.output))
+  else:
+    write_predictions(sys.stdout, metadata['words'], wav_paths, probs)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      'Run a speech-command model trained by model.py on .wav files.')
+  parser.add_argument(
+      'wav_path', type=str,
+      help='A .wav file, or a directory of .wav files.')
+  parser.add_argument(
+      '--model_path', type=str, default='speech_command_browser.h5',
+      help='Path to the model saved by model.py.')
+  parser.add_argument(
+      '--metadata_path', type=str, default='metadata.json',
+      help='Path to the metadata.json saved by model.py.')
+  parser.add_argument(
+      '--engine', type=str, default='keras', choices=ENGINES,
+      help='Run the model with Keras, or in NumPy without importing Keras '
+      'and TensorFlow (see numpy_model.py).')
+  parser.add_argument(
+      '--target_fs', type=float, default=44100,
+      help='Sampling frequency of the training data in Hz.')
+  parser.add_argument(
+      '--frame_size', type=int, default=1024,
+      help='Frame size at target frequency, as in prep_wavs.py.')
+  parser.add_argument(
+      '--resample_method', type=str, default='fft',
+      choices=('fft', 'polyphase'),
+      help='Resampling method. See prep_wavs.py.')
+  parser.add_argument(
+      '--batch_size', type=int, default=64,
+      help='Number of .wav files per batch.')
+  parser.add_argument(
+      '--output', type=str, default=None,
+      help='Optional path to write the predictions (CSV) or the benchmark '
+      'results (JSON) to. If not specified, they are printed.')
+  parser.add_argument(
+      '--benchmark', action='store_true',
+      help='Time the pipeline for every batch size in --batch_sizes instead '
+      'of writing predictions.')
+  parser.add_argument(
+      '--batch_sizes', type=str, default='1,8,32,128',
+      help='Batch sizes to benchmark, separated by commas.')
+  parser.add_argument(
+      '--repeats', type=int, default=3,
+      help='Number of timed passes over the .wav files per batch size.')
+  FLAGS, _ = parser.parse_known_args()
+
+  main()
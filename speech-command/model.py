@@ -21,38 +21,65 @@ import json
 import os
 
 import keras
+import numpy as np
 import tensorflow as tf
 from tensorflow.python import debug as tf_debug
 
 import data
+import profiling
 
 
-def create_model(input_shape, num_classes):
+ARCHITECTURES = ('default', 'compact')
+
+
+def create_model(input_shape, num_classes, sparse_labels=False,
+                 architecture='default', learning_rate=0.01):
+  if architecture not in ARCHITECTURES:
+    raise ValueError('Invalid architecture: %s' % architecture)
   model = keras.Sequential()
-  model.add(keras.layers.Conv2D(
-      8, [2, 8], activation='relu', input_shape=input_shape))
-  model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
-  model.add(keras.layers.Conv2D(32, [2, 4], activation='relu'))
-  model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
-  model.add(keras.layers.Conv2D(32, [2, 4], activation='relu'))
-  model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
-  model.add(keras.layers.Conv2D(32, [2, 4], activation='relu'))
-  model.add(keras.layers.MaxPool2D([2, 2], strides=[1, 2]))
-  model.add(keras.layers.Flatten())
-  model.add(keras.layers.Dropout(0.25))
-  model.add(keras.layers.Dense(2000, activation='relu'))
-  model.add(keras.layers.Dropout(0.5))
-  model.add(keras.layers.Dense(num_classes, activation='softmax'))
+  if architecture == 'compact':
+    # Depthwise-separable convolutions and global average pooling, in place
+    # of the Flatten and Dense(2000) layers, which hold almost all the
+    # weights of the default architecture.
+    model.add(keras.layers.Conv2D(
+        8, [2, 8], activation='relu', input_shape=input_shape))
+    model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
+    model.add(keras.layers.SeparableConv2D(32, [2, 4], activation='relu'))
+    model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
+    model.add(keras.layers.SeparableConv2D(64, [2, 4], activation='relu'))
+    model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
+    model.add(keras.layers.SeparableConv2D(64, [2, 4], activation='relu'))
+    model.add(keras.layers.GlobalAveragePooling2D())
+    model.add(keras.layers.Dropout(0.25))
+    model.add(keras.layers.Dense(num_classes, activation='softmax'))
+  else:
+    model.add(keras.layers.Conv2D(
+        8, [2, 8], activation='relu', input_shape=input_shape))
+    model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
+    model.add(keras.layers.Conv2D(32, [2, 4], activation='relu'))
+    model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
+    model.add(keras.layers.Conv2D(32, [2, 4], activation='relu'))
+    model.add(keras.layers.MaxPool2D([2, 2], strides=[2, 2]))
+    model.add(keras.layers.Conv2D(32, [2, 4], activation='relu'))
+    model.add(keras.layers.MaxPool2D([2, 2], strides=[1, 2]))
+    model.add(keras.layers.Flatten())
+    model.add(keras.layers.Dropout(0.25))
+    model.add(keras.layers.Dense(2000, activation='relu'))
+    model.add(keras.layers.Dropout(0.5))
+    model.add(keras.layers.Dense(num_classes, activation='softmax'))
 
+  # With sparse_labels, the model is trained on integer label indices, so the
+  # one-hot label matrix never needs to exist.
   model.compile(
-      loss='categorical_crossentropy',
-      optimizer=tf.train.GradientDescentOptimizer(0.01),
+      loss=('sparse_categorical_crossentropy' if sparse_labels
+            else 'categorical_crossentropy'),
+      optimizer=tf.train.GradientDescentOptimizer(learning_rate),
       metrics=['accuracy'])
   # Note on optimizer:
   #   * rmsprop doesn't work as well.
   model.summary()
 
-  # Equivalent TensorFlow.js code:
+  # Equivalent TensorFlow.js code of the default architecture:
   #
   # ```javascript
   # const model = tf.sequential();
@@ -120,22 +147,164 @@ def create_model(input_shape, num_classes):
   return model
 
 
+def set_num_threads(num_threads):
+  """Limit the number of threads of TensorFlow ops in this process.
+
+  This replaces the Keras session, so it must be called before the model is
+  created.
+  """
+  keras.backend.set_session(tf.Session(config=tf.ConfigProto(
+      intra_op_parallelism_threads=num_threads,
+      inter_op_parallelism_threads=1)))
+
+
+class SpectrogramSequence(keras.utils.Sequence):
+  """Batches of spectrograms that are read lazily, for `fit_generator()`.
+
+  The examples are shuffled with a bounded buffer. In storage order, the
+  examples of a word are consecutive, so every epoch:
+
+    1. The examples are split into blocks of `batch_size` consecutive
+       examples, and the blocks are put in a random order. This interleaves
+       the files, and hence the words.
+    2. The resulting stream is shuffled with a window of
+       `shuffle_buffer_size` examples: every example moves by less than that
+       many positions.
+
+  A batch is thus drawn from about `shuffle_buffer_size / batch_size`
+  random blocks, i.e., from many files and words. Each block is still read
+  in one piece from the memory-mapped files.
+  """
+
+  def __init__(self,
+               gather_fn,
+               labels,
+               indices,
+               num_classes,
+               batch_size=64,
+               shuffle_buffer_size=None,
+               sparse_labels=False):
+    """Constructor of SpectrogramSequence.
+
+    Args:
+      gather_fn: A function that takes an int numpy array of example indices
+        and returns the input features of the examples as a numpy array.
+      labels: Label index of every example, as an int numpy array.
+      indices: Indices of the examples in this sequence, in storage order.
+      num_classes: Number of classes, for one-hot encoding the labels.
+      batch_size: Batch size.
+      shuffle_buffer_size: Size of the shuffle buffer. If `None`, the
+        examples are not shuffled.
+      sparse_labels: Yield the label indices instead of one-hot labels.
+    """
+    self._gather_fn = gather_fn
+    self._labels = labels
+    self._indices = np.asarray(indices)
+    self._num_classes = num_classes
+    self._batch_size = batch_size
+    self._shuffle_buffer_size = shuffle_buffer_size
+    self._sparse_labels = sparse_labels
+    self._order = self._indices
+    self.on_epoch_end()
+
+  def __len__(self):
+    return int(np.ceil(len(self._indices) / float(self._batch_size)))
+
+  def __getitem__(self, i):
+    indices = self._order[i * self._batch_size : (i + 1) * self._batch_size]
+    if self._sparse_labels:
+      return self._gather_fn(indices), self._labels[indices]
+    ys = np.zeros([len(indices), self._num_classes], dtype=np.float32)
+    ys[np.arange(len(indices)), self._labels[indices]] = 1.0
+    return self._gather_fn(indices), ys
+
+  def on_epoch_end(self):
+    if not self._shuffle_buffer_size or not len(self._indices):
+      return
+    block_begins = np.arange(0, len(self._indices), self._batch_size)
+    np.random.shuffle(block_begins)
+    stream = np.concatenate(
+        [self._indices[i : i + self._batch_size] for i in block_begins])
+    # Sorting by the position plus a uniform offset in
+    # [0, shuffle_buffer_size) is a windowed shuffle.
+    keys = np.arange(len(stream)) + np.random.uniform(
+        0, self._shuffle_buffer_size, len(stream))
+    self._order = stream[np.argsort(keys)]
+
+
 def train_model(root_dir,
                 n_fft,
                 epochs,
                 include_words=None,
-                debug=False):
-  words, xs, ys = data.load_data(
-      os.path.expanduser(root_dir), n_fft, include_words)
+                debug=False,
+                cache_dir=None,
+                streaming=False,
+                shuffle_buffer_size=4096,
+                read_workers=4,
+                prefetch_batches=16,
+                sparse_labels=False,
+                float16=False,
+                normalization='example',
+                architecture='default',
+                batch_size=64,
+                learning_rate=0.01):
+  """Train the model and save it to speech_command_browser.h5.
+
+  Args:
+    root_dir: Root directory of the data. See `data.load_data()`.
+    n_fft: Number of FFT points per column of the spectrograms.
+    epochs: Number of epochs to train for.
+    include_words: Optional `list` of words to include.
+    debug: Whether to use the TensorFlow Debugger CLI.
+    cache_dir: Optional directory for caching the preprocessed data.
+    streaming: Instead of loading the whole dataset into memory, read the
+      batches lazily from the memory-mapped .dat files. The validation split
+      is then a random 10% of the examples, selected by index.
+    shuffle_buffer_size: Size of the shuffle buffer for `streaming`.
+    read_workers: Number of threads that read batches for `streaming`.
+    prefetch_batches: Maximum number of batches read ahead for `streaming`.
+    sparse_labels: Train on integer labels with sparse categorical
+      cross-entropy, instead of one-hot labels.
+    float16: Hold the spectrograms in memory as float16 (ignored with
+      `streaming`).
+    normalization: Normalization mode of the spectrograms. See
+      `data.NORMALIZATION_MODES`. The normalization (including the
+      statistics of the 'global' and 'bin' modes) is saved in
+      metadata.json, so it can be applied at inference time.
+    architecture: Model architecture. See `ARCHITECTURES` and
+      `create_model()`.
+    batch_size: Batch size.
+    learning_rate: Learning rate of the SGD optimizer.
+  """
+  root_dir = os.path.expanduser(root_dir)
+  if streaming:
+    index = data.SpectrogramIndex(root_dir, n_fft, include_words,
+                                  normalization=normalization)
+    words = index.words
+    normalization_info = index.normalization
+    input_shape = (data.NUM_FRAMES_CUTOFF, n_fft, 1)
+    num_classes = len(words)
+  else:
+    dataset = data.load_dataset(
+        root_dir, n_fft, include_words,
+        cache_dir=cache_dir and os.path.expanduser(cache_dir),
+        dtype=(np.float16 if float16 else np.float32),
+        normalization=normalization)
+    words = dataset.words
+    normalization_info = dataset.normalization
+    input_shape = dataset.xs.shape[1:]
+    num_classes = len(words)
   metadata = {
       'frameSize': n_fft,
-      'words': words
+      'words': words,
+      'normalization': normalization_info,
+      'architecture': architecture,
+      'batchSize': batch_size,
+      'learningRate': learning_rate
   }
   with open('metadata.json', 'wt') as f:
     json.dump(metadata, f)
 
-  input_shape = xs.shape[1:]
-  num_classes = ys.shape[-1]
   print('input_shape = %s' % (input_shape,))
   print('num_classes = %s' % num_classes)
 
@@ -143,14 +312,34 @@ def train_model(root_dir,
     keras.backend.set_session(
         tf_debug.LocalCLIDebugWrapperSession(tf.Session()))
 
-  model = create_model(input_shape, num_classes)
+  model = create_model(input_shape, num_classes, sparse_labels=sparse_labels,
+                       architecture=architecture, learning_rate=learning_rate)
 
-  model.fit(xs,
-            ys,
-            batch_size=64,
-            epochs=epochs,
-            shuffle=True,
-            validation_split=0.1)
+  if streaming:
+    order = np.random.permutation(len(index))
+    num_val = int(len(index) * 0.1)
+    train_seq = SpectrogramSequence(
+        index.gather, index.labels, np.sort(order[num_val:]), num_classes,
+        batch_size=batch_size, shuffle_buffer_size=shuffle_buffer_size,
+        sparse_labels=sparse_labels)
+    val_seq = SpectrogramSequence(
+        index.gather, index.labels, np.sort(order[:num_val]), num_classes,
+        batch_size=batch_size, sparse_labels=sparse_labels)
+    with profiling.stage('train_model/fit'):
+      model.fit_generator(train_seq,
+                          epochs=epochs,
+                          validation_data=val_seq,
+                          workers=read_workers,
+                          use_multiprocessing=False,
+                          max_queue_size=prefetch_batches)
+  else:
+    with profiling.stage('train_model/fit'):
+      model.fit(dataset.xs,
+                dataset.labels if sparse_labels else dataset.one_hot(),
+                batch_size=batch_size,
+                epochs=epochs,
+                shuffle=True,
+                validation_split=0.1)
 
   model.save('speech_command_browser.h5')
 
@@ -166,16 +355,60 @@ if __name__ == '__main__':
   parser.add_argument(
       '--epochs', type=int, default=300,
       help='Number of epochs to call Model.fit() with.')
+  parser.add_argument(
+      '--batch_size', type=int, default=64,
+      help='Batch size.')
+  parser.add_argument(
+      '--learning_rate', type=float, default=0.01,
+      help='Learning rate of the SGD optimizer.')
   parser.add_argument(
       '--include_words', type=str, default=None,
       help='Optional list of words to include (in addition to _unknown_ '
       'and _background_noise_, which are always included). The words should '
       'be separated with commas (e.g., "up,down").')
+  parser.add_argument(
+      '--cache_dir', type=str, default=None,
+      help='Optional directory for caching the preprocessed data. Later runs '
+      'on the same data memory-map it from there instead of re-parsing the '
+      '.dat files.')
+  parser.add_argument(
+      '--streaming', action='store_true',
+      help='Read the training batches lazily from the memory-mapped .dat '
+      'files instead of loading the whole dataset into memory.')
+  parser.add_argument(
+      '--shuffle_buffer_size', type=int, default=4096,
+      help='Size of the shuffle buffer for --streaming.')
+  parser.add_argument(
+      '--read_workers', type=int, default=4,
+      help='Number of threads that read batches for --streaming.')
+  parser.add_argument(
+      '--prefetch_batches', type=int, default=16,
+      help='Maximum number of batches read ahead for --streaming.')
+  parser.add_argument(
+      '--sparse_labels', action='store_true',
+      help='Train on integer labels with sparse categorical cross-entropy, '
+      'so that no one-hot label matrix is created.')
+  parser.add_argument(
+      '--float16', action='store_true',
+      help='Hold the spectrograms in memory as float16 instead of float32.')
+  parser.add_argument(
+      '--normalization', type=str, default='example',
+      choices=data.NORMALIZATION_MODES,
+      help='Normalize every spectrogram by its own statistics ("example"), '
+      'or by the statistics of the whole dataset ("global") or of every '
+      'frequency bin ("bin"). The statistics are saved in metadata.json.')
+  parser.add_argument(
+      '--architecture', type=str, default='default', choices=ARCHITECTURES,
+      help='Model architecture. "compact" replaces the Flatten and '
+      'Dense(2000) layers with depthwise-separable convolutions and global '
+      'average pooling, for a much smaller and faster model.')
   parser.add_argument(
       '--tf_debug', action='store_true',
       help='Use TensroFlow Debugger CLI.')
+  profiling.add_arguments(parser)
   parsed = parser.parse_args()
 
+  include_words = None
   if parsed.include_words:
     include_words = parsed.include_words.split(',')
     include_words = sorted([w for w in include_words if w])
@@ -193,8 +426,20 @@ if __name__ == '__main__':
           'You don\'t need to include _unknown_ in '
           '--include_words. It is always included.')
 
-  train_model(parsed.data_root,
-              parsed.n_fft,
-              parsed.epochs,
-              include_words=include_words,
-              debug=parsed.tf_debug)
+  with profiling.session(parsed.profile, parsed.cprofile):
+    train_model(parsed.data_root,
+                parsed.n_fft,
+                parsed.epochs,
+                include_words=include_words,
+                debug=parsed.tf_debug,
+                cache_dir=parsed.cache_dir,
+                streaming=parsed.streaming,
+                shuffle_buffer_size=parsed.shuffle_buffer_size,
+                read_workers=parsed.read_workers,
+                prefetch_batches=parsed.prefetch_batches,
+                sparse_labels=parsed.sparse_labels,
+                float16=parsed.float16,
+                normalization=parsed.normalization,
+                architecture=parsed.architecture,
+                batch_size=parsed.batch_size,
+                learning_rate=parsed.learning_rate)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Compare the size, speed and accuracy of model variants.
+
+Every model saved by `model.py` (e.g., with different `--architecture`s) is
+exported with `export_tfjs.py` with every quantization in `--quantizations`.
+Every variant is then loaded back with `numpy_model.load_tfjs_model()`, with
+the weights as the browser sees them, and the report has:
+
+  - The number of parameters and of FLOPs per example.
+  - The size of the .h5 file and of the exported TensorFlow.js model.
+  - The median CPU latency of a batch, for every batch size in
+    `--batch_sizes`, with the NumPy engine.
+  - With `--test_data_root`, the accuracy on the test split, with the words
+    and the normalization in the `metadata.json` next to the .h5 file.
+
+Usage example:
+
+```sh
+python model_report.py \
+    default/speech_command_browser.h5 compact/speech_command_browser.h5 \
+    --test_data_root path/to/combined/data/test --output report.json
+```
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import data
+import export_tfjs
+import numpy_model
+
+
+def measure_latency(model, input_shape, batch_sizes, repeats):
+  '''Measure the median and 90th-percentile latency of batches, in ms.'''
+  latency = {}
+  for batch_size in batch_sizes:
+    xs = np.random.RandomState(0).randn(
+        batch_size, *input_shape).astype(np.float32)
+    model.predict(xs, batch_size=batch_size)
+    seconds = []
+    for _ in range(repeats):
+      t0 = time.time()
+      model.predict(xs, batch_size=batch_size)
+      seconds.append(time.time() - t0)
+    p50, p90 = np.percentile(np.array(seconds) * 1e3, [50, 90])
+    latency[batch_size] = {'p50': p50, 'p90': p90}
+  return latency
+
+
+def evaluate(model, index, batch_size=256):
+  '''Calculate the accuracy of a model on a `data.SpectrogramIndex`.'''
+  num_correct = 0
+  for i in range(0, len(index), batch_size):
+    indices = np.arange(i, min(i + batch_size, len(index)))
+    probs = model.predict(index.gather(indices), batch_size=batch_size)
+    num_correct += int(np.sum(np.argmax(probs, axis=-1) ==
+                              index.labels[indices]))
+  return num_correct / max(len(index), 1)
+
+
+def load_test_index(test_data_root, metadata):
+  '''Index the test split with the words and normalization of a model.'''
+  words = metadata['words']
+  index = data.SpectrogramIndex(
+      test_data_root, metadata['frameSize'],
+      include_words=[w for w in words
+                     if w not in ('_background_noise_', '_unknown_')],
+      normalization=metadata.get('normalization', {'mode': 'example'}))
+  if index.words != words:
+    raise ValueError('The words of the test data %s do not match the words '
+                     'of the model %s' % (index.words, words))
+  return index
+
+
+def report_model(h5_path, quantizations, batch_sizes, repeats,
+                 test_data_root=None):
+  '''Measure every quantization of a model.
+
+  Returns:
+    A `list` of result `dict`s, one per quantization.
+  '''
+  metadata = None
+  metadata_path = os.path.join(os.path.dirname(h5_path), 'metadata.json')
+  if os.path.isfile(metadata_path):
+    with open(metadata_path, 'rt') as f:
+      metadata = json.load(f)
+  index = None
+  if test_data_root:
+    if metadata is None:
+      raise ValueError('Cannot find %s for evaluating %s' %
+                       (metadata_path, h5_path))
+    index = load_test_index(test_data_root, metadata)
+
+  results = []
+  out_dir = tempfile.mkdtemp()
+  try:
+    for quantization in quantizations:
+      tfjs_dir = os.path.join(out_dir, quantization)
+      tfjs_bytes = export_tfjs.export_tfjs(h5_path, tfjs_dir,
+                                           quantization=quantization)
+      model = numpy_model.load_tfjs_model(
+          os.path.join(tfjs_dir, 'model.json'))
+      input_shape = model.input_shape or (
+          data.NUM_FRAMES_CUTOFF, metadata['frameSize'], 1)
+      result = {
+          'model': h5_path,
+          'quantization': quantization,
+          'params': model.count_params(),
+          'flops': model.count_flops(input_shape),
+          'h5_bytes': os.path.getsize(h5_path),
+          'tfjs_bytes': tfjs_bytes,
+          'latency_ms': measure_latency(model, input_shape, batch_sizes,
+                                        repeats),
+      }
+      if index is not None:
+        result['accuracy'] = evaluate(model, index)
+      results.append(result)
+  finally:
+    shutil.rmtree(out_dir)
+  return results
+
+
+def print_table(results, batch_sizes):
+  header = '%-40s %-8s %10s %9s %10s' % (
+      'model', 'weights', 'params', 'MFLOPs', 'size (KB)')
+  header += ''.join(' %12s' % ('bs=%d (ms)' % b) for b in batch_sizes)
+  header += ' %9s' % 'accuracy'
+  print(header)
+  for result in results:
+    line = '%-40s %-8s %10d %9.2f %10.1f' % (
+        result['model'][-40:], result['quantization'], result['params'],
+        result['flops'] / 1e6, result['tfjs_bytes'] / 1024)
+    line += ''.join(' %12.2f' % result['latency_ms'][b]['p50']
+                    for b in batch_sizes)
+    if 'accuracy' in result:
+      line += ' %9.4f' % result['accuracy']
+    print(line)
+
+
+def main():
+  quantizations = [q for q in FLAGS.quantizations.split(',') if q]
+  for quantization in quantizations:
+    if quantization not in export_tfjs.QUANTIZATIONS:
+      raise ValueError('Invalid quantization: %s' % quantization)
+  batch_sizes = [int(b) for b in FLAGS.batch_sizes.split(',') if b]
+  results = []
+  for h5_path in FLAGS.h5_paths:
+    results.extend(report_model(
+        h5_path, quantizations, batch_sizes, FLAGS.repeats,
+        test_data_root=FLAGS.test_data_root))
+  print_table(results, batch_sizes)
+  if FLAGS.output:
+    with open(FLAGS.output, 'wt') as f:
+      json.dump(results, f, indent=2)
+    print('Wrote report to %s' % FLAGS.output)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      'Compare the size, speed and accuracy of model variants.')
+  parser.add_argument(
+      'h5_paths', type=str, nargs='+',
+      help='Paths to models saved by model.py. The metadata.json of every '
+      'model is read from the same directory.')
+  parser.add_argument(
+      '--quantizations', type=str, default='float32,float16,uint8',
+      help='Quantizations to export every model with, separated by commas. '
+      'See export_tfjs.py.')
+  parser.add_argument(
+      '--test_data_root', type=str, default=None,
+      help='Optional root directory of the test split (e.g., '
+      'path/to/combined/data/test), for reporting the accuracy.')
+  parser.add_argument(
+      '--batch_sizes', type=str, default='1,32',
+      help='Batch sizes to measure the latency for, separated by commas.')
+  parser.add_argument(
+      '--repeats', type=int, default=10,
+      help='Number of timed batches per batch size.')
+  parser.add_argument(
+      '--output', type=str, default=None,
+      help='Optional path to write the report to, as JSON.')
+  FLAGS, _ = parser.parse_known_args()
+
+  main()
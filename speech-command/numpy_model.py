@@ -0,0 +1,418 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Inference of the models of model.py in NumPy, without Keras.
+
+The layers and weights are read from the HDF5 file saved by `model.py`
+(`speech_command_browser.h5`) with h5py, or from a TensorFlow.js model.json
+written by `export_tfjs.py` (possibly with quantized weights). The layers of
+`create_model()` run as vectorized NumPy ops. A convolution is one matrix
+multiplication of the flattened input patches (im2col) with the kernel.
+Importing this module and loading a model takes a fraction of the time and
+memory of Keras and TensorFlow.
+
+Usage example:
+
+```python
+import numpy_model
+
+model = numpy_model.load_model('speech_command_browser.h5')
+probs = model.predict(xs)  # xs: [N, num_frames, n_fft, 1].
+```
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import os
+
+import numpy as np
+
+
+def _decode(value):
+  return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _relu(x):
+  return np.maximum(x, 0, out=x)
+
+
+def _softmax(x):
+  x = np.exp(x - np.max(x, axis=-1, keepdims=True))
+  return x / np.sum(x, axis=-1, keepdims=True)
+
+
+_ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': _relu,
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'softmax': _softmax,
+    'tanh': np.tanh,
+}
+
+
+def _activate(x, config):
+  activation = config.get('activation', 'linear')
+  if activation not in _ACTIVATIONS:
+    raise ValueError('Unsupported activation: %s' % (activation,))
+  return _ACTIVATIONS[activation](x)
+
+
+def _pad_same(x, pool_size, strides, value=0.0):
+  '''Pad NHWC inputs like TensorFlow's 'same' padding.'''
+  pads = [(0, 0)]
+  for size, kernel, stride in zip(x.shape[1:3], pool_size, strides):
+    out_size = -(-size // stride)
+    total = max((out_size - 1) * stride + kernel - size, 0)
+    pads.append((total // 2, total - total // 2))
+  pads.append((0, 0))
+  return np.pad(x, pads, mode='constant', constant_values=value)
+
+
+def _windows(x, window_size, strides, padding, pad_value=0.0):
+  '''Get a strided view of the sliding windows of NHWC inputs.
+
+  Returns:
+    A read-only numpy array of shape
+    `[N, out_height, out_width, window_height, window_width, C]`.
+  '''
+  if padding == 'same':
+    x = _pad_same(x, window_size, strides, value=pad_value)
+  elif padding != 'valid':
+    raise ValueError('Unsupported padding: %s' % padding)
+  x = np.ascontiguousarray(x)
+  n, height, width, channels = x.shape
+  out_height = (height - window_size[0]) // strides[0] + 1
+  out_width = (width - window_size[1]) // strides[1] + 1
+  s_n, s_h, s_w, s_c = x.strides
+  return np.lib.stride_tricks.as_strided(
+      x,
+      shape=(n, out_height, out_width, window_size[0], window_size[1],
+             channels),
+      strides=(s_n, s_h * strides[0], s_w * strides[1], s_h, s_w, s_c),
+      writeable=False)
+
+
+def _check_config(config):
+  if config.get('data_format', 'channels_last') != 'channels_last':
+    raise ValueError('Only channels_last is supported, but got %s' %
+                     config['data_format'])
+  if tuple(config.get('dilation_rate', (1, 1))) != (1, 1):
+    raise ValueError('Dilated convolutions are not supported')
+
+
+def _conv2d(x, config, weights):
+  _check_config(config)
+  kernel = weights['kernel']
+  kernel_height, kernel_width, in_channels, filters = kernel.shape
+  patches = _windows(x, (kernel_height, kernel_width), config['strides'],
+                     config['padding'])
+  n, out_height, out_width = patches.shape[:3]
+  # im2col: one row of flattened patch values per output position.
+  cols = patches.reshape([n * out_height * out_width, -1])
+  y = np.dot(cols, kernel.reshape([-1, filters]))
+  if 'bias' in weights:
+    y += weights['bias']
+  return _activate(y.reshape([n, out_height, out_width, filters]), config)
+
+
+def _depthwise(x, config, depthwise_kernel):
+  kernel_height, kernel_width, channels, multiplier = depthwise_kernel.shape
+  patches = _windows(x, (kernel_height, kernel_width), config['strides'],
+                     config['padding'])
+  y = np.zeros(patches.shape[:3] + (channels * multiplier,),
+               dtype=np.float32)
+  for i in range(kernel_height):
+    for j in range(kernel_width):
+      window = patches[:, :, :, i, j]
+      if multiplier > 1:
+        # Output channel `c * multiplier + m`, as in TensorFlow.
+        window = np.repeat(window, multiplier, axis=-1)
+      y += window * depthwise_kernel[i, j].reshape([-1])
+  return y
+
+
+def _depthwise_conv2d(x, config, weights):
+  _check_config(config)
+  # Named 'kernel' by Keras 3.
+  y = _depthwise(x, config, weights.get('depthwise_kernel',
+                                        weights.get('kernel')))
+  if 'bias' in weights:
+    y += weights['bias']
+  return _activate(y, config)
+
+
+def _separable_conv2d(x, config, weights):
+  _check_config(config)
+  y = _depthwise(x, config, weights['depthwise_kernel'])
+  pointwise_kernel = weights['pointwise_kernel']
+  filters = pointwise_kernel.shape[-1]
+  out_shape = y.shape[:3] + (filters,)
+  y = np.dot(y.reshape([-1, y.shape[-1]]),
+             pointwise_kernel.reshape([-1, filters]))
+  if 'bias' in weights:
+    y += weights['bias']
+  return _activate(y.reshape(out_shape), config)
+
+
+def _max_pool2d(x, config, weights):
+  _check_config(config)
+  pool_size = config['pool_size']
+  strides = config.get('strides') or pool_size
+  windows = _windows(x, pool_size, strides, config['padding'],
+                     pad_value=-np.inf)
+  # An elementwise maximum over the offsets in the window is much faster
+  # than a reduction over the (small, strided) window axes.
+  y = windows[:, :, :, 0, 0].copy()
+  for i in range(pool_size[0]):
+    for j in range(pool_size[1]):
+      if i or j:
+        np.maximum(y, windows[:, :, :, i, j], out=y)
+  return y
+
+
+def _global_average_pool2d(x, config, weights):
+  _check_config(config)
+  return np.mean(x, axis=(1, 2), keepdims=config.get('keepdims', False))
+
+
+def _global_max_pool2d(x, config, weights):
+  _check_config(config)
+  return np.max(x, axis=(1, 2), keepdims=config.get('keepdims', False))
+
+
+def _flatten(x, config, weights):
+  return x.reshape([len(x), -1])
+
+
+def _dropout(x, config, weights):
+  return x
+
+
+def _dense(x, config, weights):
+  y = np.dot(x, weights['kernel'])
+  if 'bias' in weights:
+    y += weights['bias']
+  return _activate(y, config)
+
+
+_LAYER_FUNCTIONS = {
+    'Conv2D': _conv2d,
+    'Dense': _dense,
+    'DepthwiseConv2D': _depthwise_conv2d,
+    'Dropout': _dropout,
+    'Flatten': _flatten,
+    'GlobalAveragePooling2D': _global_average_pool2d,
+    'GlobalMaxPooling2D': _global_max_pool2d,
+    'MaxPooling2D': _max_pool2d,
+    'SeparableConv2D': _separable_conv2d,
+}
+_LAYER_FUNCTIONS['MaxPool2D'] = _LAYER_FUNCTIONS['MaxPooling2D']
+
+
+class NumpyModel(object):
+  '''A `keras.Sequential` model of the supported layers, in NumPy.'''
+
+  def __init__(self, layers, input_shape=None):
+    '''Constructor of NumpyModel.
+
+    Args:
+      layers: A `list` of (class name, config `dict`, weights `dict`)
+        tuples, in the order of the model. The weights are float32 numpy
+        arrays keyed by name (e.g., 'kernel' and 'bias').
+      input_shape: Optional shape of one input example, e.g.,
+        `(43, 232, 1)`.
+
+    Raises:
+      ValueError: If a layer is not supported.
+    '''
+    for class_name, _, _ in layers:
+      if class_name not in _LAYER_FUNCTIONS:
+        raise ValueError('Unsupported layer type: %s' % class_name)
+    self.layers = layers
+    self.input_shape = input_shape and tuple(input_shape)
+
+  def count_params(self):
+    '''Get the total number of weight values.'''
+    return sum(int(np.size(w)) for _, _, weights in self.layers
+               for w in weights.values())
+
+  def count_flops(self, input_shape=None):
+    '''Count the floating-point operations of the model for one example.
+
+    A multiply-add of the convolutions and dense layers counts as two
+    operations. Biases, activations and pooling are not counted.
+
+    Args:
+      input_shape: Shape of one input example. Defaults to `input_shape`.
+
+    Returns:
+      The number of floating-point operations.
+    '''
+    y = np.zeros((1,) + tuple(input_shape or self.input_shape),
+                 dtype=np.float32)
+    flops = 0
+    for class_name, config, weights in self.layers:
+      y = _LAYER_FUNCTIONS[class_name](y, config, weights)
+      # Every output value takes one multiply-add per value of the kernels
+      # connected to it.
+      kernel_size = sum(int(np.size(w)) for key, w in weights.items()
+                        if key.endswith('kernel'))
+      flops += 2 * int(np.prod(y.shape[1:-1])) * kernel_size
+    return flops
+
+  def predict(self, x, batch_size=32):
+    '''Run the model on inputs, in batches.
+
+    Args:
+      x: float numpy array of shape `[N, ...]`, with the input shape of the
+        model.
+      batch_size: Number of inputs per batch.
+
+    Returns:
+      The outputs of the model, as a float32 numpy array.
+    '''
+    outputs = []
+    for i in range(0, len(x), batch_size):
+      y = np.asarray(x[i : i + batch_size], dtype=np.float32)
+      for class_name, config, weights in self.layers:
+        y = _LAYER_FUNCTIONS[class_name](y, config, weights)
+      outputs.append(y.astype(np.float32))
+    return np.concatenate(outputs)
+
+
+def _read_layer_configs(model_config):
+  if model_config['class_name'] != 'Sequential':
+    raise ValueError('Only Sequential models are supported, but got %s' %
+                     model_config['class_name'])
+  configs = model_config['config']
+  # Older versions of Keras save the layers of a Sequential model as a list.
+  if isinstance(configs, dict):
+    configs = configs['layers']
+  input_shape = None
+  for config in configs:
+    batch_shape = (config['config'].get('batch_input_shape') or
+                   config['config'].get('batch_shape'))
+    if batch_shape:
+      input_shape = tuple(batch_shape[1:])
+      break
+  return [(c['class_name'], c['config']) for c in configs
+          if c['class_name'] != 'InputLayer'], input_shape
+
+
+def _build_model(model_config, weights):
+  layer_configs, input_shape = _read_layer_configs(model_config)
+  return NumpyModel(
+      [(class_name, config, dict(weights.get(config['name'], {})))
+       for class_name, config in layer_configs],
+      input_shape=input_shape)
+
+
+def read_h5(h5_path):
+  '''Read the config and weights of a model saved by `keras.Model.save()`.
+
+  Args:
+    h5_path: Path to the HDF5 file (e.g., speech_command_browser.h5).
+
+  Returns:
+    - The attributes of the file (e.g., `model_config` and `keras_version`),
+      as a `dict`. JSON attributes are parsed.
+    - The weights, as an `OrderedDict` mapping layer names to `OrderedDict`s
+      that map weight names (e.g., 'kernel' and 'bias') to float32 numpy
+      arrays, in the order of the file.
+  '''
+  # Imported here so that loading a TensorFlow.js model does not require
+  # h5py.
+  import h5py
+  with h5py.File(h5_path, 'r') as f:
+    attrs = {}
+    for key, value in f.attrs.items():
+      value = _decode(value)
+      if key in ('model_config', 'training_config'):
+        value = json.loads(value)
+      attrs[key] = value
+    weights_group = f['model_weights'] if 'model_weights' in f else f
+    weights = collections.OrderedDict()
+    for layer_name in weights_group.attrs['layer_names']:
+      layer_name = _decode(layer_name)
+      group = weights_group[layer_name]
+      layer_weights = collections.OrderedDict()
+      for weight_name in group.attrs.get('weight_names', []):
+        weight_name = _decode(weight_name)
+        # E.g., 'conv2d_1/kernel:0' or 'sequential/conv2d_1/kernel'.
+        key = weight_name.split('/')[-1].split(':')[0]
+        layer_weights[key] = np.asarray(group[weight_name], dtype=np.float32)
+      if layer_weights:
+        weights[layer_name] = layer_weights
+  return attrs, weights
+
+
+def load_model(h5_path):
+  '''Load a model saved by `keras.Model.save()` for inference in NumPy.
+
+  Args:
+    h5_path: Path to the HDF5 file (e.g., speech_command_browser.h5).
+
+  Returns:
+    A `NumpyModel`.
+
+  Raises:
+    ValueError: If the model has layers that are not supported.
+  '''
+  attrs, weights = read_h5(h5_path)
+  return _build_model(attrs['model_config'], weights)
+
+
+def load_tfjs_model(model_json_path):
+  '''Load a TensorFlow.js layers model for inference in NumPy.
+
+  Quantized weights (see `export_tfjs.py`) are dequantized to float32, so
+  that the outputs are those of the model in the browser.
+
+  Args:
+    model_json_path: Path to the model.json file. The weight files are read
+      from the same directory.
+
+  Returns:
+    A `NumpyModel`.
+
+  Raises:
+    ValueError: If the model has layers that are not supported.
+  '''
+  with open(model_json_path, 'rt') as f:
+    model_json = json.load(f)
+  base_dir = os.path.dirname(model_json_path)
+  weights = collections.defaultdict(dict)
+  for group in model_json['weightsManifest']:
+    buf = b''
+    for path in group['paths']:
+      with open(os.path.join(base_dir, path), 'rb') as f:
+        buf += f.read()
+    offset = 0
+    for spec in group['weights']:
+      quantization = spec.get('quantization')
+      dtype = np.dtype(quantization['dtype'] if quantization
+                       else spec['dtype']).newbyteorder('<')
+      size = int(np.prod(spec['shape']))
+      values = np.frombuffer(buf, dtype=dtype, count=size, offset=offset)
+      offset += size * dtype.itemsize
+      values = values.astype(np.float32)
+      if quantization and 'scale' in quantization:
+        values = values * quantization['scale'] + quantization['min']
+      layer_name, key = spec['name'].rsplit('/', 1)
+      weights[layer_name][key.split(':')[0]] = (
+          values.astype(np.float32).reshape(spec['shape']))
+  return _build_model(model_json['modelTopology']['model_config'], weights)
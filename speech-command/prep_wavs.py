@@ -18,23 +18,44 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import collections
+import fractions
+import functools
 import glob
+import hashlib
+import itertools
 import math
+import multiprocessing
 import os
+import shutil
 import struct
 
 import numpy as np
 from scipy.io import wavfile
+from scipy.signal import firwin
 from scipy.signal import resample
+from scipy.signal import resample_poly
 
+import profiling
 import spectrogram
 
 
 _BACKGROUND_NOISE_DIR = '_background_noise_'
 
+# Version of the format of the conversion cache entries. Must be incremented
+# whenever a change to the conversion would change its output.
+_CACHE_VERSION = 2
 
-def read_as_floats(wav_path):
-  '''Read a wav file as a numpy float array.
+
+# Reusable float32 buffer for the transient, pre-resampling signals.
+_float_buffer = np.zeros([0], dtype=np.float32)
+
+
+def read_as_int16(wav_path):
+  '''Memory-map the int16 PCM samples of a wav file.
+
+  Only the wav header is parsed. The samples are read from disk lazily, when
+  they are accessed.
 
   Asserts that the wav file has only one channel.
   Asserts that the wav file has int16 data type.
@@ -44,35 +65,148 @@ def read_as_floats(wav_path):
 
   Returns:
     fs: sampling frequency
-    signal: signal as a float32-type numpy array of shape [signalLength].
+    signal: signal as a read-only int16 `numpy.memmap` of shape
+      [signalLength].
   '''
-  fs, signal = wavfile.read(wav_path)
+  fs, signal = wavfile.read(wav_path, mmap=True)
   assert len(signal.shape) == 1
   assert signal.dtype == np.int16
-  signal = signal.astype('float32')
-  signal = signal / 32768.0
   return fs, signal
 
 
-def read_and_resample_as_floats(wav_path, target_fs):
+def int16_to_floats(signal, out=None):
+  '''Convert int16 PCM samples to float32 values in [-1, 1).
+
+  Args:
+    signal: int16 numpy array of any shape.
+    out: Optional float32 numpy array of the same shape to write into.
+
+  Returns:
+    float32 numpy array of the same shape as `signal`.
+  '''
+  return np.multiply(signal, np.float32(1.0 / 32768.0), out=out,
+                     dtype=np.float32)
+
+
+def read_as_floats(wav_path, out=None):
+  '''Read a wav file as a numpy float array.
+
+  Asserts that the wav file has only one channel.
+  Asserts that the wav file has int16 data type.
+
+  Args:
+    wav_path: Path to the wav file to read.
+    out: Optional 1D float32 numpy array, at least as long as the signal, to
+      write the signal into.
+
+  Returns:
+    fs: sampling frequency
+    signal: signal as a float32-type numpy array of shape [signalLength].
+      If `out` is provided, this is a view of it.
+  '''
+  fs, signal = read_as_int16(wav_path)
+  if out is not None:
+    out = out[:len(signal)]
+  return fs, int16_to_floats(signal, out=out)
+
+
+def _get_float_buffer(length):
+  global _float_buffer
+  if len(_float_buffer) < length:
+    _float_buffer = np.empty([length], dtype=np.float32)
+  return _float_buffer[:length]
+
+
+# Mapping (up, down) to FIR filter, for memoization.
+_polyphase_filters = dict()
+
+
+def get_polyphase_filter(fs, target_fs):
+  '''Get the rational resampling factors and anti-aliasing filter.
+
+  The filter is the same as the default one of `scipy.signal.resample_poly()`
+  and is designed only once per `(up, down)` pair.
+
+  Args:
+    fs: Original sampling frequency in Hz. Must be an integer.
+    target_fs: Target sampling frequency in Hz. Must be an integer.
+
+  Returns:
+    A tuple of the upsampling factor, the downsampling factor and the FIR
+    filter coefficients.
+  '''
+  if fs != int(fs) or target_fs != int(target_fs):
+    raise ValueError(
+        'Polyphase resampling requires integer sampling frequencies, '
+        'but got %s and %s' % (fs, target_fs))
+  ratio = fractions.Fraction(int(target_fs), int(fs))
+  up, down = ratio.numerator, ratio.denominator
+  if (up, down) not in _polyphase_filters:
+    max_rate = max(up, down)
+    _polyphase_filters[(up, down)] = firwin(
+        2 * 10 * max_rate + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+  return up, down, _polyphase_filters[(up, down)]
+
+
+def resample_waveforms(waveforms,
+                       fs,
+                       target_fs,
+                       target_num_samples=None,
+                       method='fft'):
+  '''Resample one or more equal-length waveforms to a target frequency.
+
+  Args:
+    waveforms: numpy array of shape `[..., num_samples]`. All the waveforms
+      are resampled along the last axis in one call.
+    fs: Sampling frequency of `waveforms` in Hz.
+    target_fs: Target sampling frequency in Hz.
+    target_num_samples: Optional length of the output waveforms. Defaults to
+      `floor(num_samples * target_fs / fs)`.
+    method: 'fft' for `scipy.signal.resample()`, or 'polyphase' for
+      `scipy.signal.resample_poly()`. The latter requires integer sampling
+      frequencies and is much faster for ratios such as 16 kHz to 44.1 kHz.
+
+  Returns:
+    Resampled waveforms as a float32 numpy array of shape
+    `[..., target_num_samples]`.
+  '''
+  num_samples = waveforms.shape[-1]
+  if target_num_samples is None:
+    target_num_samples = int(math.floor(num_samples * target_fs / fs))
+
+  if num_samples == target_num_samples:
+    return waveforms.astype('float32')
+  elif method == 'fft':
+    return resample(waveforms, target_num_samples, axis=-1).astype('float32')
+  elif method == 'polyphase':
+    up, down, window = get_polyphase_filter(fs, target_fs)
+    resampled = resample_poly(waveforms, up, down, axis=-1, window=window)
+    if resampled.shape[-1] < target_num_samples:
+      raise ValueError(
+          'Cannot resample %d samples at %s Hz to %d samples at %s Hz' %
+          (num_samples, fs, target_num_samples, target_fs))
+    return resampled[..., :target_num_samples].astype('float32')
+  else:
+    raise ValueError('Unrecognized resampling method: %s' % method)
+
+
+def read_and_resample_as_floats(wav_path, target_fs, resample_method='fft'):
   '''Read audio signal from wav file and resample it to target frequency.
 
   Args:
     wav_path: Path to the wav file.
     target_fs: Target sampling frequency.
+    resample_method: Resampling method, 'fft' or 'polyphase'. See
+      `resample_waveforms()`.
 
   Returns:
     Resampled signal.
   '''
-  fs, signal = read_as_floats(wav_path)
-  num_samples = signal.shape[0]
-  target_num_samples = int(math.floor(num_samples * target_fs / fs))
-
-  if len(signal) != target_num_samples:
-    resampled_x = resample(signal, target_num_samples).astype('float32')
-  else:
-    resampled_x = signal.astype('float32')
-  return resampled_x
+  fs, signal = read_as_int16(wav_path)
+  # resample_waveforms() always returns a new array, so the float buffer can
+  # be reused for the next file.
+  signal = int16_to_floats(signal, out=_get_float_buffer(len(signal)))
+  return resample_waveforms(signal, fs, target_fs, method=resample_method)
 
 
 def generate_noise_examples(noise_wav_path,
@@ -81,9 +215,15 @@ def generate_noise_examples(noise_wav_path,
                             target_fs,
                             sample_length,
                             noise_out_dir,
-                            file_begin_index=0):
+                            file_begin_index=0,
+                            resample_method='fft',
+                            bulk=False):
   '''Load examples from a raw noise .wav file.
 
+  The examples are processed one subfolder at a time: the snippets of a
+  subfolder are cut out with one vectorized gather, resampled in one batch
+  and written out as raw float32 data.
+
   Args:
     noise_wav_path: Path to the raw noise .wav file.
     num_noise_examples: Number of noise examples to extract from the .wav file.
@@ -92,36 +232,66 @@ def generate_noise_examples(noise_wav_path,
     sample_length: Length (in number of PCM samples) per example.
     noise_out_dir: Output directory for noise examples.
     file_begin_index: Begin naming output files at.
+    resample_method: Resampling method, 'fft' or 'polyphase'. See
+      `resample_waveforms()`.
+    bulk: Resample the entire noise recording once and cut the examples out
+      of the resampled signal, instead of resampling every example
+      separately. This is much faster when there are many examples. The
+      examples are not sample-for-sample identical to the non-bulk ones,
+      because the start of every example is rounded to a sample at
+      `target_fs`.
   '''
   print('noise_wav_path = %s; num_noise_examples = %s' %
         (noise_wav_path, num_noise_examples))
   print('Reading %s...' % noise_wav_path)
-  fs, signal = read_as_floats(noise_wav_path)
+  fs, signal = read_as_int16(noise_wav_path)
   fs_multiplier = target_fs / fs
   sample_length_0 = int(np.ceil(sample_length / fs_multiplier))
   max_begin_index = len(signal) - sample_length_0
 
   begin_indices = np.random.randint(0, max_begin_index, num_noise_examples)
-  for i, begin_index in enumerate(begin_indices):
-    subfolder = os.path.join(
-        noise_out_dir,
-        '%d' % int(math.floor(
-            (i + file_begin_index) / recordings_per_subfolder)))
+  if bulk:
+    profiling.count('generate_noise_examples', bytes_read=signal.nbytes)
+    signal = resample_waveforms(
+        int16_to_floats(signal), fs, target_fs, method=resample_method)
+    begin_indices = np.minimum(
+        np.round(begin_indices * fs_multiplier).astype(np.int64),
+        len(signal) - sample_length)
+    snippet_offsets = np.arange(sample_length)
+  else:
+    snippet_offsets = np.arange(sample_length_0)
+
+  file_indices = np.arange(num_noise_examples) + file_begin_index
+  subfolder_indices = file_indices // recordings_per_subfolder
+  for subfolder_index in np.unique(subfolder_indices):
+    subfolder = os.path.join(noise_out_dir, '%d' % subfolder_index)
     if not os.path.isdir(subfolder):
       os.makedirs(subfolder)
 
-    out_data_path = os.path.join(subfolder, '%.5d.dat' % (i + file_begin_index))
-    if os.path.exists(out_data_path):
-      raise ValueError('File already exists: %s' % out_data_path)
-    waveform = signal[begin_index : begin_index + sample_length_0]
-    resampled_waveform = resample(waveform, sample_length)
-
-    with open(out_data_path, 'wb') as out_file:
-      out_file.write(struct.pack(
-          'f' * len(resampled_waveform), *resampled_waveform))
-
-
-def load_and_normalize_waveform(wav_path, target_fs, frame_size):
+    in_subfolder = subfolder_indices == subfolder_index
+    waveforms = signal[begin_indices[in_subfolder, np.newaxis] +
+                       snippet_offsets]
+    if not bulk:
+      # Only the samples of the snippets are read from the memory-mapped
+      # file and converted to float.
+      profiling.count('generate_noise_examples', bytes_read=waveforms.nbytes)
+      waveforms = resample_waveforms(
+          int16_to_floats(waveforms), fs, target_fs,
+          target_num_samples=sample_length, method=resample_method)
+
+    for file_index, waveform in zip(file_indices[in_subfolder], waveforms):
+      out_data_path = os.path.join(subfolder, '%.5d.dat' % file_index)
+      if os.path.exists(out_data_path):
+        raise ValueError('File already exists: %s' % out_data_path)
+      waveform.tofile(out_data_path)
+    profiling.count('generate_noise_examples',
+                    clips=len(waveforms), bytes_written=waveforms.nbytes)
+
+
+def load_and_normalize_waveform(wav_path,
+                                target_fs,
+                                frame_size,
+                                resample_method='fft'):
   '''Load and normalize waveform from a wav file.
 
   The waveform is truncated so it contain an integer multiple of `frame_size`
@@ -131,36 +301,303 @@ def load_and_normalize_waveform(wav_path, target_fs, frame_size):
     wav_path: Path to the wav file.
     target_fs: Target sampling frequency.
     frame_size: Frame size in # of samples (at target_fs).
+    resample_method: Resampling method, 'fft' or 'polyphase'. See
+      `resample_waveforms()`.
 
   Return:
     Loaded and truncated waveform.
   '''
-  signal = read_and_resample_as_floats(wav_path, target_fs)
-  num_frames = int(len(signal) / frame_size)
-  if num_frames == 0:
-    raise ValueError(
-        'Encountered an wav file which will be 0 samples long if truncated: '
-        '%s' % wav_path)
-  return signal[:frame_size * num_frames]
+  return load_and_normalize_waveforms(
+      [wav_path], target_fs, frame_size, resample_method=resample_method)[0]
+
+
+def load_and_normalize_waveforms(wav_paths,
+                                 target_fs,
+                                 frame_size,
+                                 resample_method='fft'):
+  '''Load and normalize the waveforms of several wav files.
+
+  This is `load_and_normalize_waveform()` for every file, except that the
+  files with the same sampling frequency and length are resampled together,
+  in one `resample_waveforms()` call.
+
+  Args:
+    wav_paths: Paths to the wav files.
+    Other args: See `load_and_normalize_waveform()`.
+
+  Returns:
+    The loaded and truncated waveforms, as a `list` of float32 numpy arrays
+    in the order of `wav_paths`.
+  '''
+  signals = [read_as_int16(wav_path) for wav_path in wav_paths]
+  indices_by_fs_and_len = dict()
+  for i, (fs, signal) in enumerate(signals):
+    indices_by_fs_and_len.setdefault((fs, len(signal)), []).append(i)
+
+  waveforms = [None] * len(wav_paths)
+  for (fs, num_samples), indices in indices_by_fs_and_len.items():
+    # resample_waveforms() always returns a new array, so the float buffer
+    # can be reused for the next group.
+    batch = _get_float_buffer(len(indices) * num_samples).reshape(
+        [len(indices), num_samples])
+    for i, row in zip(indices, batch):
+      int16_to_floats(signals[i][1], out=row)
+    batch = resample_waveforms(batch, fs, target_fs, method=resample_method)
+    num_frames = batch.shape[-1] // frame_size
+    for i, waveform in zip(indices, batch):
+      if num_frames == 0:
+        raise ValueError(
+            'Encountered an wav file which will be 0 samples long if '
+            'truncated: %s' % wav_paths[i])
+      waveforms[i] = waveform[:frame_size * num_frames]
+  return waveforms
+
+
+# Lengths of the pieces of the filling snippets. Arbitrarily selected.
+_FILL_PIECE_LEN_MIN = 2000
+_FILL_PIECE_LEN_MAX = 5000
+
+
+def _draw_filling_piece_lens(x_len, fill_len, random_state=None):
+  '''Draw the lengths of the pieces of a filling snippet.
+
+  All the piece lengths are drawn at once, with a single call to
+  `random_state.randint()`. Pieces longer than `x_len` are shortened to
+  `x_len`, and the last piece is truncated so that they add up to
+  `fill_len`.
+
+  Returns:
+    An int numpy array of the piece lengths, in the order they are drawn.
+  '''
+  rng = np.random if random_state is None else random_state
+  max_num_pieces = fill_len // min(_FILL_PIECE_LEN_MIN, x_len) + 1
+  piece_lens = np.minimum(
+      rng.randint(_FILL_PIECE_LEN_MIN, _FILL_PIECE_LEN_MAX, max_num_pieces),
+      x_len)
+  piece_ends = np.cumsum(piece_lens)
+  num_pieces = np.searchsorted(piece_ends, fill_len) + 1
+  piece_lens = piece_lens[:num_pieces]
+  piece_lens[-1] -= piece_ends[num_pieces - 1] - fill_len
+  return piece_lens
+
+
+def _gather_pieces(piece_lens, piece_sources):
+  '''Get the gather indices of consecutive pieces.
+
+  Args:
+    piece_lens: Lengths of the pieces, as an int numpy array.
+    piece_sources: Source index of the first sample of every piece.
+
+  Returns:
+    An int numpy array of length `sum(piece_lens)`: the source indices of
+    the samples of all the pieces, one piece after another.
+  '''
+  piece_begins = np.cumsum(piece_lens) - piece_lens
+  return (np.arange(np.sum(piece_lens)) +
+          np.repeat(piece_sources - piece_begins, piece_lens))
+
+
+def get_filling_snippet(x, fill_len, fill_type, random_state=None, out=None):
+  '''Get a filling snippet made of pieces from the head or tail of x.
 
+  The filling snippet is a concatenation of pieces of random lengths between
+  2000 and 5000 samples (the last piece is truncated to fit `fill_len`).
+  For `fill_type == 'head'`, every piece is taken from the beginning of `x`
+  and the pieces are prepended in the order they are drawn; for 'tail', every
+  piece is taken from the end of `x` and the pieces are appended.
+
+  All the piece lengths are drawn at once and the snippet is gathered from
+  `x` with a single indexing operation, so the cost is linear in `fill_len`.
+
+  Args:
+    x: The waveform to take the pieces from, as a 1D numpy array.
+    fill_len: Length of the filling snippet in number of samples.
+    fill_type: 'head' or 'tail'.
+    random_state: Optional `numpy.random.RandomState` used for drawing the
+      piece lengths. If `None`, the global numpy random state is used.
+    out: Optional 1D numpy array of length `fill_len` to write the snippet
+      into.
 
-def get_filling_snippet(x, fill_len, fill_type):
-  # Constant filling snippet length. Arbitrarily selected.
-  fill_snippet_len_min = 2000
-  fill_snippet_len_max = 5000  
-  fill = np.zeros([0])
+  Returns:
+    The filling snippet, as a 1D numpy array of the same dtype as `x`.
+  '''
   if not (fill_type in ('head', 'tail')):
     raise ValueError('Unrecognized fill_type: %s' % fill_type)
-  while len(fill) < fill_len:
-    increment = int(np.random.randint(
-        fill_snippet_len_min, fill_snippet_len_max, [1])[0])
-    if increment + len(fill) > fill_len:
-      increment = fill_len - len(fill)
-    if fill_type == 'head':
-      fill = np.concatenate([x[:increment], fill])
+  piece_lens = _draw_filling_piece_lens(len(x), fill_len, random_state)
+  if fill_type == 'head':
+    indices = _gather_pieces(piece_lens[::-1], 0)
+  else:
+    indices = _gather_pieces(piece_lens, len(x) - piece_lens)
+  if out is None:
+    out = np.empty([fill_len], dtype=x.dtype)
+  return np.take(x, indices, out=out)
+
+
+def fill_waveforms(waveforms, match_len, random_state=None):
+  '''Fill short waveforms to a given length, in one batch.
+
+  Every waveform is padded with a filling snippet taken from its beginning
+  at the head and one taken from its end at the tail (see
+  `get_filling_snippet()`), so that it ends up in the middle. The tail snippet
+  is taken from the head-filled waveform.
+
+  Only the piece lengths are drawn waveform by waveform (in the same order
+  as `get_filling_snippet()` for the head and then the tail of every
+  waveform). The filled waveforms of the whole batch are then gathered from
+  the concatenated input waveforms with one index array.
+
+  Args:
+    waveforms: A `list` of 1D float32 numpy arrays, all no longer than
+      `match_len`. They may have different lengths.
+    match_len: Length of the filled waveforms.
+    random_state: Optional `numpy.random.RandomState` used for drawing the
+      filling snippets, or a `list` of them, one per waveform. If `None`, the
+      global numpy random state is used.
+
+  Returns:
+    A float32 numpy array of shape `[len(waveforms), match_len]`.
+  '''
+  if not isinstance(random_state, (list, tuple)):
+    random_state = [random_state] * len(waveforms)
+  out = np.empty([len(waveforms), match_len], dtype=np.float32)
+  # The pieces of the head and tail snippets of all the waveforms, as tuples
+  # of piece lengths, first source index and first destination index in the
+  # flattened output.
+  head_pieces = []
+  tail_pieces = []
+  for i, (waveform, rng) in enumerate(zip(waveforms, random_state)):
+    len_diff = match_len - len(waveform)
+    if len_diff < 0:
+      raise ValueError(
+          'Waveform length (%d) exceeds match_len (%d)' %
+          (len(waveform), match_len))
+    head_len = len_diff // 2
+    tail_len = len_diff - head_len
+    out[i, head_len : head_len + len(waveform)] = waveform
+    if head_len > 0:
+      piece_lens = _draw_filling_piece_lens(
+          len(waveform), head_len, rng)[::-1]
+      head_pieces.append((piece_lens, i * match_len + head_len,
+                          i * match_len))
+    if tail_len > 0:
+      filled_len = match_len - tail_len
+      piece_lens = _draw_filling_piece_lens(filled_len, tail_len, rng)
+      tail_pieces.append((piece_lens,
+                          i * match_len + filled_len - piece_lens,
+                          i * match_len + filled_len))
+
+  # The head snippets are gathered from the waveforms in the middle of the
+  # output. The tail snippets are gathered after them, because they may
+  # reach into the head snippets.
+  flat_out = out.reshape([-1])
+  for pieces in (head_pieces, tail_pieces):
+    if not pieces:
+      continue
+    piece_lens = np.concatenate([lens for lens, _, _ in pieces])
+    piece_sources = np.concatenate(
+        [np.broadcast_to(sources, lens.shape) for lens, sources, _ in pieces])
+    piece_dests = np.concatenate(
+        [dest + np.cumsum(lens) - lens for lens, _, dest in pieces])
+    flat_out[_gather_pieces(piece_lens, piece_dests)] = flat_out[
+        _gather_pieces(piece_lens, piece_sources)]
+  return out
+
+
+def load_and_split_waveform(in_wav_path,
+                            target_fs,
+                            frame_size,
+                            match_len=None,
+                            multi_splits=False,
+                            do_filling=True,
+                            random_state=None,
+                            resample_method='fft'):
+  '''Load the waveform(s) to be converted from a wav file.
+
+  The waveform is resampled and truncated, then split or filled to
+  `match_len` (if specified). See `convert()` for the arguments.
+
+  Returns:
+    The waveform(s) as a non-empty `list` of float32 `numpy.ndarray`s, all of
+    the same length.
+  '''
+  waveform = load_and_normalize_waveform(in_wav_path,
+                                         target_fs,
+                                         frame_size,
+                                         resample_method=resample_method)
+  return split_waveforms([waveform], [in_wav_path], match_len=match_len,
+                         multi_splits=multi_splits, do_filling=do_filling,
+                         random_state=random_state)[0]
+
+
+def split_waveforms(waveforms,
+                    in_wav_paths,
+                    match_len=None,
+                    multi_splits=False,
+                    do_filling=True,
+                    random_state=None):
+  '''Split or fill loaded waveforms to `match_len` (if specified).
+
+  The waveforms to be filled are filled together, in one `fill_waveforms()`
+  call.
+
+  Args:
+    waveforms: The waveforms, as returned by `load_and_normalize_waveforms()`.
+    in_wav_paths: Paths to the wav files of the waveforms, for logging.
+    random_state: Optional `numpy.random.RandomState` used for drawing the
+      filling snippets, or a `list` of them, one per waveform. If `None`, the
+      global numpy random state is used.
+    Other args: See `convert()`.
+
+  Returns:
+    A `list` with one item per waveform: the waveform(s) it is split or
+    filled into, as a non-empty `list` of float32 `numpy.ndarray`s, all of
+    the same length.
+  '''
+  if not isinstance(random_state, (list, tuple)):
+    random_state = [random_state] * len(waveforms)
+  out_waveforms = []
+  # Indices of the waveforms to be filled.
+  short_indices = []
+  for i, (waveform, in_wav_path) in enumerate(zip(waveforms, in_wav_paths)):
+    if match_len is None:
+      # Extract the entire waveform from the single .wav file.
+      out_waveforms.append([waveform])
+    elif len(waveform) > match_len:
+      if not multi_splits:
+        out_waveforms.append([waveform[:match_len]])
+      else:
+        splits = []
+        num_splits = int(np.ceil(len(waveform) / float(match_len)))
+        for split in range(num_splits):
+          start_index = match_len * split
+          end_index = match_len * (split + 1)
+          if end_index > len(waveform):
+            end_index = len(waveform)
+            start_index = end_index - match_len
+          print('Split %d of %d: %s: %d --> %d' %
+                (split + 1, num_splits, in_wav_path, start_index, end_index))
+          splits.append(waveform[start_index : end_index])
+        out_waveforms.append(splits)
+    elif len(waveform) < match_len and do_filling:
+      out_waveforms.append(None)
+      short_indices.append(i)
     else:
-      fill = np.concatenate([fill, x[len(x) - increment:]])
-  return fill
+      # I.e., len(waveform) == match_len
+      out_waveforms.append([waveform])
+
+  if short_indices:
+    filled_waveforms = fill_waveforms(
+        [waveforms[i] for i in short_indices], match_len,
+        [random_state[i] for i in short_indices])
+    for i, waveform in zip(short_indices, filled_waveforms):
+      orig_len = len(waveforms[i])
+      len_diff = match_len - orig_len
+      head_len = len_diff // 2
+      tail_len = len_diff - head_len
+      print('Filling: %s: (head=%d; tail=%d) %s --> %s' %
+            (in_wav_paths[i], head_len, tail_len, orig_len, match_len))
+      out_waveforms[i] = [waveform]
+  return out_waveforms
 
 
 def convert(in_wav_path,
@@ -169,7 +606,9 @@ def convert(in_wav_path,
             n_fft_out,
             match_len=None,
             multi_splits=False,
-            do_filling=True):
+            do_filling=True,
+            random_state=None,
+            resample_method='fft'):
   '''Convert an input wav file to a spectrogram.
 
   The data file consists of the resampled and truncated PCM samples.
@@ -190,6 +629,10 @@ def convert(in_wav_path,
       indices of 0, 4k and 6k, respetively.
     do_filling: Whether to perform filling for input waveforms
       shorter than match_len.
+    random_state: Optional `numpy.random.RandomState` used for drawing the
+      filling snippets. If `None`, the global numpy random state is used.
+    resample_method: Resampling method, 'fft' or 'polyphase'. See
+      `resample_waveforms()`.
 
   Returns:
     A tuple of two items:
@@ -202,53 +645,355 @@ def convert(in_wav_path,
   assert n_fft_out > 0
   assert n_fft_out <= frame_size
 
-  waveform = load_and_normalize_waveform(in_wav_path,
-                                         target_fs,
-                                         frame_size)
-  out_waveforms = []
-  if match_len is None:
-    # Extract the entire waveform from the single .wav file.
-    out_waveforms.append(waveform)
-  else:
-    if len(waveform) > match_len:
-      if not multi_splits:
-        out_waveforms.append(waveform[:match_len])
-      else:
-        num_splits = int(np.ceil(len(waveform) / float(match_len)))
-        for split in range(num_splits):
-          start_index = match_len * split
-          end_index = match_len * (split + 1)
-          if end_index > len(waveform):
-            end_index = len(waveform)
-            start_index = end_index - match_len
-          print('Split %d of %d: %s: %d --> %d' %
-                (split + 1, num_splits, in_wav_path, start_index, end_index))
-          out_waveforms.append(waveform[start_index : end_index])
+  out_waveforms = load_and_split_waveform(
+      in_wav_path, target_fs, frame_size, match_len=match_len,
+      multi_splits=multi_splits, do_filling=do_filling,
+      random_state=random_state, resample_method=resample_method)
+  spectrograms = list(spectrogram.waveforms_to_spectrograms(
+      out_waveforms, frame_size, n_fft_out))
+  return spectrograms, len(spectrograms[0]) * frame_size
 
-    elif len(waveform) < match_len and do_filling:
-      orig_len = len(waveform)
-      len_diff = match_len - orig_len
-      head_len = int(np.floor(len_diff / 2))
-      tail_len = len_diff - head_len
-      if head_len > 0:
-        waveform = np.concatenate([
-          get_filling_snippet(waveform, head_len, 'head'), waveform])
-      if tail_len > 0:
-        waveform = np.concatenate([
-            waveform, get_filling_snippet(waveform, tail_len, 'tail')])
-      assert len(waveform) == match_len, 'Length mismatch after filling'
-      print('Filling: %s: (head=%d; tail=%d) %s --> %s' %
-            (in_wav_path, head_len, tail_len, orig_len, match_len))
-      out_waveforms.append(waveform)
 
-    else:
-      # I.e., len(waveform) == match_len
-      out_waveforms.append(waveform)
+def _hash_file(path):
+  '''Get the SHA-1 hash of the content of a file, as a hex string.'''
+  hasher = hashlib.sha1()
+  with open(path, 'rb') as f:
+    hasher.update(f.read())
+  return hasher.hexdigest()
 
-  spectrograms = [
-      spectrogram.waveform_to_spectrogram(waveform, frame_size, n_fft_out)
-      for waveform in out_waveforms]
-  return spectrograms, len(spectrograms[0]) * frame_size
+
+def _file_seed(seed, content_hash):
+  '''Get the seed of the random state for filling a wav file.
+
+  The seed depends only on the seed of the run and on the content of the
+  file, not on the position of the file in the run. Hence it does not change
+  with `--words`, `--unknown_words` or `--test_split`, and neither does the
+  cache entry of a filled file.
+
+  Args:
+    seed: Integer seed of the run.
+    content_hash: Hash of the content of the wav file. See `_hash_file()`.
+
+  Returns:
+    An integer seed in `[0, 2**31 - 1)`.
+  '''
+  key = hashlib.sha1(('%d:%s' % (seed, content_hash)).encode('utf-8'))
+  return int(key.hexdigest()[:8], 16) % (2**31 - 1)
+
+
+def _cache_entry_path(cache_dir, content_hash, conversion_params):
+  '''Get the path to the cache entry of a wav file.
+
+  The cache key is the hash of the content of the wav file together with the
+  conversion parameters. The entry path does not depend on the path of the
+  wav file.
+  '''
+  hasher = hashlib.sha1(content_hash.encode('utf-8'))
+  hasher.update(repr((_CACHE_VERSION,) + conversion_params).encode('utf-8'))
+  key = hasher.hexdigest()
+  return os.path.join(cache_dir, key[:2], key + '.npz')
+
+
+def _read_cache_entry(entry_path, seed):
+  '''Read the spectrograms from a cache entry.
+
+  Args:
+    entry_path: Path to the cache entry.
+    seed: Seed of the random state for filling the wav file in this run.
+
+  Returns:
+    The cached spectrograms as a `list` of `numpy.ndarray`s, or `None` if
+    the entry does not exist or if it involved filling with a different seed.
+  '''
+  if not os.path.isfile(entry_path):
+    return None
+  with np.load(entry_path) as entry:
+    if entry['seed'] >= 0 and entry['seed'] != seed:
+      return None
+    spectrograms = list(entry['spectrograms'])
+  # Mark the entry as recently used, for evict_cache().
+  os.utime(entry_path, None)
+  return spectrograms
+
+
+def _write_cache_entry(entry_path, spectrograms, seed):
+  '''Write spectrograms to a cache entry.
+
+  The entry is written to a temporary file first and then renamed, so that
+  concurrent workers never read a partially-written entry.
+
+  Args:
+    entry_path: Path to the cache entry.
+    spectrograms: A `list` of spectrograms, as `numpy.ndarray`s.
+    seed: Seed of the random state used for filling, or -1 if no filling
+      (i.e., no randomness) was involved.
+  '''
+  entry_dir = os.path.dirname(entry_path)
+  if not os.path.isdir(entry_dir):
+    try:
+      os.makedirs(entry_dir)
+    except OSError:
+      # Another worker may have created the directory in the meantime.
+      if not os.path.isdir(entry_dir):
+        raise
+  tmp_path = '%s.%d.tmp' % (entry_path, os.getpid())
+  with open(tmp_path, 'wb') as f:
+    np.savez(f, spectrograms=np.stack(spectrograms), seed=seed)
+  os.rename(tmp_path, entry_path)
+
+
+def evict_cache(cache_dir, max_bytes):
+  '''Evict the least recently used cache entries.
+
+  Args:
+    cache_dir: The cache directory.
+    max_bytes: Maximum total size of the cache entries, in bytes. The least
+      recently used entries are deleted until the total size is within this
+      limit.
+
+  Returns:
+    The number of deleted entries.
+  '''
+  entries = []
+  for entry_path in glob.glob(os.path.join(cache_dir, '*', '*.npz')):
+    stat = os.stat(entry_path)
+    entries.append((stat.st_mtime, stat.st_size, entry_path))
+  entries.sort()
+  total_bytes = sum(size for _, size, _ in entries)
+  num_evicted = 0
+  for _, size, entry_path in entries:
+    if total_bytes <= max_bytes:
+      break
+    os.remove(entry_path)
+    total_bytes -= size
+    num_evicted += 1
+  return num_evicted
+
+
+def _random_state_used(random_state, seed):
+  '''Whether any numbers have been drawn from a freshly-seeded random state.'''
+  state = random_state.get_state()
+  initial_state = np.random.RandomState(seed).get_state()
+  return (state[2] != initial_state[2] or
+          not np.array_equal(state[1], initial_state[1]))
+
+
+def _convert_chunk(in_wav_paths,
+                   seed,
+                   target_fs,
+                   frame_size,
+                   n_fft_out,
+                   match_len=None,
+                   multi_splits=False,
+                   do_filling=True,
+                   cache_dir=None,
+                   resample_method='fft'):
+  '''Call `convert()` on a chunk of wav files, with batched resampling and STFT.
+
+  The files with the same sampling frequency and length are resampled in one
+  batch (see `load_and_normalize_waveforms()`), and the short waveforms are
+  filled in one batch (see `split_waveforms()`). The waveforms from all the
+  files are then grouped by length (with `match_len` set, they all have the
+  same length except for short ones that are not filled) and the
+  spectrograms of each group are computed in one batch.
+
+  This is a module-level function so that it can be pickled and sent to
+  the worker processes of a `multiprocessing.Pool`.
+
+  Args:
+    in_wav_paths: A `list` of wav file paths.
+    seed: Integer seed of the run. The random state for filling a file is
+      seeded with `_file_seed()` of this seed and the content of the file.
+    cache_dir: Optional directory of the conversion cache. Files found in the
+      cache are not converted again, and newly converted files are added to
+      the cache.
+    Other args: See `convert()`.
+
+  Returns:
+    A `list` of the `convert()` return values, one for each file.
+  '''
+  conversion_params = (target_fs, frame_size, n_fft_out, match_len,
+                       multi_splits, do_filling, resample_method)
+  results = [None] * len(in_wav_paths)
+  # Tuples of (index in chunk, seed, cache entry path).
+  misses = []
+  for i, in_path in enumerate(in_wav_paths):
+    content_hash = _hash_file(in_path)
+    file_seed = _file_seed(seed, content_hash)
+    entry_path = None
+    if cache_dir:
+      entry_path = _cache_entry_path(cache_dir, content_hash,
+                                     conversion_params)
+      cached_spectrograms = _read_cache_entry(entry_path, file_seed)
+      if cached_spectrograms is not None:
+        results[i] = (cached_spectrograms,
+                      len(cached_spectrograms[0]) * frame_size)
+        continue
+    misses.append((i, file_seed, entry_path))
+
+  loaded_waveforms = load_and_normalize_waveforms(
+      [in_wav_paths[i] for i, _, _ in misses], target_fs, frame_size,
+      resample_method=resample_method)
+  random_states = [np.random.RandomState(file_seed)
+                   for _, file_seed, _ in misses]
+  split_waveforms_by_file = split_waveforms(
+      loaded_waveforms, [in_wav_paths[i] for i, _, _ in misses],
+      match_len=match_len, multi_splits=multi_splits, do_filling=do_filling,
+      random_state=random_states)
+  # Tuples of (index in chunk, waveforms, seed, cache entry path).
+  converted = []
+  for (i, file_seed, entry_path), file_waveforms, random_state in zip(
+      misses, split_waveforms_by_file, random_states):
+    if not _random_state_used(random_state, file_seed):
+      file_seed = -1
+    converted.append((i, file_waveforms, file_seed, entry_path))
+  waveforms = [waveform for _, file_waveforms, _, _ in converted
+               for waveform in file_waveforms]
+
+  indices_by_len = dict()
+  for i, waveform in enumerate(waveforms):
+    indices_by_len.setdefault(len(waveform), []).append(i)
+  spectrograms = [None] * len(waveforms)
+  for indices in indices_by_len.values():
+    batch = spectrogram.waveforms_to_spectrograms(
+        [waveforms[i] for i in indices], frame_size, n_fft_out)
+    for i, spec in zip(indices, batch):
+      spectrograms[i] = spec
+
+  offset = 0
+  for i, file_waveforms, file_seed, entry_path in converted:
+    file_spectrograms = spectrograms[offset : offset + len(file_waveforms)]
+    offset += len(file_waveforms)
+    results[i] = (file_spectrograms, len(file_spectrograms[0]) * frame_size)
+    if entry_path:
+      _write_cache_entry(entry_path, file_spectrograms, file_seed)
+  return results
+
+
+class NpyAppender(object):
+  '''Writes equal-shaped arrays to a .npy file on disk as they come in.
+
+  Only the arrays passed to a single `append()` call are held in memory. The
+  .npy header is rewritten with the updated number of arrays after every
+  `append()` call, so at any time the file is a valid .npy file of shape
+  `[num_arrays_so_far, ...]`, which `np.load()` can read (and memory-map).
+  '''
+
+  # Fixed header size in bytes, large enough for a 3D float32 shape.
+  _HEADER_SIZE = 128
+
+  def __init__(self, path, dtype=np.float32):
+    '''Constructor of NpyAppender.
+
+    Args:
+      path: Path to the .npy file to write. Overwritten if it exists.
+      dtype: Data type of the arrays in the file.
+    '''
+    self._file = open(path, 'wb')
+    self._dtype = np.dtype(dtype)
+    self._item_shape = ()
+    self._count = 0
+    self._write_header()
+
+  def append(self, arrays):
+    '''Append arrays to the file.
+
+    Args:
+      arrays: An iterable of numpy arrays. All of them must have the same
+        shape as the previously appended ones.
+    '''
+    for array in arrays:
+      array = np.ascontiguousarray(array, dtype=self._dtype)
+      if not self._count:
+        self._item_shape = array.shape
+      elif array.shape != self._item_shape:
+        raise ValueError(
+            'Shape mismatch: %s vs. %s' % (array.shape, self._item_shape))
+      self._file.write(array.tobytes())
+      self._count += 1
+    self._write_header()
+
+  def close(self):
+    '''Close the file.
+
+    Returns:
+      The number of arrays written to the file.
+    '''
+    self._file.close()
+    return self._count
+
+  def _write_header(self):
+    header = repr({
+        'descr': np.lib.format.dtype_to_descr(self._dtype),
+        'fortran_order': False,
+        'shape': (self._count,) + self._item_shape}).encode('latin1')
+    magic = np.lib.format.magic(1, 0)
+    header_len = self._HEADER_SIZE - len(magic) - 2
+    if len(header) + 1 > header_len:
+      raise ValueError('Shape too long for .npy header: %s' % header)
+    self._file.seek(0)
+    self._file.write(magic + struct.pack('<H', header_len) +
+                     header.ljust(header_len - 1) + b'\n')
+    self._file.seek(0, os.SEEK_END)
+    self._file.flush()
+
+
+class ChunkScheduler(object):
+  '''Runs conversion chunks in a process pool, with a bounded backlog.
+
+  Unlike `multiprocessing.Pool.imap()`, which queues all the chunks at once
+  and lets the workers run arbitrarily far ahead of the consumer, at most
+  `max_in_flight` chunks are submitted to the pool and not yet consumed. The
+  finished results that wait for the consumer are therefore bounded by
+  `max_in_flight` chunks, whatever the number of files.
+
+  One scheduler can be shared by several directories: their chunks are
+  submitted in the order of the `imap()` calls, so that the pool stays busy
+  across directories. The results are expected to be consumed in the same
+  order. Consuming a later chunk first is allowed, but the chunks before it
+  are then submitted regardless of the bound.
+  '''
+
+  def __init__(self, pool, max_in_flight=None):
+    '''Constructor of ChunkScheduler.
+
+    Args:
+      pool: A `multiprocessing.Pool`.
+      max_in_flight: Maximum number of chunks submitted to the pool whose
+        results have not been consumed yet. Defaults to two per CPU, which
+        keeps every worker of a pool of up to that many CPUs busy.
+    '''
+    if max_in_flight is None:
+      max_in_flight = 2 * multiprocessing.cpu_count()
+    self._pool = pool
+    self._max_in_flight = max(1, max_in_flight)
+    # Tuples of (task index, function, chunk) not submitted yet.
+    self._pending = collections.deque()
+    # Mapping task index to the `AsyncResult` of a submitted chunk.
+    self._in_flight = dict()
+    self._num_tasks = 0
+
+  def imap(self, fn, chunks):
+    '''Queue the chunks and get an iterator of their results, in order.'''
+    task_indices = []
+    for chunk in chunks:
+      self._pending.append((self._num_tasks, fn, chunk))
+      task_indices.append(self._num_tasks)
+      self._num_tasks += 1
+    self._submit()
+    return (self._get(task_index) for task_index in task_indices)
+
+  def _submit(self, through=-1):
+    while self._pending and (len(self._in_flight) < self._max_in_flight or
+                             self._pending[0][0] <= through):
+      task_index, fn, chunk = self._pending.popleft()
+      self._in_flight[task_index] = self._pool.apply_async(fn, (chunk,))
+
+  def _get(self, task_index):
+    self._submit(through=task_index)
+    result = self._in_flight.pop(task_index).get()
+    self._submit()
+    return result
 
 
 def convert_wav_files_in_dir(input_dir,
@@ -262,7 +1007,12 @@ def convert_wav_files_in_dir(input_dir,
                              test_output_dir=None,
                              convert_wav_files_in_dir=False,
                              multi_splits=False,
-                             do_filling=True):
+                             do_filling=True,
+                             pool=None,
+                             chunk_size=32,
+                             cache_dir=None,
+                             resample_method='fft',
+                             seed=None):
   '''Convert wav files from input directory and write results output dir.
 
   Args:
@@ -291,11 +1041,73 @@ def convert_wav_files_in_dir(input_dir,
       indices of 0, 4k and 6k, respetively.
     do_filling: Whether to perform filling on input waveforms shorter than
       match_len.
+    pool: Optional `multiprocessing.Pool` or `ChunkScheduler`. If provided,
+      the wav files are converted in the worker processes of the pool. A
+      `multiprocessing.Pool` is wrapped in a `ChunkScheduler` with the
+      default bound.
+    chunk_size: Number of wav files to convert together. The spectrograms of
+      a chunk are computed in one batch, and a chunk is the unit of work sent
+      to `pool`.
+    cache_dir: Optional directory of the conversion cache. The results for
+      wav files whose content and conversion parameters are found in the
+      cache are read from there instead of being converted again.
+    resample_method: Resampling method, 'fft' or 'polyphase'. See
+      `resample_waveforms()`.
+    seed: Optional integer seed for the filling. The filling of a file
+      depends only on this seed and the content of the file. If `None`, a
+      seed is drawn from the global numpy random state.
 
   Returns:
     - The number of training examples.
     - The number of test examples.
   '''
+  finish = start_converting_wav_files_in_dir(
+      input_dir, output_dir, recordings_per_subfolder, target_fs, frame_size,
+      n_fft_out, match_len=match_len, test_split=test_split,
+      test_output_dir=test_output_dir, multi_splits=multi_splits,
+      do_filling=do_filling, pool=pool, chunk_size=chunk_size,
+      cache_dir=cache_dir, resample_method=resample_method, seed=seed)
+  return finish()
+
+
+def start_converting_wav_files_in_dir(input_dir,
+                                      output_dir,
+                                      recordings_per_subfolder,
+                                      target_fs,
+                                      frame_size,
+                                      n_fft_out,
+                                      match_len=None,
+                                      test_split=None,
+                                      test_output_dir=None,
+                                      multi_splits=False,
+                                      do_filling=True,
+                                      pool=None,
+                                      chunk_size=32,
+                                      cache_dir=None,
+                                      resample_method='fft',
+                                      seed=None):
+  '''Start converting the wav files from a directory.
+
+  All draws from the global numpy random state (the train/test split and,
+  if `seed` is `None`, the seed for the filling) happen in this call, in the
+  calling process. Hence the output does not depend on whether or how many
+  worker processes are used, as long as the global numpy random seed is the
+  same.
+
+  If `pool` is provided, the conversion tasks are queued into it
+  immediately. With a `ChunkScheduler` shared by several directories, this
+  lets the caller start all of them before waiting on any, so that the
+  workers are kept busy across directories, while the number of converted
+  chunks waiting to be written stays bounded. The directories must then be
+  finished in the order they were started.
+
+  See `convert_wav_files_in_dir()` for the arguments.
+
+  Returns:
+    A function that takes no arguments. It waits for the conversion to
+    complete, writes the spectrograms to the output directories and returns
+    the numbers of training and test examples.
+  '''
   assert frame_size > 0
   assert n_fft_out > 0
   assert n_fft_out <= frame_size
@@ -328,47 +1140,68 @@ def convert_wav_files_in_dir(input_dir,
     num_train = int(np.round((1.0 - test_split) * len(in_wav_paths)))
     train_wav_paths = [in_wav_paths[i] for i in indices[:num_train]]
     test_wav_paths = [in_wav_paths[i] for i in indices[num_train:]]
-
-  train_spectrograms = []
-  test_spectrograms = []
-  for n in range(2):
-    spectrograms = []
-    if n == 0:
-      split_in_path = train_wav_paths
-      split_out_path = output_dir
-    else:
-      if test_split is None:
-        break
-      split_in_path = test_wav_paths
-      split_out_path = test_output_dir
-
-    for i, in_path in enumerate(split_in_path):
-      file_basename = os.path.basename(in_path)
-      filename, extension_name = os.path.splitext(file_basename)
-      output_basename = (
-          filename + '.dat' if extension_name.lower() == '.wav' else filename)
-      spectrograms, converted_len = convert(
-          in_path, target_fs, frame_size, n_fft_out,
-          match_len=match_len, multi_splits=multi_splits, do_filling=do_filling)
+  if seed is None:
+    seed = np.random.randint(0, 2**31 - 1)
+
+  convert_fn = functools.partial(
+      _convert_chunk, seed=seed, target_fs=target_fs, frame_size=frame_size,
+      n_fft_out=n_fft_out, match_len=match_len, multi_splits=multi_splits,
+      do_filling=do_filling, cache_dir=cache_dir,
+      resample_method=resample_method)
+  tasks = train_wav_paths + test_wav_paths
+  chunks = [tasks[i : i + chunk_size]
+            for i in range(0, len(tasks), chunk_size)]
+  if pool is None:
+    chunk_results = map(convert_fn, chunks)
+  else:
+    if not isinstance(pool, ChunkScheduler):
+      pool = ChunkScheduler(pool)
+    chunk_results = pool.imap(convert_fn, chunks)
+  results = itertools.chain.from_iterable(chunk_results)
+
+  def finish():
+    with profiling.stage('convert_wav_files_in_dir'):
+      return _finish()
+
+  def _finish():
+    profiling.count(
+        'convert_wav_files_in_dir', clips=len(tasks),
+        bytes_read=sum(os.path.getsize(path) for path in tasks))
+    train_out_path = os.path.join(output_dir, 'spectrograms.npy')
+    train_writer = NpyAppender(train_out_path)
+    if test_split:
+      test_out_path = os.path.join(test_output_dir, 'spectrograms.npy')
+      test_writer = NpyAppender(test_out_path)
+    for i, in_path in enumerate(tasks):
+      spectrograms, converted_len = next(results)
       if match_len is not None and match_len != converted_len:
         print('  Skipped %s due to length mismatch (%d != %d)' %
               (in_path, converted_len, match_len))
-      if n == 0:
-        train_spectrograms.extend(spectrograms)
+      if i < len(train_wav_paths):
+        train_writer.append(spectrograms)
       else:
-        test_spectrograms.extend(spectrograms)
+        test_writer.append(spectrograms)
+
+    num_train = train_writer.close()
+    print("%s: train split--> %s" % (input_dir, train_out_path))
+    num_test = 0
+    bytes_written = os.path.getsize(train_out_path)
+    if test_split:
+      num_test = test_writer.close()
+      print("%s: test split--> %s" % (input_dir, test_out_path))
+      bytes_written += os.path.getsize(test_out_path)
+    profiling.count('convert_wav_files_in_dir',
+                    train_examples=num_train, test_examples=num_test,
+                    bytes_written=bytes_written)
+    return num_train, num_test
 
-  train_out_path = os.path.join(output_dir, 'spectrograms.npy')
-  np.save(train_out_path, np.stack(train_spectrograms))
-  print("%s: train split--> %s" % (input_dir, train_out_path))
-  if test_split:
-    test_out_path = os.path.join(test_output_dir, 'spectrograms.npy')
-    np.save(test_out_path, np.stack(test_spectrograms))
-    print("%s: test split--> %s" % (input_dir, test_out_path))
-  return len(train_spectrograms), len(test_spectrograms)
+  return finish
 
 
 def main():
+  if FLAGS.seed is not None:
+    np.random.seed(FLAGS.seed)
+
   if os.path.isdir(FLAGS.input_wav_path):
     nums_train_examples = []
     nums_test_examples = []
@@ -411,10 +1244,25 @@ def main():
     train_base = os.path.join(FLAGS.output_data_path, 'train')
     test_base = os.path.join(FLAGS.output_data_path, 'test')
     if os.path.isdir(train_base) or os.path.isdir(test_base):
-      raise ValueError('train or test subdirectory already exists.')
+      if not FLAGS.overwrite:
+        raise ValueError('train or test subdirectory already exists.')
+      print('Deleting existing train and test subdirectories')
+      shutil.rmtree(train_base, ignore_errors=True)
+      shutil.rmtree(test_base, ignore_errors=True)
     os.makedirs(train_base)
     os.makedirs(test_base)
 
+    pool = None
+    scheduler = None
+    if FLAGS.num_workers > 1:
+      print('Using %d worker processes' % FLAGS.num_workers)
+      pool = multiprocessing.Pool(FLAGS.num_workers)
+      scheduler = ChunkScheduler(pool, 2 * FLAGS.num_workers)
+
+    # Start the conversion of all words before waiting on any of them, so
+    # that a worker pool (if any) is shared across words. The scheduler
+    # bounds how far the workers run ahead of the words being written.
+    finishers = []
     for word in words:
       word_input_dir = os.path.join(FLAGS.input_wav_path, word)
       train_out_dir = os.path.join(
@@ -427,20 +1275,38 @@ def main():
       if multi_splits:
         print('*** Will use multiple splits for word "%s" ***' % word)
 
-      num_train_examples, num_test_examples = convert_wav_files_in_dir(
+      finishers.append(start_converting_wav_files_in_dir(
           word_input_dir, train_out_dir,
           FLAGS.recordings_per_subfolder, FLAGS.target_fs,
           FLAGS.frame_size, FLAGS.n_fft_out, FLAGS.match_len,
           FLAGS.test_split, test_out_dir,
           multi_splits=multi_splits,
-          do_filling=(not FLAGS.no_filling))
+          do_filling=(not FLAGS.no_filling),
+          pool=scheduler,
+          chunk_size=FLAGS.chunk_size,
+          cache_dir=FLAGS.cache_dir,
+          resample_method=FLAGS.resample_method,
+          seed=FLAGS.seed))
+
+    for finish in finishers:
+      num_train_examples, num_test_examples = finish()
       nums_train_examples.append(num_train_examples)
       nums_test_examples.append(num_test_examples)
+    if pool is not None:
+      pool.close()
+      pool.join()
+    if FLAGS.cache_dir:
+      with profiling.stage('evict_cache'):
+        num_evicted = evict_cache(FLAGS.cache_dir,
+                                  FLAGS.cache_max_gb * 1024 * 1024 * 1024)
+      print('Evicted %d entries from cache %s' % (num_evicted, FLAGS.cache_dir))
   elif os.path.isfile(FLAGS.input_wav_path):
-    convert(FLAGS.input_wav_path,
-            FLAGS.target_fs,
-            FLAGS.frame_size,
-            FLAGS.n_fft_out)
+    with profiling.stage('convert'):
+      convert(FLAGS.input_wav_path,
+              FLAGS.target_fs,
+              FLAGS.frame_size,
+              FLAGS.n_fft_out,
+              resample_method=FLAGS.resample_method)
   else:
     raise ValueError('Nonexistent input path %s' % FLAGS.input_wav_path)
 
@@ -465,10 +1331,14 @@ def main():
             FLAGS.output_data_path, split, _BACKGROUND_NOISE_DIR)
         if not os.path.isdir(out_dir):
           os.makedirs(out_dir)
-        generate_noise_examples(
-            raw_noise_wav_path, num_examples, FLAGS.recordings_per_subfolder,
-            FLAGS.target_fs, FLAGS.match_len, out_dir,
-            file_begin_index=begin_file_index)
+        with profiling.stage('generate_noise_examples'):
+          generate_noise_examples(
+              raw_noise_wav_path, num_examples,
+              FLAGS.recordings_per_subfolder, FLAGS.target_fs,
+              FLAGS.match_len, out_dir,
+              file_begin_index=begin_file_index,
+              resample_method=FLAGS.resample_method,
+              bulk=FLAGS.bulk_noise)
         begin_file_index += num_examples
 
 
@@ -500,6 +1370,11 @@ if __name__ == '__main__':
       'various kinds of background noises inside the _background_noise_ '
       'directory. N.B., these noise samples are separate examples, and _not_ '
       'additive noises to the word examples.')
+  parser.add_argument(
+      '--bulk_noise', action='store_true',
+      help='With --include_noise, resample every long background noise '
+      'recording once and cut the noise examples out of the resampled '
+      'signal, instead of resampling every example separately.')
   parser.add_argument(
       '--test_split', type=float, default=0.15,
       help='The fraction of files to split out for testing. Must be a '
@@ -511,6 +1386,13 @@ if __name__ == '__main__':
       'The input signals in the .wav files will be resampled.'
       'This should match the sampling frequency of AudioContexts in '
       'the browser.')
+  parser.add_argument(
+      '--resample_method', type=str, default='fft',
+      choices=('fft', 'polyphase'),
+      help='Method for resampling the .wav files to --target_fs. "fft" uses '
+      'scipy.signal.resample. "polyphase" uses scipy.signal.resample_poly, '
+      'which is much faster for rational ratios such as 16 kHz to 44.1 kHz, '
+      'but requires integer sampling frequencies.')
   parser.add_argument(
       '--frame_size', type=int, default=1024,
       help='Frame size at target frequency.')
@@ -530,6 +1412,35 @@ if __name__ == '__main__':
   parser.add_argument(
       '--all_words_multi_splits', action='store_true',
       help='Use multi-splits on all words (not just _background_noise_)')
+  parser.add_argument(
+      '--num_workers', type=int, default=1,
+      help='Number of worker processes for converting the .wav files. '
+      'The conversion tasks of all words share one process pool. The output '
+      'is identical to that of a single-process run with the same --seed '
+      'and --chunk_size.')
+  parser.add_argument(
+      '--chunk_size', type=int, default=32,
+      help='Number of .wav files whose spectrograms are computed together '
+      'in one batch. This is also the unit of work for --num_workers.')
+  parser.add_argument(
+      '--cache_dir', type=str, default=None,
+      help='Optional directory for caching the conversion result of every '
+      '.wav file, keyed by the file content and the conversion parameters. '
+      'With the cache, a re-run converts only new or changed .wav files.')
+  parser.add_argument(
+      '--cache_max_gb', type=float, default=20.0,
+      help='Maximum size of --cache_dir in GB. The least recently used '
+      'entries are evicted at the end of a run to stay within this size.')
+  parser.add_argument(
+      '--overwrite', action='store_true',
+      help='Delete the train and test subdirectories of output_data_path if '
+      'they already exist, instead of refusing to run.')
+  parser.add_argument(
+      '--seed', type=int, default=None,
+      help='Optional random seed for the train/test split and the filling. '
+      'The filling of a file depends only on this seed and the file content.')
+  profiling.add_arguments(parser)
   FLAGS, _ = parser.parse_known_args()
 
-  main()
+  with profiling.session(FLAGS.profile, FLAGS.cprofile):
+    main()
@@ -0,0 +1,202 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Opt-in instrumentation of the stages of the speech-command pipeline.
+
+The instrumentation is off by default, and then `stage()` and `count()` do
+nothing. It is turned on for a run of `prep_wavs.py` or `model.py` with
+`--profile`, or with the `SPEECH_COMMAND_PROFILE` environment variable:
+
+```sh
+python prep_wavs.py --profile profile.json --cprofile prep.pstats ...
+SPEECH_COMMAND_PROFILE=- python model.py ...
+```
+
+For every stage, the summary has the number of calls, the wall time (summed
+over the calls, which may overlap if they run in threads), the counters
+recorded with `count()` (e.g., clips, bytes read and written, kept and
+discarded spectrograms) and the peak RSS of the process and its children
+at the end of the stage.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows. The peak RSS is then not reported.
+  resource = None
+
+
+PROFILE_ENV = 'SPEECH_COMMAND_PROFILE'
+CPROFILE_ENV = 'SPEECH_COMMAND_CPROFILE'
+
+_profiler = None
+
+
+class Profiler(object):
+  '''Records the wall time, counters and peak RSS of pipeline stages.'''
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._stages = collections.OrderedDict()
+    self._begin_time = time.time()
+
+  def _get_stage(self, name):
+    if name not in self._stages:
+      self._stages[name] = collections.OrderedDict(
+          [('calls', 0), ('seconds', 0.0)])
+    return self._stages[name]
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    t0 = time.time()
+    try:
+      yield
+    finally:
+      seconds = time.time() - t0
+      peak_rss = get_peak_rss_bytes()
+      with self._lock:
+        stage = self._get_stage(name)
+        stage['calls'] += 1
+        stage['seconds'] += seconds
+        if peak_rss is not None:
+          stage['peak_rss_bytes'] = max(
+              stage.get('peak_rss_bytes', 0), peak_rss)
+
+  def count(self, name, **counters):
+    with self._lock:
+      stage = self._get_stage(name)
+      for key in sorted(counters):
+        stage[key] = stage.get(key, 0) + counters[key]
+
+  def summary(self):
+    with self._lock:
+      return collections.OrderedDict([
+          ('argv', sys.argv),
+          ('seconds', time.time() - self._begin_time),
+          ('peak_rss_bytes', get_peak_rss_bytes()),
+          ('stages', json.loads(json.dumps(self._stages))),
+      ])
+
+
+def get_peak_rss_bytes():
+  '''Get the peak RSS of this process and its (waited-for) children.
+
+  Returns:
+    The larger of the two peak RSS values in bytes, or `None` if it is not
+    available on this platform.
+  '''
+  if resource is None:
+    return None
+  peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+  # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def stage(name):
+  '''Time a stage, if profiling is enabled.
+
+  Usage:
+
+  ```python
+  with profiling.stage('load_dataset/gather'):
+    ...
+  ```
+
+  Args:
+    name: Name of the stage.
+
+  Returns:
+    A context manager.
+  '''
+  if _profiler is None:
+    return _null_context()
+  return _profiler.stage(name)
+
+
+def count(name, **counters):
+  '''Add to the counters of a stage, if profiling is enabled.
+
+  Args:
+    name: Name of the stage.
+    **counters: Numbers to add to the counters of the same names.
+  '''
+  if _profiler is not None:
+    _profiler.count(name, **counters)
+
+
+@contextlib.contextmanager
+def _null_context():
+  yield
+
+
+def add_arguments(parser):
+  '''Add the --profile and --cprofile flags to an argparse parser.'''
+  parser.add_argument(
+      '--profile', type=str, nargs='?', const='-',
+      default=os.environ.get(PROFILE_ENV),
+      help='Record the wall time, bytes, clips and peak RSS of every stage, '
+      'and write a JSON summary to this path at the end ("-" or no value: '
+      'print it). Defaults to the %s environment variable.' % PROFILE_ENV)
+  parser.add_argument(
+      '--cprofile', type=str, default=os.environ.get(CPROFILE_ENV),
+      help='Optional path to dump cProfile statistics of the main process '
+      'to, for use with pstats or snakeviz. Defaults to the %s environment '
+      'variable.' % CPROFILE_ENV)
+
+
+@contextlib.contextmanager
+def session(summary_path=None, cprofile_path=None):
+  '''Enable profiling for the duration of a `with` block.
+
+  Args:
+    summary_path: Path to write the JSON summary to, or '-' to print it.
+      If `None`, the stages are not instrumented.
+    cprofile_path: Optional path to dump cProfile statistics to.
+  '''
+  global _profiler
+  if summary_path:
+    _profiler = Profiler()
+  cprofiler = None
+  if cprofile_path:
+    cprofiler = cProfile.Profile()
+    cprofiler.enable()
+  try:
+    yield
+  finally:
+    if cprofiler is not None:
+      cprofiler.disable()
+      cprofiler.dump_stats(cprofile_path)
+      print('Wrote cProfile statistics to %s' % cprofile_path)
+    if summary_path:
+      summary_json = json.dumps(_profiler.summary(), indent=2)
+      _profiler = None
+      if summary_path == '-':
+        print(summary_json)
+      else:
+        with open(summary_path, 'wt') as f:
+          f.write(summary_json)
+        print('Wrote profile summary to %s' % summary_path)
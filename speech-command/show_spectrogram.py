@@ -3,21 +3,17 @@ from __future__ import print_function
 
 import argparse
 import os
-import struct
 
 from matplotlib import pyplot as plt
 import numpy as np
 
+import data as data_lib
+
 
 def plot_spectrogram(input_file_name):
-  with open(os.path.expanduser(input_file_name), 'rb') as f:
-    buff = f.read()
-    buffer_len = len(buff)
-    num_floats = int(buffer_len / 4)
-    print('num_floats = %s' % num_floats)
-    data = np.array(struct.unpack('=%df' % num_floats, buff))
-    print(data.shape)
-    data = np.flipud(data.reshape([int(num_floats / 1024), 1024]).T[:360, :])
+  data = data_lib.read_dat(os.path.expanduser(input_file_name), 1024)
+  print(data.shape)
+  data = np.flipud(data.T[:360, :])
 
   fig = plt.figure()
   fig.add_subplot(111)
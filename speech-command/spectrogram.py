@@ -3,6 +3,7 @@ from __future__ import print_function
 
 import numpy as np
 from scipy import fftpack
+from scipy import signal
 
 
 target_fs = 44100
@@ -23,26 +24,204 @@ def make_window(length):
 windows = dict()  # Mapping n_fft to window, for memoization.
 
 
-def waveform_to_spectrogram(waveform, n_fft, n_fft_out):
-  waveform_len = len(waveform)
+def _get_window(n_fft):
   if n_fft not in windows:
     windows[n_fft] = make_window(2 * n_fft)
-  window = windows[n_fft]
-
-  n_seg = 0
-  spectra = []
-  while n_fft * (n_seg + 1) <= waveform_len:
-    if n_seg == 0:
-      x_seg = np.concatenate([
-          np.zeros([n_fft], dtype=waveform.dtype),
-          waveform[:n_fft]])
-    else:
-      x_seg = waveform[n_fft * (n_seg - 1) : n_fft * (n_seg + 1)]
-    x_seg *= window
-    # NOTE(cais): This should fully replicate WebAudio AnalyzerNode's
-    # GetFloatFrequencyData(), up to a added constant.
-    spectrum = 20 * np.log10(
-        np.abs(np.fft.fft(x_seg)).astype(np.float32) / n_fft)
-    spectra.append(spectrum[:n_fft_out])
-    n_seg += 1
-  return np.stack(spectra)
+  return windows[n_fft]
+
+
+def _frame(waveforms, n_fft):
+  '''Get the overlapping 2 * n_fft-long frames of waveforms.
+
+  Frame `i` covers samples `[n_fft * (i - 1), n_fft * (i + 1))` of a
+  waveform, with the samples before the beginning of the waveform taken to
+  be zero. The frames are a read-only strided view into a zero-padded copy
+  of the waveforms, so the input is never written to.
+
+  Args:
+    waveforms: numpy array of shape `[..., waveform_len]`.
+    n_fft: Hop size (half the frame length) in number of samples.
+
+  Returns:
+    A numpy array of shape `[..., num_frames, 2 * n_fft]`, where `num_frames`
+    is `waveform_len // n_fft`.
+  '''
+  num_frames = waveforms.shape[-1] // n_fft
+  padded = np.zeros(waveforms.shape[:-1] + (n_fft * (num_frames + 1),),
+                    dtype=waveforms.dtype)
+  padded[..., n_fft:] = waveforms[..., :n_fft * num_frames]
+  stride = padded.strides[-1]
+  return np.lib.stride_tricks.as_strided(
+      padded, shape=padded.shape[:-1] + (num_frames, 2 * n_fft),
+      strides=padded.strides[:-1] + (n_fft * stride, stride),
+      writeable=False)
+
+
+def smooth_magnitudes(magnitudes, smoothing_time_constant, initial=None):
+  '''Average linear magnitude spectra over time, like AnalyserNode.
+
+  WebAudio's AnalyserNode blends every new magnitude spectrum with the
+  previous (smoothed) one: `y[t] = k * y[t - 1] + (1 - k) * x[t]`, where `k`
+  is its `smoothingTimeConstant` and `y[-1]` is zero.
+
+  Args:
+    magnitudes: numpy array of linear magnitudes, of shape
+      `[..., num_frames, num_bins]`.
+    smoothing_time_constant: `k`, between 0.0 (no smoothing) and 1.0.
+    initial: Optional smoothed magnitudes before the first frame, `y[-1]`,
+      of shape `[..., num_bins]`. Defaults to zeros.
+
+  Returns:
+    The smoothed magnitudes, as a numpy array of the same shape and dtype.
+  '''
+  if not 0.0 <= smoothing_time_constant <= 1.0:
+    raise ValueError(
+        'smoothing_time_constant must be between 0.0 and 1.0, but got %s' %
+        smoothing_time_constant)
+  if not smoothing_time_constant:
+    return magnitudes
+  k = smoothing_time_constant
+  zi = None
+  if initial is not None:
+    zi = k * np.expand_dims(initial, -2)
+  smoothed = signal.lfilter([1.0 - k], [1.0, -k], magnitudes, axis=-2, zi=zi)
+  if zi is not None:
+    smoothed = smoothed[0]
+  return smoothed.astype(magnitudes.dtype)
+
+
+def _frames_to_magnitudes(frames, n_fft, n_fft_out):
+  x = frames * _get_window(n_fft)
+  return np.abs(np.fft.rfft(x, axis=-1)[..., :n_fft_out]).astype(np.float32)
+
+
+def _magnitudes_to_decibels(magnitudes, n_fft):
+  # NOTE(cais): This should fully replicate WebAudio AnalyzerNode's
+  # GetFloatFrequencyData(), up to a added constant.
+  return 20 * np.log10(magnitudes / n_fft)
+
+
+def _frames_to_spectra(frames, n_fft, n_fft_out, smoothing_time_constant=0.0):
+  if not frames.shape[-2]:
+    raise ValueError('Waveform is too short for n_fft = %d' % n_fft)
+  magnitudes = _frames_to_magnitudes(frames, n_fft, n_fft_out)
+  magnitudes = smooth_magnitudes(magnitudes, smoothing_time_constant)
+  return _magnitudes_to_decibels(magnitudes, n_fft)
+
+
+def waveform_to_spectrogram(waveform, n_fft, n_fft_out,
+                            smoothing_time_constant=0.0):
+  '''Compute the spectrogram of a waveform.
+
+  The frames are 2 * n_fft long and hop by n_fft samples. They are windowed
+  and transformed all at once. The input waveform is not modified.
+
+  Args:
+    waveform: 1D numpy array of the waveform, of dtype float32.
+    n_fft: Hop size in number of samples. Half the frame length.
+    n_fft_out: Number of frequency bins to keep. Must be <= n_fft + 1.
+    smoothing_time_constant: The `smoothingTimeConstant` of AnalyserNode.
+      See `smooth_magnitudes()`.
+
+  Returns:
+    A float32 numpy array of shape `[len(waveform) // n_fft, n_fft_out]`.
+  '''
+  return _frames_to_spectra(_frame(np.asarray(waveform), n_fft),
+                            n_fft, n_fft_out, smoothing_time_constant)
+
+
+def waveforms_to_spectrograms(waveforms, n_fft, n_fft_out,
+                              smoothing_time_constant=0.0):
+  '''Compute the spectrograms of a batch of equal-length waveforms.
+
+  Equivalent to calling `waveform_to_spectrogram()` on every waveform, but
+  with all the frames of all the waveforms transformed in one pass.
+
+  Args:
+    waveforms: numpy array of shape `[N, waveform_len]`, or a `list` of N
+      1D numpy arrays of the same length.
+    n_fft: Hop size in number of samples. Half the frame length.
+    n_fft_out: Number of frequency bins to keep. Must be <= n_fft + 1.
+    smoothing_time_constant: The `smoothingTimeConstant` of AnalyserNode.
+      See `smooth_magnitudes()`. Every waveform is smoothed separately.
+
+  Returns:
+    A float32 numpy array of shape `[N, waveform_len // n_fft, n_fft_out]`.
+  '''
+  waveforms = np.asarray(waveforms)
+  if waveforms.ndim != 2:
+    raise ValueError(
+        'Expected waveforms to be 2D, but got shape %s' % (waveforms.shape,))
+  return _frames_to_spectra(_frame(waveforms, n_fft), n_fft, n_fft_out,
+                            smoothing_time_constant)
+
+
+class StreamingSpectrogram(object):
+  '''Incremental spectrogram of an audio stream.
+
+  The samples are pushed in chunks of any length. Every time a hop of `n_fft`
+  samples is complete, one new frame is computed, from that hop and the
+  previous one. Only the new frames are transformed, all at once per push.
+  The frames are the same as those of `waveform_to_spectrogram()` on the
+  concatenation of the chunks.
+  '''
+
+  def __init__(self, n_fft, n_fft_out, smoothing_time_constant=0.0):
+    '''Constructor of StreamingSpectrogram.
+
+    Args:
+      n_fft: Hop size in number of samples. Half the frame length.
+      n_fft_out: Number of frequency bins to keep. Must be <= n_fft + 1.
+      smoothing_time_constant: The `smoothingTimeConstant` of AnalyserNode.
+        See `smooth_magnitudes()`.
+    '''
+    self._n_fft = n_fft
+    self._n_fft_out = n_fft_out
+    self._smoothing_time_constant = smoothing_time_constant
+    # The previous hop, followed by the samples of the incomplete hop.
+    self._buffer = np.zeros([n_fft], dtype=np.float32)
+    self._num_buffered = n_fft
+    self._magnitudes = None
+    self.num_frames = 0
+
+  def push(self, samples):
+    '''Push samples and compute the frames they complete.
+
+    Args:
+      samples: 1D numpy array of float samples.
+
+    Returns:
+      The new frames, as a float32 numpy array of shape
+      `[num_new_frames, n_fft_out]`. `num_new_frames` may be 0.
+    '''
+    n_fft = self._n_fft
+    num_total = self._num_buffered + len(samples)
+    if len(self._buffer) < num_total:
+      buf = np.empty([max(num_total, 2 * len(self._buffer))],
+                     dtype=np.float32)
+      buf[:self._num_buffered] = self._buffer[:self._num_buffered]
+      self._buffer = buf
+    self._buffer[self._num_buffered : num_total] = samples
+    self._num_buffered = num_total
+
+    num_new_frames = num_total // n_fft - 1
+    if num_new_frames <= 0:
+      return np.zeros([0, self._n_fft_out], dtype=np.float32)
+    stride = self._buffer.strides[0]
+    frames = np.lib.stride_tricks.as_strided(
+        self._buffer, shape=(num_new_frames, 2 * n_fft),
+        strides=(n_fft * stride, stride), writeable=False)
+    magnitudes = _frames_to_magnitudes(frames, n_fft, self._n_fft_out)
+    if self._smoothing_time_constant:
+      magnitudes = smooth_magnitudes(
+          magnitudes, self._smoothing_time_constant, initial=self._magnitudes)
+      self._magnitudes = magnitudes[-1]
+    spectra = _magnitudes_to_decibels(magnitudes, n_fft)
+
+    # Keep the last complete hop and the incomplete one.
+    consumed = num_new_frames * n_fft
+    self._num_buffered -= consumed
+    self._buffer[:self._num_buffered] = (
+        self._buffer[consumed : consumed + self._num_buffered])
+    self.num_frames += num_new_frames
+    return spectra
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Streaming speech-command recognition over long audio.
+
+This is the offline counterpart of `speech-command-recognizer.js`. The audio
+is read in chunks, from a (long) .wav file or as raw 16-bit PCM from stdin.
+The spectrogram is updated incrementally with
+`spectrogram.StreamingSpectrogram`. The model is run on the last
+`data.NUM_FRAMES_CUTOFF` frames every `--stride_frames` frames.
+
+Usage example:
+
+```sh
+python streaming_recognizer.py path/to/long_recording.wav \
+    --stride_frames 11 --threshold 0.8 --output recognitions.csv
+arecord -f S16_LE -r 44100 -c 1 | \
+    python streaming_recognizer.py - --input_fs 44100
+```
+
+For every model run, the output has the time (in seconds) of the end of the
+window, the top word and its probability. With `--threshold`, only the runs
+whose top word is not `_background_noise_` or `_unknown_` and whose
+probability is at least the threshold are written.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import math
+import sys
+import time
+
+import numpy as np
+from scipy.signal import resample_poly
+
+import data
+import infer
+import prep_wavs
+import spectrogram
+
+
+_NON_WORD_LABELS = ('_background_noise_', '_unknown_')
+
+
+class StreamingResampler(object):
+  '''Polyphase resampling of an audio stream, chunk by chunk.
+
+  Every push resamples the new samples with enough context on both sides for
+  the FIR filter, so that the output is the same as that of
+  `scipy.signal.resample_poly()` on the whole stream (up to float rounding).
+  The output lags the input by the right context.
+  '''
+
+  def __init__(self, fs, target_fs):
+    '''Constructor of StreamingResampler.
+
+    Args:
+      fs: Sampling frequency of the input in Hz. Must be an integer.
+      target_fs: Target sampling frequency in Hz. Must be an integer.
+    '''
+    self._up, self._down, self._window = prep_wavs.get_polyphase_filter(
+        fs, target_fs)
+    # Filter half-length in input samples, rounded up to a multiple of
+    # `down`, so that every segment begins at an output sample.
+    half_len = (len(self._window) // 2) / self._up + 1
+    self._context = int(math.ceil(half_len / self._down)) * self._down
+    # The left context, followed by the samples not resampled yet.
+    self._buffer = np.zeros([self._context], dtype=np.float32)
+    self._num_buffered = self._context
+    self._num_pushed = 0
+    self._num_output = 0
+
+  def push(self, samples):
+    '''Push float samples and get the resampled samples that are complete.'''
+    self._append(samples)
+    self._num_pushed += len(samples)
+    available = self._num_buffered - 2 * self._context
+    available -= available % self._down
+    if available <= 0:
+      return np.zeros([0], dtype=np.float32)
+    return self._resample(available)
+
+  def flush(self):
+    '''Get the remaining resampled samples at the end of the stream.'''
+    available = self._num_buffered - self._context
+    pad_len = 2 * self._context + (-available % self._down)
+    self._append(np.zeros([pad_len], dtype=np.float32))
+    out = self._resample(available + (-available % self._down))
+    num_total = int(math.ceil(self._num_pushed * self._up / self._down))
+    return out[:max(0, num_total - (self._num_output - len(out)))]
+
+  def _append(self, samples):
+    num_total = self._num_buffered + len(samples)
+    if len(self._buffer) < num_total:
+      buf = np.empty([max(num_total, 2 * len(self._buffer))],
+                     dtype=np.float32)
+      buf[:self._num_buffered] = self._buffer[:self._num_buffered]
+      self._buffer = buf
+    self._buffer[self._num_buffered : num_total] = samples
+    self._num_buffered = num_total
+
+  def _resample(self, num_samples):
+    segment = self._buffer[:num_samples + 2 * self._context]
+    resampled = resample_poly(segment, self._up, self._down,
+                              window=self._window)
+    begin = self._context * self._up // self._down
+    out = resampled[begin : begin + num_samples * self._up // self._down]
+    # Keep the context of the next segment and the samples after it.
+    self._num_buffered -= num_samples
+    self._buffer[:self._num_buffered] = (
+        self._buffer[num_samples : num_samples + self._num_buffered])
+    self._num_output += len(out)
+    return out.astype(np.float32)
+
+
+class StreamingRecognizer(object):
+  '''Runs a model on a sliding window over a stream of audio.
+
+  The last `NUM_FRAMES_CUTOFF` frames are held in a ring buffer that is
+  stored twice in a row, so that the current window is always a contiguous
+  slice. All the windows completed by one push are normalized and run
+  through the model in one batch.
+  '''
+
+  def __init__(self, model, metadata, frame_size=1024, stride_frames=11,
+               smoothing_time_constant=0.0):
+    '''Constructor of StreamingRecognizer.
+
+    Args:
+      model: The model saved by model.py, as loaded by `infer.load_model()`.
+      metadata: The metadata `dict` saved by model.py.
+      frame_size: Hop size of the spectrogram in number of samples, as in
+        prep_wavs.py.
+      stride_frames: Run the model every this many frames.
+      smoothing_time_constant: The `smoothingTimeConstant` of AnalyserNode.
+    '''
+    self._model = model
+    self._n_fft = metadata['frameSize']
+    self._normalization = metadata.get('normalization', {'mode': 'example'})
+    self._stride_frames = stride_frames
+    self._num_frames = data.NUM_FRAMES_CUTOFF
+    self._stream = spectrogram.StreamingSpectrogram(
+        frame_size, self._n_fft,
+        smoothing_time_constant=smoothing_time_constant)
+    self._ring = np.zeros([2 * self._num_frames, self._n_fft],
+                          dtype=np.float32)
+    self.frame_count = 0
+
+  def push(self, samples):
+    '''Push samples at the sampling frequency of the training data.
+
+    Args:
+      samples: 1D numpy array of float samples.
+
+    Returns:
+      - The frame counts at the ends of the windows that the model was run
+        on, as an int numpy array.
+      - The probabilities of the words for these windows, as a numpy array
+        of shape `[num_windows, num_words]`.
+    '''
+    windows = []
+    ends = []
+    for frame in self._stream.push(samples):
+      pos = self.frame_count % self._num_frames
+      self._ring[pos] = frame
+      self._ring[pos + self._num_frames] = frame
+      self.frame_count += 1
+      if (self.frame_count >= self._num_frames and
+          (self.frame_count - self._num_frames) % self._stride_frames == 0):
+        begin = self.frame_count % self._num_frames
+        windows.append(self._ring[begin : begin + self._num_frames].copy())
+        ends.append(self.frame_count)
+    if not windows:
+      return np.zeros([0], dtype=np.int64), None
+    xs = data.normalize_spectrograms(np.stack(windows), self._normalization)
+    probs = self._model.predict(xs[..., np.newaxis], batch_size=len(xs))
+    return np.array(ends, dtype=np.int64), probs
+
+
+def read_chunks(input_path, chunk_samples, input_fs=None):
+  '''Read float audio samples in chunks from a .wav file or from stdin.
+
+  Args:
+    input_path: Path to a .wav file, or '-' for raw little-endian 16-bit
+      mono PCM from stdin.
+    chunk_samples: Number of samples per chunk.
+    input_fs: Sampling frequency in Hz of the raw PCM from stdin.
+
+  Returns:
+    - The sampling frequency in Hz.
+    - A generator of 1D float32 numpy arrays.
+  '''
+  if input_path == '-':
+    if input_fs is None:
+      raise ValueError('--input_fs is required for reading from stdin.')
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+
+    def generate_stdin():
+      while True:
+        chunk = stdin.read(chunk_samples * 2)
+        if not chunk:
+          return
+        yield prep_wavs.int16_to_floats(
+            np.frombuffer(chunk[:len(chunk) // 2 * 2], dtype='<i2'))
+
+    return input_fs, generate_stdin()
+
+  fs, signal = prep_wavs.read_as_int16(input_path)
+
+  def generate_wav():
+    for i in range(0, len(signal), chunk_samples):
+      yield prep_wavs.int16_to_floats(signal[i : i + chunk_samples])
+
+  return fs, generate_wav()
+
+
+def main():
+  model, metadata = infer.load_model(FLAGS.model_path, FLAGS.metadata_path,
+                                     engine=FLAGS.engine)
+  words = metadata['words']
+  recognizer = StreamingRecognizer(
+      model, metadata, frame_size=FLAGS.frame_size,
+      stride_frames=FLAGS.stride_frames,
+      smoothing_time_constant=FLAGS.smoothing_time_constant)
+
+  fs, chunks = read_chunks(FLAGS.input_path, FLAGS.chunk_samples,
+                           input_fs=FLAGS.input_fs)
+  resampler = None
+  if fs != FLAGS.target_fs:
+    resampler = StreamingResampler(fs, FLAGS.target_fs)
+
+  out_file = open(FLAGS.output, 'wt') if FLAGS.output else sys.stdout
+  writer = csv.writer(out_file)
+  writer.writerow(['time_sec', 'word', 'probability'])
+  frame_sec = FLAGS.frame_size / FLAGS.target_fs
+  num_samples = 0
+  num_windows = 0
+  t0 = time.time()
+
+  def process(samples):
+    ends, probs = recognizer.push(samples)
+    for end, p in zip(ends, probs if probs is not None else []):
+      top = int(np.argmax(p))
+      if FLAGS.threshold is not None and (
+          words[top] in _NON_WORD_LABELS or p[top] < FLAGS.threshold):
+        continue
+      writer.writerow(['%.3f' % (end * frame_sec), words[top],
+                       '%.6f' % p[top]])
+    return len(ends)
+
+  for chunk in chunks:
+    num_samples += len(chunk)
+    if resampler is not None:
+      chunk = resampler.push(chunk)
+    num_windows += process(chunk)
+  if resampler is not None:
+    num_windows += process(resampler.flush())
+  elapsed = time.time() - t0
+  if FLAGS.output:
+    out_file.close()
+
+  audio_sec = num_samples / fs
+  print('Processed %.1f s of audio (%d model runs) in %.1f s: '
+        '%.1fx real time' %
+        (audio_sec, num_windows, elapsed, audio_sec / max(elapsed, 1e-9)),
+        file=sys.stderr)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      'Streaming speech-command recognition over long audio.')
+  parser.add_argument(
+      'input_path', type=str,
+      help='Path to a .wav file, or "-" for raw 16-bit little-endian mono '
+      'PCM from stdin (see --input_fs).')
+  parser.add_argument(
+      '--model_path', type=str, default='speech_command_browser.h5',
+      help='Path to the model saved by model.py.')
+  parser.add_argument(
+      '--metadata_path', type=str, default='metadata.json',
+      help='Path to the metadata.json saved by model.py.')
+  parser.add_argument(
+      '--engine', type=str, default='keras', choices=infer.ENGINES,
+      help='Run the model with Keras, or in NumPy without importing Keras '
+      'and TensorFlow (see numpy_model.py).')
+  parser.add_argument(
+      '--input_fs', type=int, default=None,
+      help='Sampling frequency of the PCM from stdin in Hz.')
+  parser.add_argument(
+      '--target_fs', type=int, default=44100,
+      help='Sampling frequency of the training data in Hz. Other input '
+      'frequencies are resampled with a streaming polyphase filter.')
+  parser.add_argument(
+      '--frame_size', type=int, default=1024,
+      help='Frame size at target frequency, as in prep_wavs.py.')
+  parser.add_argument(
+      '--stride_frames', type=int, default=11,
+      help='Run the model every this many frames (11 frames are about '
+      '0.25 s at 44.1 kHz).')
+  parser.add_argument(
+      '--smoothing_time_constant', type=float, default=0.0,
+      help='smoothingTimeConstant of the AnalyserNode. '
+      'speech-command-recognizer.js uses 0.0.')
+  parser.add_argument(
+      '--chunk_samples', type=int, default=44100,
+      help='Number of input samples to read at a time.')
+  parser.add_argument(
+      '--threshold', type=float, default=None,
+      help='If specified, write only the windows whose top word is a word '
+      '(not _background_noise_ or _unknown_) with at least this '
+      'probability.')
+  parser.add_argument(
+      '--output', type=str, default=None,
+      help='Optional path to write the recognitions (CSV) to. If not '
+      'specified, they are printed.')
+  FLAGS, _ = parser.parse_known_args()
+
+  main()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Parallel hyperparameter sweep of the model of model.py.
+
+Every combination of `--architectures`, `--batch_sizes` and
+`--learning_rates` is a trial. The trials run in a pool of
+`--num_workers` processes, each with `--num_threads_per_trial` threads (and,
+with `--pin_cpus`, pinned to as many CPUs).
+
+The dataset is preprocessed once, into the cache of `data.load_dataset()`.
+Every trial then memory-maps the same cached `xs` and labels read-only, so
+the page cache holds one copy of the dataset for all the trials. The
+validation split (the last 10% of the shuffled cache) is the same for all
+the trials.
+
+With early stopping, a trial is stopped when, after
+`--early_stopping_grace_epochs` epochs, its best validation accuracy is
+more than `--early_stopping_margin` below the median of the best validation
+accuracies of the other trials after as many epochs (the median stopping
+rule).
+
+Usage example:
+
+```sh
+python sweep.py \
+    --include_words down,left,right,up \
+    --architectures default,compact \
+    --batch_sizes 32,64,128 --learning_rates 0.003,0.01,0.03 \
+    --num_threads_per_trial 2 --pin_cpus \
+    path/to/combined/data/train 232 path/to/sweep
+```
+
+The output directory gets `results.csv` (one row per trial, sorted by best
+validation accuracy), `history.csv` (the validation accuracy of every epoch
+of every trial against the wall-clock time) and, for every trial, a
+`trial_NNN/` directory with its `speech_command_browser.h5` and
+`metadata.json`, which can be compared with `model_report.py`. Both CSV files
+are rewritten after every trial. A trial that raises an exception (e.g., runs
+out of memory) is recorded with the status `failed` and the error, and the
+sweep goes on.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+import numpy as np
+
+import data
+
+# Keras and TensorFlow (through model.py) are imported only in the trial
+# processes, after their numbers of threads have been set.
+
+_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'OPENBLAS_NUM_THREADS')
+
+_RESULT_COLUMNS = ('trial', 'architecture', 'batch_size', 'learning_rate',
+                   'status', 'epochs', 'stopped_early', 'best_val_acc',
+                   'final_val_acc', 'seconds', 'error')
+_HISTORY_COLUMNS = ('trial', 'epoch', 'seconds', 'sweep_seconds', 'loss',
+                    'acc', 'val_loss', 'val_acc')
+
+# State of a trial process, set by `_init_worker()`.
+_cpu_slots = None
+_progress = None
+_config = None
+
+
+def make_trials(architectures, batch_sizes, learning_rates):
+  '''Make the grid of trials.
+
+  Returns:
+    A `list` of trial `dict`s, with the keys `trial` (the index of the
+    trial), `architecture`, `batch_size` and `learning_rate`.
+  '''
+  return [{'trial': i,
+           'architecture': architecture,
+           'batch_size': batch_size,
+           'learning_rate': learning_rate}
+          for i, (architecture, batch_size, learning_rate) in enumerate(
+              itertools.product(architectures, batch_sizes, learning_rates))]
+
+
+def should_stop(val_accs, other_val_accs, grace_epochs, margin,
+                min_trials=3):
+  '''Decide whether to stop a trial, with the median stopping rule.
+
+  Args:
+    val_accs: Validation accuracies of the trial so far, one per epoch.
+    other_val_accs: Validation accuracies of the other trials so far, as
+      `list`s.
+    grace_epochs: Never stop a trial before this many epochs.
+    margin: Stop only if the best accuracy of the trial is below the median
+      by more than this.
+    min_trials: Minimum number of other trials that have run as many epochs
+      for the median to be used.
+
+  Returns:
+    Whether to stop the trial.
+  '''
+  num_epochs = len(val_accs)
+  if not num_epochs or num_epochs < grace_epochs:
+    return False
+  others = [max(accs[:num_epochs]) for accs in other_val_accs
+            if len(accs) >= num_epochs]
+  if len(others) < min_trials:
+    return False
+  return max(val_accs) < np.median(others) - margin
+
+
+def get_cpu_slots(num_workers, num_threads, pin_cpus):
+  '''Assign CPUs to the workers, round-robin over the available CPUs.
+
+  Returns:
+    A `list` of `num_workers` `list`s of CPU indices, or of `None`s if
+    `pin_cpus` is false or pinning is not supported on this platform.
+  '''
+  if not pin_cpus or not hasattr(os, 'sched_setaffinity'):
+    return [None] * num_workers
+  cpus = sorted(os.sched_getaffinity(0))
+  return [sorted(set(cpus[(i * num_threads + j) % len(cpus)]
+                     for j in range(num_threads)))
+          for i in range(num_workers)]
+
+
+def _init_worker(cpu_slots, progress, config):
+  global _cpu_slots, _progress, _config
+  _cpu_slots = cpu_slots
+  _progress = progress
+  _config = config
+
+
+def _run_trial(trial):
+  '''Run a trial and get its result row.
+
+  An exception in a trial (e.g., a `MemoryError` or an invalid config) does
+  not stop the sweep. The trial is reported with status 'failed', the error
+  and the epochs it completed before the failure.
+  '''
+  cpus = _cpu_slots.get()
+  result = dict(trial, status='ok', stopped_early=False, error='',
+                history=[])
+  t0 = time.time()
+  try:
+    _train_trial(trial, cpus, result)
+  except Exception as e:
+    traceback.print_exc()
+    result['status'] = 'failed'
+    result['error'] = '%s: %s' % (type(e).__name__, e)
+  finally:
+    _cpu_slots.put(cpus)
+  val_accs = [h['val_acc'] for h in result['history']]
+  result.update({
+      'epochs': len(val_accs),
+      'best_val_acc': max(val_accs) if val_accs else None,
+      'final_val_acc': val_accs[-1] if val_accs else None,
+      'seconds': time.time() - t0,
+  })
+  return result
+
+
+def _train_trial(trial, cpus, result):
+  '''Train the model of a trial in this (worker) process.
+
+  The validation accuracy of every epoch is appended to `result['history']`
+  as it completes, and `result['stopped_early']` is set if the trial is
+  stopped early.
+  '''
+  config = _config
+  if cpus:
+    os.sched_setaffinity(0, cpus)
+  import keras
+  import model
+  model.set_num_threads(config['num_threads'])
+
+  # A cache hit: xs is memory-mapped from the cache written by main().
+  dataset = data.load_dataset(
+      config['data_root'], config['n_fft'], config['include_words'],
+      cache_dir=config['cache_dir'], dtype=config['dtype'],
+      normalization=config['normalization'])
+  trial_model = model.create_model(
+      dataset.xs.shape[1:], len(dataset.words), sparse_labels=True,
+      architecture=trial['architecture'],
+      learning_rate=trial['learning_rate'])
+
+  trial_id = trial['trial']
+  history = result['history']
+  t0 = time.time()
+
+  def on_epoch_end(epoch, logs):
+    # The metrics are named 'acc' in older versions of Keras.
+    entry = {
+        'trial': trial_id,
+        'epoch': epoch + 1,
+        'seconds': time.time() - t0,
+        'sweep_seconds': time.time() - config['sweep_begin_time'],
+        'loss': logs.get('loss'),
+        'acc': logs.get('acc', logs.get('accuracy')),
+        'val_loss': logs.get('val_loss'),
+        'val_acc': logs.get('val_acc', logs.get('val_accuracy')),
+    }
+    history.append(entry)
+    val_accs = [h['val_acc'] for h in history]
+    _progress[trial_id] = val_accs
+    if config['early_stopping'] and should_stop(
+        val_accs,
+        [accs for k, accs in _progress.items() if k != trial_id],
+        config['grace_epochs'], config['margin']):
+      print('Trial %d: stopping early after %d epochs' %
+            (trial_id, epoch + 1))
+      result['stopped_early'] = True
+      trial_model.stop_training = True
+
+  trial_model.fit(dataset.xs,
+                  dataset.labels,
+                  batch_size=trial['batch_size'],
+                  epochs=config['epochs'],
+                  shuffle=True,
+                  validation_split=0.1,
+                  verbose=0,
+                  callbacks=[keras.callbacks.LambdaCallback(
+                      on_epoch_end=on_epoch_end)])
+
+  trial_dir = os.path.join(config['output_dir'], 'trial_%03d' % trial_id)
+  if not os.path.isdir(trial_dir):
+    os.makedirs(trial_dir)
+  trial_model.save(os.path.join(trial_dir, 'speech_command_browser.h5'))
+  with open(os.path.join(trial_dir, 'metadata.json'), 'wt') as f:
+    json.dump({'frameSize': config['n_fft'],
+               'words': dataset.words,
+               'normalization': dataset.normalization,
+               'architecture': trial['architecture'],
+               'batchSize': trial['batch_size'],
+               'learningRate': trial['learning_rate']}, f)
+
+
+def write_results(output_dir, results):
+  '''Write results.csv and history.csv for the trials finished so far.
+
+  The files are written to temporary files first and then renamed, so that
+  they are complete at any time.
+  '''
+  results = sorted(results, key=lambda r: -(r['best_val_acc'] or 0.0))
+  results_path = os.path.join(output_dir, 'results.csv')
+  with open(results_path + '.tmp', 'wt') as f:
+    writer = csv.writer(f)
+    writer.writerow(_RESULT_COLUMNS)
+    for result in results:
+      writer.writerow([result[column] for column in _RESULT_COLUMNS])
+  history_path = os.path.join(output_dir, 'history.csv')
+  with open(history_path + '.tmp', 'wt') as f:
+    writer = csv.writer(f)
+    writer.writerow(_HISTORY_COLUMNS)
+    for result in sorted(results, key=lambda r: r['trial']):
+      for entry in result['history']:
+        writer.writerow([entry[column] for column in _HISTORY_COLUMNS])
+  os.rename(results_path + '.tmp', results_path)
+  os.rename(history_path + '.tmp', history_path)
+
+
+def print_results(results):
+  '''Print the results table, sorted by best validation accuracy.'''
+  results = sorted(results, key=lambda r: -(r['best_val_acc'] or 0.0))
+  print('%5s %-12s %10s %13s %6s %6s %8s %12s %9s' % (
+      'trial', 'architecture', 'batch_size', 'learning_rate', 'status',
+      'epochs', 'stopped', 'best_val_acc', 'seconds'))
+  for result in results:
+    print('%5d %-12s %10d %13g %6s %6d %8s %12.4f %9.1f' % (
+        result['trial'], result['architecture'], result['batch_size'],
+        result['learning_rate'], result['status'], result['epochs'],
+        'yes' if result['stopped_early'] else 'no',
+        result['best_val_acc'] or 0.0, result['seconds']))
+
+
+def main():
+  sweep_begin_time = time.time()
+  include_words = None
+  if FLAGS.include_words:
+    include_words = sorted([w for w in FLAGS.include_words.split(',') if w])
+  trials = make_trials(
+      [a for a in FLAGS.architectures.split(',') if a],
+      [int(b) for b in FLAGS.batch_sizes.split(',') if b],
+      [float(r) for r in FLAGS.learning_rates.split(',') if r])
+  if not os.path.isdir(FLAGS.output_dir):
+    os.makedirs(FLAGS.output_dir)
+  cache_dir = FLAGS.cache_dir or os.path.join(FLAGS.output_dir, 'cache')
+  dtype = np.float16 if FLAGS.float16 else np.float32
+
+  # Preprocess the data once. The trials memory-map it from the cache.
+  dataset = data.load_dataset(
+      FLAGS.data_root, FLAGS.n_fft, include_words, cache_dir=cache_dir,
+      dtype=dtype, normalization=FLAGS.normalization)
+  print('Sweeping %d trials over %d examples' % (len(trials), len(dataset)))
+  del dataset
+
+  num_workers = FLAGS.num_workers or max(
+      1, multiprocessing.cpu_count() // FLAGS.num_threads_per_trial)
+  num_workers = min(num_workers, len(trials))
+  # Inherited by the trial processes, before they import numpy and
+  # TensorFlow.
+  for var in _THREAD_ENV_VARS:
+    os.environ[var] = str(FLAGS.num_threads_per_trial)
+  config = {
+      'data_root': FLAGS.data_root,
+      'n_fft': FLAGS.n_fft,
+      'include_words': include_words,
+      'cache_dir': cache_dir,
+      'dtype': dtype,
+      'normalization': FLAGS.normalization,
+      'num_threads': FLAGS.num_threads_per_trial,
+      'epochs': FLAGS.epochs,
+      'early_stopping': not FLAGS.no_early_stopping,
+      'grace_epochs': FLAGS.early_stopping_grace_epochs,
+      'margin': FLAGS.early_stopping_margin,
+      'output_dir': FLAGS.output_dir,
+      'sweep_begin_time': sweep_begin_time,
+  }
+
+  # Fresh (spawned) processes, one per trial, so that no TensorFlow state
+  # is shared between the trials.
+  context = multiprocessing.get_context('spawn')
+  manager = context.Manager()
+  cpu_slots = manager.Queue()
+  for cpus in get_cpu_slots(num_workers, FLAGS.num_threads_per_trial,
+                            FLAGS.pin_cpus):
+    cpu_slots.put(cpus)
+  print('Using %d worker processes with %d threads each' %
+        (num_workers, FLAGS.num_threads_per_trial))
+  pool = context.Pool(num_workers,
+                      initializer=_init_worker,
+                      initargs=(cpu_slots, manager.dict(), config),
+                      maxtasksperchild=1)
+  results = []
+  try:
+    for result in pool.imap_unordered(_run_trial, trials):
+      if result['status'] == 'failed':
+        print('Trial %d failed after %d epochs (%.1f s): %s' %
+              (result['trial'], result['epochs'], result['seconds'],
+               result['error']))
+      else:
+        print('Trial %d done: best val_acc = %s after %d epochs (%.1f s)' %
+              (result['trial'], result['best_val_acc'], result['epochs'],
+               result['seconds']))
+      results.append(result)
+      # Rewritten after every trial, so that the results of the finished
+      # trials are kept even if the sweep is interrupted.
+      write_results(FLAGS.output_dir, results)
+  finally:
+    pool.close()
+    pool.join()
+    manager.shutdown()
+  print_results(results)
+  print('Wrote results to %s' % FLAGS.output_dir)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      'Parallel hyperparameter sweep of the speech-command model.')
+  parser.add_argument(
+      'data_root', type=str, help='Root directory for data.')
+  parser.add_argument(
+      'n_fft', type=int,
+      help='Number of FFT points (after possible truncation). This is the '
+      'number of frequency points per column of spectrogram.')
+  parser.add_argument(
+      'output_dir', type=str,
+      help='Output directory for the results and the models of the trials.')
+  parser.add_argument(
+      '--include_words', type=str, default=None,
+      help='Optional list of words to include (in addition to _unknown_ '
+      'and _background_noise_), separated with commas. See model.py.')
+  parser.add_argument(
+      '--architectures', type=str, default='default',
+      help='Model architectures to sweep, separated with commas. See '
+      'model.py.')
+  parser.add_argument(
+      '--batch_sizes', type=str, default='64',
+      help='Batch sizes to sweep, separated with commas.')
+  parser.add_argument(
+      '--learning_rates', type=str, default='0.01',
+      help='Learning rates of the SGD optimizer to sweep, separated with '
+      'commas.')
+  parser.add_argument(
+      '--epochs', type=int, default=300,
+      help='Maximum number of epochs per trial.')
+  parser.add_argument(
+      '--num_workers', type=int, default=None,
+      help='Number of trials to run in parallel. Defaults to the number of '
+      'CPUs divided by --num_threads_per_trial.')
+  parser.add_argument(
+      '--num_threads_per_trial', type=int, default=1,
+      help='Number of threads of every trial.')
+  parser.add_argument(
+      '--pin_cpus', action='store_true',
+      help='Pin every trial process to --num_threads_per_trial CPUs (Linux '
+      'only).')
+  parser.add_argument(
+      '--no_early_stopping', action='store_true',
+      help='Run every trial for --epochs epochs.')
+  parser.add_argument(
+      '--early_stopping_grace_epochs', type=int, default=10,
+      help='Never stop a trial early before this many epochs.')
+  parser.add_argument(
+      '--early_stopping_margin', type=float, default=0.05,
+      help='Stop a trial when its best validation accuracy is below the '
+      'median of the other trials by more than this.')
+  parser.add_argument(
+      '--cache_dir', type=str, default=None,
+      help='Directory for the preprocessed data. Defaults to cache/ in the '
+      'output directory.')
+  parser.add_argument(
+      '--float16', action='store_true',
+      help='Store the spectrograms as float16, halving the memory footprint.')
+  parser.add_argument(
+      '--normalization', type=str, default='example',
+      choices=data.NORMALIZATION_MODES,
+      help='Normalization mode of the spectrograms. See model.py.')
+  FLAGS, _ = parser.parse_known_args()
+
+  main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Reader and writer of the TFJSSCDS (.bin) dataset format.
+
+This is the format of `Dataset.serialize()` in
+`@tensorflow-models/speech-commands`, as written by `dat2bin.js` and
+`puppeteer-convert.js`. A .bin file consists of:
+
+  - The 8-byte descriptor `TFJSSCDS`.
+  - The format version, as a little-endian uint32.
+  - The byte length of the manifest, as a little-endian uint32.
+  - The manifest: a UTF-8 JSON array with one spec per example, e.g.,
+    `{"label": "yes", "spectrogramNumFrames": 43,
+    "spectrogramFrameSize": 232}`.
+  - The data: for every example, in the order of the manifest, the
+    float32 spectrogram data, followed by the float32 raw audio samples if
+    the spec has `rawAudioNumSamples`.
+
+Usage example:
+
+```sh
+python tfjsscds.py path/to/data.bin
+```
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import struct
+
+import numpy as np
+
+
+DESCRIPTOR = b'TFJSSCDS'
+VERSION = 1
+
+_HEADER_FORMAT = '<8sII'
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+
+def is_bin_file(path):
+  '''Check whether a file starts with the TFJSSCDS descriptor.'''
+  with open(path, 'rb') as f:
+    return f.read(len(DESCRIPTOR)) == DESCRIPTOR
+
+
+def read_manifest(bin_path):
+  '''Read the manifest of a .bin file, without reading its data.
+
+  Args:
+    bin_path: Path to the .bin file.
+
+  Returns:
+    - The manifest, as a `list` of example spec `dict`s.
+    - The byte offset of the data in the file.
+
+  Raises:
+    ValueError: If the file is not a TFJSSCDS file of a supported version.
+  '''
+  with open(bin_path, 'rb') as f:
+    header = f.read(_HEADER_SIZE)
+    if len(header) < _HEADER_SIZE:
+      raise ValueError('File is too short for a TFJSSCDS header: %s' %
+                       bin_path)
+    descriptor, version, manifest_length = struct.unpack(
+        _HEADER_FORMAT, header)
+    if descriptor != DESCRIPTOR:
+      raise ValueError('Not a TFJSSCDS file: %s' % bin_path)
+    if version != VERSION:
+      raise ValueError('Unsupported TFJSSCDS version %d in %s' %
+                       (version, bin_path))
+    manifest = json.loads(f.read(manifest_length).decode('utf-8'))
+  return manifest, _HEADER_SIZE + manifest_length
+
+
+def example_offsets(manifest):
+  '''Calculate where the data of every example begins.
+
+  Args:
+    manifest: The manifest of a .bin file. See `read_manifest()`.
+
+  Returns:
+    - The begin offsets of the spectrograms, in number of float32 values
+      from the beginning of the data, as an int64 numpy array.
+    - The total number of float32 values in the data.
+  '''
+  sizes = np.array(
+      [spec['spectrogramNumFrames'] * spec['spectrogramFrameSize'] +
+       spec.get('rawAudioNumSamples', 0) for spec in manifest],
+      dtype=np.int64)
+  offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+  return offsets[:-1], int(offsets[-1])
+
+
+def read_bin(bin_path):
+  '''Memory-map a .bin file.
+
+  Only the header is parsed. The data is not copied or converted. It is
+  read from disk only when it is accessed.
+
+  Args:
+    bin_path: Path to the .bin file.
+
+  Returns:
+    - The manifest, as a `list` of example spec `dict`s.
+    - The data, as a read-only 1D float32 numpy array.
+    - The begin offsets of the spectrograms in the data. See
+      `example_offsets()`.
+
+  Raises:
+    ValueError: If the size of the data does not match the manifest.
+  '''
+  manifest, data_offset = read_manifest(bin_path)
+  offsets, num_values = example_offsets(manifest)
+  data_size = os.path.getsize(bin_path) - data_offset
+  if data_size != num_values * 4:
+    raise ValueError(
+        'Expected %d bytes of data in %s, but found %d' %
+        (num_values * 4, bin_path, data_size))
+  if not num_values:
+    return manifest, np.zeros([0], dtype=np.float32), offsets
+  data = np.memmap(bin_path, dtype='<f4', mode='r', offset=data_offset,
+                   shape=(num_values,))
+  return manifest, data, offsets
+
+
+def read_examples(bin_path):
+  '''Read the examples of a .bin file as memory-mapped arrays.
+
+  Args:
+    bin_path: Path to the .bin file.
+
+  Returns:
+    A `list` of example `dict`s, in the order of the file. Every example
+    has a `label` and a `spectrogram` of shape `[num_frames, frame_size]`,
+    and optionally a `key_frame_index`, or `raw_audio` and
+    `sample_rate_hz`. The arrays are read-only views of the file.
+  '''
+  manifest, data, offsets = read_bin(bin_path)
+  examples = []
+  for spec, offset in zip(manifest, offsets):
+    num_frames = spec['spectrogramNumFrames']
+    frame_size = spec['spectrogramFrameSize']
+    end = offset + num_frames * frame_size
+    example = {
+        'label': spec['label'],
+        'spectrogram': data[offset : end].reshape([num_frames, frame_size]),
+    }
+    if 'spectrogramKeyFrameIndex' in spec:
+      example['key_frame_index'] = spec['spectrogramKeyFrameIndex']
+    if 'rawAudioNumSamples' in spec:
+      example['raw_audio'] = data[end : end + spec['rawAudioNumSamples']]
+      example['sample_rate_hz'] = spec['rawAudioSampleRateHz']
+    examples.append(example)
+  return examples
+
+
+def write_bin(bin_path, examples):
+  '''Write examples to a .bin file.
+
+  The file can be loaded by `Dataset` of `@tensorflow-models/speech-commands`
+  and by `read_bin()`.
+
+  Args:
+    bin_path: Path to the output .bin file.
+    examples: Examples as `dict`s, in the format of `read_examples()`.
+
+  Returns:
+    Number of examples written.
+  '''
+  examples = list(examples)
+  manifest = []
+  for example in examples:
+    shape = np.shape(example['spectrogram'])
+    if len(shape) != 2:
+      raise ValueError(
+          'Expected spectrogram of shape [num_frames, frame_size], '
+          'but got shape %s' % (shape,))
+    # Same key order as Dataset.serialize().
+    spec = collections.OrderedDict([
+        ('label', example['label']),
+        ('spectrogramNumFrames', int(shape[0])),
+        ('spectrogramFrameSize', int(shape[1])),
+    ])
+    if example.get('key_frame_index') is not None:
+      spec['spectrogramKeyFrameIndex'] = int(example['key_frame_index'])
+    if example.get('raw_audio') is not None:
+      spec['rawAudioNumSamples'] = int(np.size(example['raw_audio']))
+      spec['rawAudioSampleRateHz'] = example['sample_rate_hz']
+    manifest.append(spec)
+
+  manifest_bytes = json.dumps(
+      manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+  with open(bin_path, 'wb') as f:
+    f.write(struct.pack(_HEADER_FORMAT, DESCRIPTOR, VERSION,
+                        len(manifest_bytes)))
+    f.write(manifest_bytes)
+    for example in examples:
+      np.asarray(example['spectrogram'], dtype='<f4').tofile(f)
+      if example.get('raw_audio') is not None:
+        np.asarray(example['raw_audio'], dtype='<f4').tofile(f)
+  return len(examples)
+
+
+def main():
+  for bin_path in FLAGS.bin_paths:
+    manifest, data, _ = read_bin(bin_path)
+    counts = collections.Counter(spec['label'] for spec in manifest)
+    shapes = collections.Counter(
+        (spec['spectrogramNumFrames'], spec['spectrogramFrameSize'])
+        for spec in manifest)
+    print('%s: %d examples, %d float32 values' %
+          (bin_path, len(manifest), len(data)))
+    for label in sorted(counts):
+      print('  label %s: %d' % (label, counts[label]))
+    for shape in sorted(shapes):
+      print('  spectrogram shape %s: %d' % (list(shape), shapes[shape]))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      'Print a summary of TFJSSCDS (.bin) dataset files.')
+  parser.add_argument(
+      'bin_paths', type=str, nargs='+', help='Paths to .bin files.')
+  FLAGS, _ = parser.parse_known_args()
+
+  main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Convert the output of prep_wavs.py into combined .dat files, in Python.
+
+This is a replacement for `puppeteer-convert.js` that does not need a
+browser. The WebAudio AnalyserNode FFT is replicated by `spectrogram.py`:
+frame `i` of a recording is the spectrum of the `2 * n_fft` samples before
+time `(i + 1) * n_fft`, as seen by `getFloatFrequencyData()` when the
+rendering is suspended at that time. The spectra differ from the browser's
+by a constant offset in dB, which `data.py` normalizes away.
+
+Usage example:
+
+```sh
+python webaudio_convert.py --num_workers 8 \
+    path/to/converted/data path/to/combined/data
+```
+
+Every leaf directory of raw float32 .dat waveforms (e.g., `train/yes/0/`)
+becomes one combined .dat file (e.g., `train/yes/0.dat`). Every
+`spectrograms.npy` written by `prep_wavs.py` (e.g., `train/yes/`) becomes
+`spectrograms.dat` in the corresponding output directory. In a combined .dat
+file, every spectrogram is followed by one NaN frame, as expected by
+`data.py`.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import glob
+import multiprocessing
+import os
+
+import numpy as np
+
+import spectrogram
+
+
+_SPECTROGRAMS_NPY = 'spectrograms.npy'
+
+
+def append_combined(f, spectrograms):
+  '''Append spectrograms to a combined .dat file.
+
+  Args:
+    f: A file object, opened for binary writing.
+    spectrograms: float32 numpy array of shape `[N, num_frames, n_fft_out]`.
+  '''
+  num_spectrograms, num_frames, n_fft_out = spectrograms.shape
+  out = np.full([num_spectrograms, num_frames + 1, n_fft_out], np.nan,
+                dtype=np.float32)
+  out[:, :num_frames] = spectrograms
+  out.tofile(f)
+
+
+def smooth_decibel_spectrograms(spectrograms, smoothing_time_constant):
+  '''Apply AnalyserNode smoothing to spectrograms in dB.
+
+  See `spectrogram.smooth_magnitudes()`.
+
+  Args:
+    spectrograms: float32 numpy array of shape
+      `[N, num_frames, n_fft_out]`, in dB.
+    smoothing_time_constant: The `smoothingTimeConstant` of AnalyserNode.
+
+  Returns:
+    The smoothed spectrograms in dB, as a float32 numpy array.
+  '''
+  if not smoothing_time_constant:
+    return spectrograms
+  magnitudes = np.power(10.0, spectrograms / 20.0, dtype=np.float32)
+  magnitudes = spectrogram.smooth_magnitudes(
+      magnitudes, smoothing_time_constant)
+  return 20 * np.log10(magnitudes)
+
+
+def convert_waveform_dir(dat_dir,
+                         out_path,
+                         n_fft,
+                         n_fft_out,
+                         smoothing_time_constant=0.0,
+                         batch_size=64):
+  '''Convert a directory of raw waveform .dat files into a combined .dat file.
+
+  The waveforms are grouped by length, and the spectrograms of every group
+  are computed in batches of `batch_size`. The spectrograms are written in
+  the sorted order of the .dat files.
+
+  Args:
+    dat_dir: Directory of .dat files, each holding a float32 waveform.
+    out_path: Path to the output combined .dat file.
+    n_fft: Hop size in number of samples. Half the AnalyserNode `fftSize`.
+    n_fft_out: Number of frequency bins to keep.
+    smoothing_time_constant: The `smoothingTimeConstant` of AnalyserNode.
+    batch_size: Maximum number of waveforms to transform at once.
+
+  Returns:
+    Number of spectrograms written.
+  '''
+  dat_paths = sorted(glob.glob(os.path.join(dat_dir, '*.dat')))
+  waveforms = [np.fromfile(dat_path, dtype=np.float32)
+               for dat_path in dat_paths]
+  lengths = np.array([len(waveform) for waveform in waveforms])
+  spectrograms = [None] * len(waveforms)
+  for length in np.unique(lengths):
+    if length < n_fft:
+      print('WARNING: Skipping %d waveforms shorter than n_fft: %d' %
+            (np.sum(lengths == length), length))
+      continue
+    indices = np.flatnonzero(lengths == length)
+    for i in range(0, len(indices), batch_size):
+      batch_indices = indices[i : i + batch_size]
+      batch_spectrograms = spectrogram.waveforms_to_spectrograms(
+          [waveforms[k] for k in batch_indices], n_fft, n_fft_out,
+          smoothing_time_constant=smoothing_time_constant)
+      for k, spec in zip(batch_indices, batch_spectrograms):
+        spectrograms[k] = spec
+
+  num_written = 0
+  with open(out_path, 'wb') as f:
+    for spec in spectrograms:
+      if spec is not None:
+        append_combined(f, spec[np.newaxis])
+        num_written += 1
+  return num_written
+
+
+def convert_spectrograms_npy(npy_path,
+                             out_path,
+                             n_fft_out,
+                             smoothing_time_constant=0.0,
+                             batch_size=256):
+  '''Convert a spectrograms.npy file of prep_wavs.py into a combined .dat file.
+
+  The spectrograms are memory-mapped and copied in batches of `batch_size`.
+
+  Args:
+    npy_path: Path to the spectrograms.npy file.
+    out_path: Path to the output combined .dat file.
+    n_fft_out: Expected number of frequency bins of the spectrograms.
+    smoothing_time_constant: The `smoothingTimeConstant` of AnalyserNode.
+    batch_size: Maximum number of spectrograms to process at once.
+
+  Returns:
+    Number of spectrograms written.
+
+  Raises:
+    ValueError: If the number of frequency bins is not `n_fft_out`.
+  '''
+  spectrograms = np.load(npy_path, mmap_mode='r')
+  if spectrograms.ndim != 3 or spectrograms.shape[2] != n_fft_out:
+    raise ValueError(
+        'Expected spectrograms of shape [N, num_frames, %d] in %s, '
+        'but got shape %s' % (n_fft_out, npy_path, spectrograms.shape))
+  with open(out_path, 'wb') as f:
+    for i in range(0, len(spectrograms), batch_size):
+      append_combined(f, smooth_decibel_spectrograms(
+          np.asarray(spectrograms[i : i + batch_size], dtype=np.float32),
+          smoothing_time_constant))
+  return len(spectrograms)
+
+
+def find_conversion_tasks(input_dir, output_dir):
+  '''Find the inputs to convert under a directory.
+
+  Args:
+    input_dir: Output directory of prep_wavs.py, or a subdirectory of it.
+    output_dir: Output directory for the combined .dat files.
+
+  Returns:
+    A `list` of (input path, output .dat path) tuples. The input path is
+    either a directory of .dat waveforms or a spectrograms.npy file.
+  '''
+  tasks = []
+  for dir_path, dir_names, file_names in os.walk(input_dir):
+    dir_names.sort()
+    rel_path = os.path.relpath(dir_path, input_dir)
+    if _SPECTROGRAMS_NPY in file_names:
+      tasks.append((os.path.join(dir_path, _SPECTROGRAMS_NPY),
+                    os.path.normpath(os.path.join(
+                        output_dir, rel_path, 'spectrograms.dat'))))
+    if any(file_name.endswith('.dat') for file_name in file_names):
+      if rel_path == os.curdir:
+        rel_path = os.path.basename(os.path.abspath(input_dir))
+      tasks.append((dir_path, os.path.join(output_dir, rel_path + '.dat')))
+  return tasks
+
+
+def _convert(task,
+             n_fft,
+             n_fft_out,
+             smoothing_time_constant=0.0,
+             overwrite=False):
+  '''Run one conversion task of `find_conversion_tasks()`.'''
+  in_path, out_path = task
+  if os.path.exists(out_path) and not overwrite:
+    raise ValueError('File already exists: %s' % out_path)
+  out_dir = os.path.dirname(out_path)
+  if out_dir and not os.path.isdir(out_dir):
+    try:
+      os.makedirs(out_dir)
+    except OSError:
+      # Created concurrently by another worker.
+      if not os.path.isdir(out_dir):
+        raise
+  if os.path.isdir(in_path):
+    num_spectrograms = convert_waveform_dir(
+        in_path, out_path, n_fft, n_fft_out,
+        smoothing_time_constant=smoothing_time_constant)
+  else:
+    num_spectrograms = convert_spectrograms_npy(
+        in_path, out_path, n_fft_out,
+        smoothing_time_constant=smoothing_time_constant)
+  return in_path, out_path, num_spectrograms
+
+
+def _convert_task(args):
+  return _convert(*args)
+
+
+def main():
+  tasks = find_conversion_tasks(FLAGS.input_path, FLAGS.output_path)
+  if not tasks:
+    raise ValueError(
+        'Cannot find any .dat or %s files in %s' %
+        (_SPECTROGRAMS_NPY, FLAGS.input_path))
+  task_args = [(task, FLAGS.n_fft, FLAGS.n_fft_out,
+                FLAGS.smoothing_time_constant, FLAGS.overwrite)
+               for task in tasks]
+
+  pool = None
+  if FLAGS.num_workers > 1:
+    print('Using %d worker processes' % FLAGS.num_workers)
+    pool = multiprocessing.Pool(FLAGS.num_workers)
+    results = pool.imap_unordered(_convert_task, task_args)
+  else:
+    results = map(_convert_task, task_args)
+  total = 0
+  for in_path, out_path, num_spectrograms in results:
+    print('%s --> %s: %d spectrograms' % (in_path, out_path, num_spectrograms))
+    total += num_spectrograms
+  if pool is not None:
+    pool.close()
+    pool.join()
+  print('Wrote %d spectrograms to %d files' % (total, len(tasks)))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      'Convert the output of prep_wavs.py into combined .dat files with '
+      'the equivalent of the WebAudio AnalyserNode FFT, without a browser.')
+  parser.add_argument(
+      'input_path', type=str,
+      help='Output directory of prep_wavs.py, or a subdirectory of it.')
+  parser.add_argument(
+      'output_path', type=str,
+      help='Output directory for the combined .dat files.')
+  parser.add_argument(
+      '--n_fft', type=int, default=1024,
+      help='Number of FFT points per frame. Half the AnalyserNode fftSize.')
+  parser.add_argument(
+      '--n_fft_out', type=int, default=232,
+      help='Truncation length for each spectrum of the spectrogram.')
+  parser.add_argument(
+      '--smoothing_time_constant', type=float, default=0.0,
+      help='smoothingTimeConstant of the AnalyserNode. puppeteer-convert.js '
+      'uses 0.0. The WebAudio default is 0.8.')
+  parser.add_argument(
+      '--num_workers', type=int, default=1,
+      help='Number of worker processes. Every output file is converted by a '
+      'single worker.')
+  parser.add_argument(
+      '--overwrite', action='store_true',
+      help='Overwrite existing output files.')
+  FLAGS, _ = parser.parse_known_args()
+
+  main()